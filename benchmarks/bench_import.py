@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark the time of ``import m2r``.
+
+Usage: python benchmarks/bench_import.py [--m2r DIR] [--budget MS]
+
+``import m2r`` is run in fresh interpreters with ``-X importtime`` and the
+best cumulative time of the ``m2r`` module (including mistune and docutils)
+is reported with its slowest imports. Exits with status 1 when the time is
+over the budget, or when a module which should be imported on first use
+(the sphinx extension, the server and the command line parser) is imported
+by ``import m2r``.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+
+from common import root
+
+# modules which `import m2r` must not import
+DEFERRED = ['argparse', 'asyncio', 'concurrent.futures.process',
+            'docutils.parsers.rst', 'docutils.statemachine', 'http.client',
+            'http.server', 'json', 'sphinx']
+
+CODE = '''\
+import sys
+sys.path.insert(0, {!r})
+import m2r
+print(' '.join(sys.modules))
+'''
+
+
+def import_once(directory):
+    """Return ``{module: (self us, cumulative us)}`` of ``import m2r`` and
+    the names of all imported modules."""
+    p = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CODE.format(directory)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True)
+    times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative))
+    return times, p.stdout.split()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the time of "import m2r".')
+    parser.add_argument('--m2r', metavar='DIR', default=root,
+                        help='directory of m2r.py under the benchmark')
+    parser.add_argument('--budget', type=float, default=100, metavar='MS',
+                        help='maximum milliseconds of "import m2r" '
+                             '(default: 100)')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of interpreters to run (default: 10)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of the slowest imports to show')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # measure as installed, without compiling the source
+    compileall.compile_file(os.path.join(args.m2r, 'm2r.py'), quiet=1)
+    best = None
+    for _ in range(args.repeat):
+        times, modules = import_once(os.path.abspath(args.m2r))
+        if best is None or times['m2r'][1] < best[0]['m2r'][1]:
+            best = times, modules
+    times, modules = best
+    for name, (self_us, cumulative) in sorted(
+            times.items(), key=lambda item: -item[1][0])[:args.top]:
+        print('{:<36} {:>8.1f} ms {:>8.1f} ms'.format(
+            name, self_us / 1000, cumulative / 1000))
+    failed = False
+    total = times['m2r'][1] / 1000
+    print('import m2r: {:.1f} ms (budget: {:.0f} ms)'.format(
+        total, args.budget))
+    if total > args.budget:
+        print('import m2r is slower than the budget')
+        failed = True
+    for name in DEFERRED:
+        if name in modules:
+            print('{} is imported by import m2r'.format(name))
+            failed = True
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark conversion of deeply nested and wide lists and block quotes.
+
+Usage: python benchmarks/bench_lists.py [--m2r PATH]
+
+The converter under the benchmark is imported from ``--m2r``, or from the
+repository root by default.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import timeit
+
+from common import load_m2r
+
+
+def deep_list(depth, width, ordered=False, level=0):
+    """Return a list nested ``depth`` levels with ``width`` items each."""
+    indent = ' ' * 4 * level
+    mark = '1. ' if ordered else '* '
+    lines = []
+    for i in range(width):
+        lines.append('{}{}item {} at level {}'.format(indent, mark, i, level))
+        if level + 1 < depth:
+            lines.append(deep_list(depth, width, not ordered, level + 1))
+    return '\n'.join(lines)
+
+
+def wide_list(items, loose=False):
+    """Return a flat list of ``items`` items."""
+    sep = '\n\n' if loose else '\n'
+    return sep.join('* item {} with *emphasis*'.format(i)
+                    for i in range(items))
+
+
+def nested_quotes(depth, paragraphs):
+    """Return block quotes and lists alternately nested ``depth`` levels."""
+    lines = ['paragraph {}\n'.format(i) for i in range(paragraphs)]
+    for level in range(depth):
+        if level % 2:
+            lines = ['* item'] + ['  ' + line if line.strip() else line
+                                  for line in lines]
+        else:
+            lines = ['> ' + line if line.strip() else '>' for line in lines]
+    return '\n'.join(lines)
+
+
+CASES = [
+    ('deep: 8 levels x 3 items', lambda: deep_list(8, 3)),
+    ('deep: 6 levels x 5 items', lambda: deep_list(6, 5)),
+    ('wide: 20000 items', lambda: wide_list(20000)),
+    ('wide: 20000 loose items', lambda: wide_list(20000, loose=True)),
+    ('quotes in lists: 8 levels', lambda: nested_quotes(8, 3000)),
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark conversion of nested lists and block quotes.')
+    parser.add_argument('--m2r', metavar='PATH',
+                        help='path to m2r.py under the benchmark')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    m2r = load_m2r(args.m2r)
+    for name, make in CASES:
+        text = make()
+        timer = timeit.Timer(lambda: m2r.convert(text))
+        number = 3
+        best = min(timer.repeat(repeat=3, number=number)) / number
+        print('{:<28} {:>8.1f} KB {:>9.3f} s'.format(
+            name, len(text) / 1024, best))
+
+
+if __name__ == '__main__':
+    main()
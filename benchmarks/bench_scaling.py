@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark how conversion time scales with the input size.
+
+Usage: python benchmarks/bench_scaling.py [--m2r PATH] [--sizes SIZES]
+
+Synthetic documents of ``benchmarks/bench_suite.py`` from 10 MB to 100 MB
+are converted once each, and the time per MB is compared with that of the
+smallest document. Exits with status 1 when the time per MB of a larger
+document is over ``--tolerance`` times that of the smallest, that is, when
+the conversion does not scale linearly.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import sys
+import time
+
+from bench_suite import MB, synthetic_doc
+from common import load_m2r
+
+
+def parse_size(value):
+    """Return bytes of a size like ``10MB``, ``512KB`` or ``1000``."""
+    value = value.strip().upper()
+    for unit, size in (('MB', MB), ('KB', 1024)):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * size)
+    return int(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the scaling of conversion time.')
+    parser.add_argument('--m2r', metavar='PATH',
+                        help='path to m2r.py under the benchmark')
+    parser.add_argument('--sizes', default='10MB,20MB,50MB,100MB',
+                        help='comma-separated sizes of the documents '
+                             '(default: 10MB,20MB,50MB,100MB)')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='maximum ratio of the time per MB to that of '
+                             'the smallest document (default: 1.5)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    m2r = load_m2r(args.m2r)
+    sizes = sorted(parse_size(size) for size in args.sizes.split(','))
+    base = None
+    failed = False
+    for size in sizes:
+        text = synthetic_doc(size)
+        mb = len(text.encode('utf-8')) / MB
+        start = time.perf_counter()
+        m2r.convert(text)
+        seconds = time.perf_counter() - start
+        del text
+        if base is None:
+            base = seconds / mb
+        ratio = seconds / mb / base
+        print('{:>8.1f} MB {:>10.2f} s {:>8.2f} MB/s {:>6.2f}x per MB'.format(
+            mb, seconds, mb / seconds, ratio))
+        sys.stdout.flush()
+        if ratio > args.tolerance:
+            print('conversion of {:.1f} MB is not linear'.format(mb))
+            failed = True
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
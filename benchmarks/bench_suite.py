@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark suite of m2r.
+
+Usage: python benchmarks/bench_suite.py [options]
+
+Cases are grouped as follows:
+
+* ``block``: block lexer (``RestBlockLexer``) on each block construct
+* ``inline``: inline lexer (``RestInlineLexer``) on each inline construct
+* ``render``: renderer (``RestRenderer``) methods
+* ``corpus``: conversion of synthetic documents from 1 KB to 100 MB
+* ``scaled``: conversion of ``tests/test.md`` repeated 1 to 1000 times
+
+Each case reports the best time of a run, runs (documents) per second, MB
+per second of the input and peak memory allocated by a run. Results can be
+saved as a baseline by ``--save`` and compared with it by ``--compare``,
+which exits with status 1 when some case is slower than the threshold.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from common import load_m2r, root
+
+MB = 1024 * 1024
+SIZES = [
+    ('1KB', 1024),
+    ('10KB', 10 * 1024),
+    ('100KB', 100 * 1024),
+    ('1MB', MB),
+    ('10MB', 10 * MB),
+    ('100MB', 100 * MB),
+]
+SCALES = [1, 10, 100, 1000]
+
+# a sample of each rule, repeated to make the input of the rule's case
+BLOCK_SAMPLES = {
+    'directive': '.. note::\n   :class: sample\n\n   directive body\n\n',
+    'oneline_directive': '.. _label:\n\n',
+    'rest_code_block': 'code follows::\n\n    code\n\n',
+    'newline': '\n\n\n',
+    'hrule': '* * *\n\n',
+    'block_code': '    code line\n    another line\n\n',
+    'fences': '```python\nprint(1)\n```\n\n',
+    'heading': '## Heading\n\n',
+    'nptable': 'a | b\n--- | ---\n1 | 2\n\n',
+    'lheading': 'Heading\n-------\n\n',
+    'block_quote': '> quoted\n> text\n\n',
+    'list_block': '* item\n* item\n  1. nested\n\n',
+    'block_html': '<div>\nhtml\n</div>\n\n',
+    'def_links': '[label]: http://example.com/ "title"\n',
+    'def_footnotes': '[^note]: footnote text\n\n',
+    'table': '| a | b |\n| --- | --- |\n| 1 | 2 |\n\n',
+    'paragraph': 'paragraph text\nsecond line\n\n',
+}
+INLINE_SAMPLES = {
+    'inline_math': '`$E=mc^2$`\n',
+    'image_link': '[![alt](img.png)](http://example.com/) ',
+    'rest_role': ':ref:`label` ',
+    'rest_link': '`label`_ ',
+    'eol_literal_marker': 'text::\n',
+    'escape': '\\* ',
+    'inline_html': '<span>html</span> ',
+    'autolink': '<http://example.com/> ',
+    'url': 'http://example.com/ ',
+    'footnote': '[^note] ',
+    'link': '[text](http://example.com/) ',
+    'reflink': '[text][label] ',
+    'nolink': '[label] ',
+    'double_emphasis': '**strong** ',
+    'emphasis': '*emphasis* ',
+    'code': '`code` ',
+    'linebreak': 'text  \n',
+    'strikethrough': '~~deleted~~ ',
+    'text': 'plain text without markups ',
+}
+# approximate input size of each block and inline case
+SAMPLE_SIZE = 16 * 1024
+# number of calls in a run of each render case
+RENDER_CALLS = 1000
+
+
+def _repeat(sample, size):
+    return sample * max(1, size // len(sample))
+
+
+def block_case(m2r, rule):
+    # trailing newlines are stripped before parsing
+    text = _repeat(BLOCK_SAMPLES[rule], SAMPLE_SIZE) + 'end\n'
+
+    def run():
+        m2r.RestBlockLexer().parse(text)
+    return run, len(text)
+
+
+def inline_case(m2r, rule):
+    text = _repeat(INLINE_SAMPLES[rule], SAMPLE_SIZE)
+    lexer = m2r.RestInlineLexer(m2r.RestRenderer())
+    links = {'label': {'link': 'http://example.com/', 'title': None}}
+
+    def run():
+        lexer.setup(links, {'note': 0})
+        lexer.output(text)
+    return run, len(text)
+
+
+def render_cases(renderer):
+    """Return render cases as ``{name: function}`` with ``renderer``."""
+    r = renderer
+    return {
+        'header': lambda: r.header('Heading text', 2, 'Heading text'),
+        'paragraph': lambda: r.paragraph('paragraph text'),
+        'block_code': lambda: str(r.block_code('code\nlines\n', 'python')),
+        'block_quote': lambda: str(r.block_quote(['\nquoted text\n'])),
+        'list': lambda: str(r.list([r.list_item(['item\n']),
+                                    r.list_item(['item\n'])])),
+        'table': lambda: str(r.table(
+            r.table_row([r.table_cell('a'), r.table_cell('b')]),
+            [r.table_row([r.table_cell('1'), r.table_cell('2')])])),
+        'double_emphasis': lambda: r.double_emphasis('strong'),
+        'emphasis': lambda: r.emphasis('emphasis'),
+        'codespan': lambda: r.codespan('code'),
+        'link': lambda: r.link('http://example.com/', None, 'text'),
+        'image': lambda: r.image('img.png', None, 'alt'),
+        'autolink': lambda: r.autolink('http://example.com/'),
+        'join_inline': lambda: r.join_inline(
+            ['text', r'\ **strong**\ ', ', ', r'\ ``code``\ ', 'text'],
+            True),
+    }
+
+
+def render_case(m2r, name):
+    func = render_cases(m2r.RestRenderer())[name]
+    calls = range(RENDER_CALLS)
+
+    def run():
+        for _ in calls:
+            func()
+    return run, None
+
+
+def synthetic_doc(size, seed=0):
+    """Return a markdown document of about ``size`` bytes, mixing blocks
+    and inline markups at random."""
+    rng = random.Random(seed)
+    words = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+             'eiusmod tempor incididunt ut labore et dolore magna').split()
+    inlines = ['**strong**', '*emphasis*', '`code`', '[link](http://x.org)',
+               ':ref:`label`', '`$x^2$`', '~~deleted~~', '<b>html</b>']
+
+    def sentence():
+        parts = [rng.choice(words) for _ in range(rng.randint(5, 15))]
+        for _ in range(rng.randint(0, 3)):
+            parts.insert(rng.randint(0, len(parts)), rng.choice(inlines))
+        return ' '.join(parts)
+
+    def paragraph():
+        return '\n'.join(sentence() for _ in range(rng.randint(1, 4)))
+
+    def items(mark):
+        return '\n'.join('{} {}'.format(mark, sentence())
+                         for _ in range(rng.randint(2, 6)))
+
+    blocks = [
+        lambda: '{} {}'.format('#' * rng.randint(1, 4), sentence()),
+        paragraph, paragraph, paragraph,
+        lambda: items('*'),
+        lambda: items('1.') + '\n  * ' + sentence(),
+        lambda: '> ' + paragraph().replace('\n', '\n> '),
+        lambda: '```python\n{}\n```'.format(sentence()),
+        lambda: '| a | b |\n| --- | --- |\n| {} | {} |'.format(
+            rng.choice(inlines), sentence()),
+        lambda: '.. note::\n\n   ' + sentence(),
+    ]
+    out = []
+    length = 0
+    while length < size:
+        block = rng.choice(blocks)()
+        out.append(block)
+        length += len(block) + 2
+    return '\n\n'.join(out) + '\n'
+
+
+def corpus_case(m2r, size):
+    text = synthetic_doc(size)
+
+    def run():
+        m2r.convert(text)
+    return run, len(text.encode('utf-8'))
+
+
+def scaled_case(m2r, scale):
+    with open(os.path.join(root, 'tests', 'test.md')) as f:
+        text = f.read() * scale
+
+    def run():
+        m2r.convert(text)
+    return run, len(text.encode('utf-8'))
+
+
+def collect_cases(m2r, max_size):
+    """Return a list of ``(name, factory)``, where ``factory()`` returns a
+    function of a run and the input size in bytes (or None)."""
+    cases = []
+    for rule in m2r.RestBlockLexer.default_rules:
+        if rule not in BLOCK_SAMPLES:
+            continue  # text of list items
+        cases.append(('block.' + rule,
+                      lambda rule=rule: block_case(m2r, rule)))
+    inline = m2r.RestInlineLexer(m2r.RestRenderer())
+    for rule in inline.default_rules:
+        if rule not in INLINE_SAMPLES:
+            continue
+        cases.append(('inline.' + rule,
+                      lambda rule=rule: inline_case(m2r, rule)))
+    for name in render_cases(None):
+        cases.append(('render.' + name,
+                      lambda name=name: render_case(m2r, name)))
+    for label, size in SIZES:
+        if size <= max_size:
+            cases.append(('corpus.' + label,
+                          lambda size=size: corpus_case(m2r, size)))
+    for scale in SCALES:
+        cases.append(('scaled.test_md_x{}'.format(scale),
+                      lambda scale=scale: scaled_case(m2r, scale)))
+    return cases
+
+
+def measure(run, min_time=0.2, repeat=3, memory=True):
+    """Return the best time of ``run()`` and its peak memory in bytes."""
+    best = None
+    for _ in range(repeat):
+        number = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            number += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        t = elapsed / number
+        best = t if best is None else min(best, t)
+        if best * repeat > 10 * min_time:
+            break  # large inputs take long enough for a single run
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def parse_size(value):
+    for label, size in SIZES:
+        if value.upper() == label:
+            return size
+    return int(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run benchmarks of m2r.')
+    parser.add_argument('-k', dest='patterns', action='append', default=[],
+                        help='run cases including this string in the name')
+    parser.add_argument('--m2r', metavar='PATH',
+                        help='path to m2r.py under the benchmark')
+    parser.add_argument('--max-size', type=parse_size, default=MB,
+                        help='largest corpus to run, like 100MB '
+                             '(default: 1MB)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds to measure a case')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure peak memory')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save results to the JSON file as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare results with the baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='ratio of slowdown reported as a regression '
+                             '(default: 0.1)')
+    return parser.parse_args(argv)
+
+
+def format_result(name, result, base=None, threshold=0.1):
+    mb_per_sec = result['mb_per_sec']
+    peak = result['peak_memory']
+    line = '{:<28} {:>10.6f} s {:>10.1f} /s {:>9} MB/s {:>10} KB'.format(
+        name, result['seconds'], result['runs_per_sec'],
+        '-' if mb_per_sec is None else '{:.2f}'.format(mb_per_sec),
+        '-' if peak is None else '{:.0f}'.format(peak / 1024))
+    if base is None:
+        return line, False
+    change = result['seconds'] / base['seconds'] - 1
+    regression = change > threshold
+    line += ' {:>+7.1%}{}'.format(change, '  SLOWER' if regression else '')
+    return line, regression
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    m2r = load_m2r(args.m2r)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    results = {}
+    regressions = 0
+    for name, factory in collect_cases(m2r, args.max_size):
+        if args.patterns and not any(p in name for p in args.patterns):
+            continue
+        run, size = factory()
+        seconds, peak = measure(run, args.min_time,
+                                memory=not args.no_memory)
+        result = results[name] = {
+            'seconds': seconds,
+            'runs_per_sec': 1 / seconds,
+            'mb_per_sec': None if size is None else size / MB / seconds,
+            'peak_memory': peak,
+        }
+        line, regression = format_result(name, result, baseline.get(name),
+                                         args.threshold)
+        regressions += regression
+        print(line)
+        sys.stdout.flush()
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+    if regressions:
+        print('{} cases are slower than the baseline'.format(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark conversion of large markdown tables.
+
+Usage: python benchmarks/bench_tables.py [--m2r PATH]
+
+Tables of 10k, 100k and 1M cells are converted at the top level and inside
+a list item (whose indent is added to every row), and the best time and the
+peak memory allocated by a conversion are reported.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import time
+import tracemalloc
+
+from common import load_m2r
+
+COLUMNS = 10
+
+
+def table(cells, columns=COLUMNS, indent=''):
+    """Return a table of ``cells`` cells in ``columns`` columns."""
+    lines = ['| ' + ' | '.join('col {}'.format(i) for i in range(columns)) +
+             ' |',
+             '|' + '---|' * columns]
+    for row in range(cells // columns):
+        lines.append('| ' + ' | '.join(
+            '`cell` {} *{}*'.format(row, i) for i in range(columns)) + ' |')
+    return '\n'.join(indent + line for line in lines) + '\n'
+
+
+CASES = [
+    ('10k cells', lambda: table(10000)),
+    ('100k cells', lambda: table(100000)),
+    ('1M cells', lambda: table(1000000)),
+    ('100k cells in a list',
+     lambda: '* item\n\n' + table(100000, indent='  ')),
+]
+
+
+def measure(m2r, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        m2r.convert(text)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    tracemalloc.start()
+    try:
+        m2r.convert(text)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark conversion of large tables.')
+    parser.add_argument('--m2r', metavar='PATH',
+                        help='path to m2r.py under the benchmark')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    m2r = load_m2r(args.m2r)
+    for name, make in CASES:
+        text = make()
+        seconds, peak = measure(m2r, text, 1 if len(text) > 10 ** 7 else 3)
+        print('{:<24} {:>9.1f} KB {:>9.3f} s {:>9.1f} MB peak'.format(
+            name, len(text) / 1024, seconds, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
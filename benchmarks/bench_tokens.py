@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark memory of block tokens and the number of inline text tokens.
+
+Usage: python benchmarks/bench_tokens.py [--m2r PATH]
+
+Each document is lexed by ``RestBlockLexer``, and the memory held by its
+tokens, the number of memory blocks allocated while lexing and the best
+lexing time of three runs are reported per KB of the input. The number of
+``RestRenderer.text`` calls and the best conversion time are reported in the
+same way, for the cost of the inline text rule.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import time
+import tracemalloc
+
+from bench_lists import wide_list
+from bench_tables import table
+from common import load_m2r, root
+
+
+def paragraphs(count):
+    return '\n\n'.join('Paragraph {} with *some* `inline` text.'.format(i)
+                       for i in range(count)) + '\n'
+
+
+def prose(count):
+    words = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+             'eiusmod tempor incididunt ut labore et dolore magna').split()
+    return '\n\n'.join(' '.join(words[i % 7:] + words[:i % 7])
+                       for i in range(count)) + '\n'
+
+
+def sample(times):
+    with open(os.path.join(root, 'tests', 'test.md')) as f:
+        return f.read() * times
+
+
+CASES = [
+    ('tests/test.md x 200', lambda: sample(200)),
+    ('paragraphs: 20000', lambda: paragraphs(20000)),
+    ('prose: 10000 paragraphs', lambda: prose(10000)),
+    ('list: 20000 items', lambda: wide_list(20000)),
+    ('list: 20000 loose items', lambda: wide_list(20000, loose=True)),
+    ('table: 100k cells', lambda: table(100000)),
+]
+
+
+def measure(m2r, text):
+    text = m2r.mistune.preprocessing(text)
+    seconds = None
+    for _ in range(3):
+        lexer = m2r.RestBlockLexer()
+        start = time.perf_counter()
+        lexer.parse(text)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    lexer = m2r.RestBlockLexer()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tokens = lexer.parse(text)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    count = sum(stat.count_diff for stat in stats)
+    return len(tokens), seconds, size, count
+
+
+def measure_text(m2r, text):
+    """Return the number of ``RestRenderer.text`` calls and the best time to
+    convert ``text``."""
+    calls = []
+
+    class Renderer(m2r.RestRenderer):
+        def text(self, text):
+            calls.append(None)
+            return super(Renderer, self).text(text)
+
+    seconds = None
+    for _ in range(3):
+        del calls[:]
+        converter = m2r.M2R(renderer=Renderer())
+        start = time.perf_counter()
+        converter(text)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return len(calls), seconds
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark memory of tokens and inline text tokens.')
+    parser.add_argument('--m2r', metavar='PATH',
+                        help='path to m2r.py under the benchmark')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    m2r = load_m2r(args.m2r)
+    print('{:<26} {:>9} {:>8} {:>12} {:>12} {:>10} {:>10} {:>10}'.format(
+        'document', 'KB', 'tokens', 'bytes/KB', 'blocks/KB', 'ms/KB',
+        'texts/KB', 'conv ms/KB'))
+    for name, make in CASES:
+        text = make()
+        kb = len(text) / 1024
+        tokens, seconds, size, count = measure(m2r, text)
+        texts, convert_seconds = measure_text(m2r, text)
+        print('{:<26} {:>9.1f} {:>8} {:>12.0f} {:>12.1f} {:>10.3f} '
+              '{:>10.1f} {:>10.3f}'.format(
+                  name, kb, tokens, size / kb, count / kb, seconds * 1000 / kb,
+                  texts / kb, convert_seconds * 1000 / kb))
+
+
+if __name__ == '__main__':
+    main()
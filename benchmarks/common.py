@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers shared by the benchmarks."""
+
+from __future__ import print_function, unicode_literals
+
+import importlib.util
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_m2r(filename=None):
+    """Import m2r from ``filename``, or from the repository root by
+    default."""
+    sys.argv[1:] = []  # m2r parses command-line options on conversion
+    spec = importlib.util.spec_from_file_location(
+        'm2r', filename or os.path.join(root, 'm2r.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
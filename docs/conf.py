@@ -69,9 +69,9 @@ author = 'Hiroyuki Takagi'
 # built documents.
 #
 # The short X.Y version.
-version = '0.3.1'
+version = '0.4.0'
 # The full version, including alpha/beta/rc tags.
-release = '0.3.1'
+release = '0.4.0'
 
 # The language for content autogenerated by Sphinx. Refer to documentation
 # for a list of supported languages.
@@ -146,7 +146,7 @@ html_theme_options = {
 
 # The name for this set of Sphinx documents.
 # "<project> v<release> documentation" by default.
-#html_title = 'M2R v0.3.1'
+#html_title = 'M2R v0.4.0'
 
 # A shorter title for the navigation bar.  Default is the same as html_title.
 #html_short_title = None
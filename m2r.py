@@ -2,19 +2,33 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, unicode_literals
+import copy
+import importlib
 import os
 import os.path
 import re
-from argparse import ArgumentParser, Namespace
-
-from docutils import statemachine, nodes, io, utils
-from docutils.parsers import rst
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from functools import partial, wraps
+from stat import S_ISSOCK
+from types import SimpleNamespace
+
+# docutils.parsers.rst, asyncio, http and argparse are imported where they
+# are used, and classes based on them are made by _lazy, so that converting
+# markdown needs only mistune and the docutils modules below.
+from docutils import nodes, io, utils
 from docutils.utils import column_width
 import mistune
 from urllib.parse import urlparse
 
-__version__ = '0.3.1'
+__version__ = '0.4.0'
 _is_sphinx = False
+_profiler = None  # active Profile of profile()
 prolog = '''\
 .. role:: raw-html-m2r(raw)
    :format: html
@@ -22,36 +36,180 @@ prolog = '''\
 '''
 
 # for command-line use
-parser = ArgumentParser()
-options = Namespace()
-parser.add_argument('input_file', nargs='*',
-                    help='files to convert to reST format')
-parser.add_argument('--overwrite', action='store_true', default=False,
-                    help='overwrite output file without confirmaion')
-parser.add_argument('--dry-run', action='store_true', default=False,
-                    help='print conversion result and not save output file')
-parser.add_argument('--no-underscore-emphasis', action='store_true',
-                    default=False,
-                    help='do not use underscore (_) for emphasis')
-parser.add_argument('--parse-relative-links', action='store_true',
-                    default=False,
-                    help='parse relative links into ref or doc directives')
-parser.add_argument('--anonymous-references', action='store_true',
-                    default=False,
-                    help='use anonymous references in generated rst')
-parser.add_argument('--disable-inline-math', action='store_true',
-                    default=False,
-                    help='disable parsing inline math')
+options = SimpleNamespace()
+
+
+def _make_parser():
+    """Return the command line parser, which is ``m2r.parser``."""
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('input_file', nargs='*',
+                        help='files or directories to convert to reST '
+                        'format ("-" converts stdin to stdout)')
+    parser.add_argument('--overwrite', action='store_true', default=False,
+                        help='overwrite output file without confirmaion')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='print conversion result and not save output '
+                        'file')
+    parser.add_argument('--no-underscore-emphasis', action='store_true',
+                        default=False,
+                        help='do not use underscore (_) for emphasis')
+    parser.add_argument('--parse-relative-links', action='store_true',
+                        default=False,
+                        help='parse relative links into ref or doc '
+                        'directives')
+    parser.add_argument('--anonymous-references', action='store_true',
+                        default=False,
+                        help='use anonymous references in generated rst')
+    parser.add_argument('--disable-inline-math', action='store_true',
+                        default=False,
+                        help='disable parsing inline math')
+    parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                        help='convert files with N worker processes and '
+                        'overwrite output files without confirmation '
+                        '(0: number of CPUs)')
+    parser.add_argument('--include', action='append', default=None,
+                        metavar='GLOB',
+                        help='file pattern to convert in directories '
+                        '(default: *.md, can be repeated)')
+    parser.add_argument('--exclude', action='append', default=None,
+                        metavar='GLOB',
+                        help='file or directory pattern to skip in '
+                        'directories (can be repeated)')
+    parser.add_argument('--cache-dir', default=None, metavar='DIR',
+                        help='reuse conversion results stored in DIR for '
+                        'unchanged files')
+    parser.add_argument('--prune-cache', action='store_true', default=False,
+                        help='remove stale entries from --cache-dir')
+    parser.add_argument('--cache-max-age', type=float, default=30,
+                        metavar='DAYS',
+                        help='remove cache entries not used for DAYS on '
+                        '--prune-cache (default: 30)')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='print time spent in each lexer rule and '
+                        'renderer method to stderr (files are converted in '
+                        'this process without cache)')
+    parser.add_argument('--serve', default=None, metavar='ADDRESS',
+                        help='run a conversion server on ADDRESS '
+                        '([HOST:]PORT or unix:PATH) until interrupted')
+    parser.add_argument('--server', default=None, metavar='ADDRESS',
+                        help='convert files by the server running on ADDRESS')
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='convert files or directories again whenever '
+                        'their markdown files change, until interrupted '
+                        '(overwrite output files without confirmation)')
+    return parser
 
 
 def parse_options():
-    parser.parse_known_args(namespace=options)
+    _lazy('parser').parse_known_args(namespace=options)
+
+
+# classes made on first use by _lazy: name -> (mixin, "module:base class")
+_lazy_classes = {
+    'M2RParser': ('_M2RParserMixin', 'docutils.parsers.rst:Parser'),
+    'MdInclude': ('_MdIncludeMixin', 'docutils.parsers.rst:Directive'),
+    '_ConversionHandler': ('_ConversionHandlerMixin',
+                           'http.server:BaseHTTPRequestHandler'),
+    'ConversionServer': ('_ConversionServerMixin',
+                         'http.server:ThreadingHTTPServer'),
+    'UnixConversionServer': ('_UnixConversionServerMixin',
+                             __name__ + ':ConversionServer'),
+    '_UnixHTTPConnection': ('_UnixHTTPConnectionMixin',
+                            'http.client:HTTPConnection'),
+}
+_lazy_lock = threading.RLock()
+
+
+def _lazy(name):
+    """Return the module attribute ``name``, which is made on first use.
+
+    ``parser`` is built by :func:`_make_parser`, and the classes in
+    ``_lazy_classes`` are made of their mixin and base class, so that their
+    modules are imported only when they are used. This is also the module
+    ``__getattr__``, so ``from m2r import M2RParser`` works as before.
+    """
+    with _lazy_lock:
+        if name in globals():
+            return globals()[name]
+        if name == 'parser':
+            value = _make_parser()
+        elif name in _lazy_classes:
+            mixin, base = _lazy_classes[name]
+            module, _, base = base.partition(':')
+            base = getattr(importlib.import_module(module), base)
+            mixin = globals()[mixin]
+            value = type(name, (mixin, base), {
+                '__module__': __name__, '__doc__': mixin.__doc__})
+        else:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(
+                __name__, name))
+        globals()[name] = value
+        return value
+
+
+__getattr__ = _lazy
+
+
+class M2RConfig(namedtuple('M2RConfig', [
+        'no_underscore_emphasis',
+        'parse_relative_links',
+        'anonymous_references',
+        'disable_inline_math',
+], defaults=(False, False, False, False))):
+    """Immutable options of a converter.
+
+    Pass it to :class:`M2R`, :func:`convert` and other conversion functions
+    as ``config``. Converters of equal configs share their grammar rules.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_options(cls, namespace):
+        """Return the config given by command-line ``namespace``."""
+        return cls(*(getattr(namespace, name) for name in cls._fields))
+
+    @classmethod
+    def from_sphinx_config(cls, config):
+        """Return the config given by the ``m2r_*`` values of sphinx
+        ``config``."""
+        return cls(
+            no_underscore_emphasis=config.no_underscore_emphasis,
+            parse_relative_links=config.m2r_parse_relative_links,
+            anonymous_references=config.m2r_anonymous_references,
+            disable_inline_math=config.m2r_disable_inline_math,
+        )
+
+
+def _pop_config(kwargs, config=None):
+    """Return ``config`` updated by its fields given in ``kwargs``.
+
+    The fields are removed from ``kwargs``, so the rest can be passed to
+    mistune.
+    """
+    values = {}
+    for name in M2RConfig._fields:
+        if name in kwargs:
+            values[name] = kwargs.pop(name)
+    if config is None:
+        return M2RConfig(**values)
+    return config._replace(**values) if values else config
+
+
+# Rules defined in the grammars below match in linear time of the text.
+# Lazy or nested quantifiers which may search the rest of the text on each
+# attempt are replaced with character classes excluding their terminators.
+# mistune's link, reflink and nolink rules are left as they are, and still
+# take quadratic time on long runs of unclosed brackets.
 
 
 class RestBlockGrammar(mistune.BlockGrammar):
+    # a directive ends before an unindented line or at the end of text, and
+    # the blank lines before the end are included except the last newline
     directive = re.compile(
-            r'^( *\.\..*?)\n(?=\S)',
-            re.DOTALL | re.MULTILINE,
+            r'^( *\.\.[^\n]*(?:\n+[^\S\n][^\n]*)*(?:\n+(?=\n\S))?)'
+            r'(?:\n(?=\S)|\n*\Z)',
+            re.MULTILINE,
         )
     oneline_directive = re.compile(
             r'^( *\.\..*?)$',
@@ -61,6 +219,166 @@ class RestBlockGrammar(mistune.BlockGrammar):
             r'^::\s*$',
             re.DOTALL | re.MULTILINE,
         )
+    # same as mistune's, but a fence is a whole run of backticks or tildes
+    # and the code ends with a non-space character unless it is only one
+    # space, so spaces before the closing fence are not retried on each one
+    fences = re.compile(
+        r'^ *(`{3,}(?!`)|~{3,}(?!~)) *([^`\s]+)? *\n'
+        r'(\s|[\s\S]*?\S)\s*\1 *(?:\n+|$)'
+    )
+    # mistune's paragraph ends before fences in the same way
+    paragraph = re.compile(mistune.BlockGrammar.paragraph.pattern.replace(
+        mistune._pure_pattern(mistune.BlockGrammar.fences).replace(
+            r'\1', r'\2'),
+        mistune._pure_pattern(fences).replace(r'\1', r'\2'),
+    ))
+    # same as mistune's, but the first line is scanned to its first pipe
+    # once, instead of to the end of the line from each pipe
+    nptable = re.compile(
+        r'^ *(\S[^\n|]*\|[^\n]*)\n *([-:]+ *\|[-| :]*)\n'
+        r'((?:.*\|.*(?:\n|$))*)\n*'
+    )
+
+
+class _Token(object):
+    """Block token, which is read and updated like mistune's token dicts.
+
+    Documents have a token for each block, so tokens are records of the
+    fields of their types rather than dicts. The markdown lines of a block
+    may be set to its first token as ``lines``.
+    """
+
+    __slots__ = ('type', 'lines')
+    fields = ('type',)
+
+    def __init__(self, type):
+        self.type = type
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return [key for key in self.fields + ('lines',) if hasattr(self, key)]
+
+    def __eq__(self, other):
+        if isinstance(other, (_Token, dict)):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class _TextToken(_Token):
+    __slots__ = ('text',)
+    fields = ('type', 'text')
+
+    def __init__(self, type, text):
+        self.type = type
+        self.text = text
+
+
+class _CodeToken(_Token):
+    __slots__ = ('lang', 'text')
+    fields = ('type', 'lang', 'text')
+
+    def __init__(self, lang, text):
+        self.type = 'code'
+        self.lang = lang
+        self.text = text
+
+
+class _HeadingToken(_Token):
+    __slots__ = ('level', 'text')
+    fields = ('type', 'level', 'text')
+
+    def __init__(self, level, text):
+        self.type = 'heading'
+        self.level = level
+        self.text = text
+
+
+class _HtmlToken(_Token):
+    __slots__ = ('tag', 'extra', 'text')
+    fields = ('type', 'tag', 'extra', 'text')
+
+
+class _ListToken(_Token):
+    __slots__ = ('ordered',)
+    fields = ('type', 'ordered')
+
+
+class _FootnoteToken(_Token):
+    __slots__ = ('key',)
+    fields = ('type', 'key')
+
+
+class _TableToken(_Token):
+    __slots__ = ('header', 'align', 'cells')
+    fields = ('type', 'header', 'align', 'cells')
+
+
+# token classes by the keys of mistune's token dicts
+_token_classes = dict((frozenset(cls.fields), cls) for cls in [
+    _Token, _TextToken, _CodeToken, _HeadingToken, _HtmlToken, _ListToken,
+    _FootnoteToken, _TableToken,
+])
+
+
+class _TokenList(list):
+    """List of block tokens, which turns token dicts appended by mistune's
+    lexer methods into :class:`_Token` records."""
+
+    __slots__ = ()
+
+    def append(self, token):
+        if type(token) is dict:
+            if len(token) == 1:
+                token = _Token(token['type'])
+                list.append(self, token)
+                return
+            cls = _token_classes.get(frozenset(token))
+            if cls is not None:
+                record = cls.__new__(cls)
+                for key, value in token.items():
+                    setattr(record, key, value)
+                token = record
+        list.append(self, token)
+
+
+# block rules without the leading "^", by the rules
+_unanchored_rules = {}
+
+
+def _unanchored(pattern):
+    """Return ``pattern`` without its leading ``^``, which matches at the
+    position given to ``match`` as ``pattern`` matches at the start of the
+    text sliced at the position.
+
+    Other ``^`` of block rules are escaped or in character classes, and
+    ``$`` and lookaheads see the same rest of the text.
+    """
+    rule = _unanchored_rules.get(pattern)
+    if rule is None:
+        rule = pattern
+        if pattern.pattern.startswith('^'):
+            rule = re.compile(pattern.pattern[1:], pattern.flags)
+        _unanchored_rules[pattern] = rule
+    return rule
 
 
 class RestBlockLexer(mistune.BlockLexer):
@@ -71,35 +389,145 @@ class RestBlockLexer(mistune.BlockLexer):
         'rest_code_block',
     ] + mistune.BlockLexer.default_rules
 
+    def __init__(self, rules=None, **kwargs):
+        super(RestBlockLexer, self).__init__(rules, **kwargs)
+        self.tokens = _TokenList()
+
+    def parse(self, text, rules=None, line=None):
+        return self.parse_partial(text.rstrip('\n'), rules, line)
+
+    def parse_partial(self, text, rules=None, line=None):
+        """Parse ``text`` without stripping trailing newlines.
+
+        Used for a part of a document followed by more text, where trailing
+        newlines belong to the last block as in the whole document.
+
+        If ``line`` is given, ``text`` is the top level of a document which
+        starts at the 0-based ``line``, and the first token of each block
+        gets the markdown lines of the block as ``lines``.
+        """
+        if not rules:
+            rules = self.default_rules
+        index = len(self.tokens)
+        for source in self.parse_blocks(text, rules):
+            if line is not None:
+                line = self._set_lines(index, source, line)
+            index = len(self.tokens)
+        return self.tokens
+
+    def parse_blocks(self, text, rules=None):
+        """Parse ``text`` block by block, and yield the source of each block
+        after its tokens are appended to ``tokens``.
+
+        Rules match at the position of each block, instead of at the start
+        of the rest of the text sliced after each block, which copies the
+        rest of a document for every block.
+        """
+        if not rules:
+            rules = self.default_rules
+        matchers = []
+        for key in rules:
+            match = _unanchored(getattr(self.rules, key)).match
+            handle = getattr(self, 'parse_%s' % key)
+            if _profiler is not None:
+                match, handle = _profiler.time_rule('block', key, match,
+                                                    handle)
+            matchers.append((match, handle))
+        position = 0
+        while position < len(text):
+            for match, handle in matchers:
+                m = match(text, position)
+                if m:
+                    handle(m)
+                    break
+            else:  # pragma: no cover
+                raise RuntimeError('Infinite loop at: %s' % text[position:])
+            yield m.group(0)
+            position = m.end()
+
+    def _set_lines(self, index, source, line):
+        """Set lines ``(start, end)`` of the block matched as ``source`` at
+        ``line`` to its first token, and return the line after ``source``.
+
+        Trailing blank lines are not included in the block.
+        """
+        if index < len(self.tokens):
+            self.tokens[index]['lines'] = (
+                line, line + source.rstrip('\n').count('\n') + 1)
+        return line + source.count('\n')
+
+    # tokens of leaf blocks are made as records here, and the others are
+    # turned into records by _TokenList
+
+    def parse_newline(self, m):
+        if len(m.group(0)) > 1:
+            self.tokens.append(_Token('newline'))
+
+    def parse_block_code(self, m):
+        code = mistune._block_code_leading_pattern.sub('', m.group(0))
+        self.tokens.append(_CodeToken(None, code))
+
+    def parse_fences(self, m):
+        self.tokens.append(_CodeToken(m.group(2), m.group(3)))
+
+    def parse_heading(self, m):
+        self.tokens.append(_HeadingToken(len(m.group(1)), m.group(2)))
+
+    def parse_lheading(self, m):
+        self.tokens.append(_HeadingToken(1 if m.group(2) == '=' else 2,
+                                         m.group(1)))
+
+    def parse_hrule(self, m):
+        self.tokens.append(_Token('hrule'))
+
+    def parse_block_html(self, m):
+        if not m.group(1):
+            self.tokens.append(_TextToken('close_html', m.group(0)))
+            return
+        token = _HtmlToken('open_html')
+        token.tag = m.group(1)
+        token.extra = m.group(2)
+        token.text = m.group(3)
+        self.tokens.append(token)
+
+    def parse_paragraph(self, m):
+        self.tokens.append(_TextToken('paragraph', m.group(1).rstrip('\n')))
+
+    def parse_text(self, m):
+        self.tokens.append(_TextToken('text', m.group(0)))
+
     def parse_directive(self, m):
-        self.tokens.append({
-            'type': 'directive',
-            'text': m.group(1),
-        })
+        self.tokens.append(_TextToken('directive', m.group(1)))
 
     def parse_oneline_directive(self, m):
         # reuse directive output
-        self.tokens.append({
-            'type': 'directive',
-            'text': m.group(1),
-        })
+        self.tokens.append(_TextToken('directive', m.group(1)))
 
     def parse_rest_code_block(self, m):
-        self.tokens.append({
-            'type': 'rest_code_block',
-        })
+        self.tokens.append(_Token('rest_code_block'))
 
 
 class RestInlineGrammar(mistune.InlineGrammar):
+    # alt may include [brackets], but urls may not, so the match does not
+    # reach the next image link
     image_link = re.compile(
-        r'\[!\[(?P<alt>.*?)\]\((?P<url>.*?)\).*?\]\((?P<target>.*?)\)'
+        r'\[!\[(?P<alt>(?:[^\[\]\n]|\[[^\[\]\n]*\])*)\]'
+        r'\((?P<url>[^()\[\]\n]*)\)[^\[\]\n]*'
+        r'\]\((?P<target>[^()\[\]\n]*)\)'
+    )
+    # :role:`text`, :domain:role:`text` or `text`:role:
+    rest_role = re.compile(
+        r':[\w.+-]+(?::[\w.+-]+){0,2}:`[^`\n]*`|`[^`]+`:[^:\n]*:'
     )
-    rest_role = re.compile(r':.*?:`.*?`|`[^`]+`:.*?:')
     rest_link = re.compile(r'`[^`]*?`_')
-    inline_math = re.compile(r'`\$(.*)?\$`')
+    inline_math = re.compile(r'`\$([^`\n]*)\$`')
     eol_literal_marker = re.compile(r'(\s+)?::\s*$')
-    # add colon and space as special text
-    text = re.compile(r'^[\s\S]+?(?=[\\<!\[:_*`~ ]|https?://| {2,}\n|$)')
+    # add colon and space as special text, and take runs of spaces at once
+    # not to try the other rules on each space; a single space is taken with
+    # the following word
+    text = re.compile(
+        r'^(?: {2,}|[\s\S]+?(?=[\\<!\[:_*`~ ]|https?://| {2,}\n|$))'
+    )
     # __word__ or **word**
     double_emphasis = re.compile(
         r'^([_*]){2}(?P<text>[\s\S]+?)\1{2}(?!\1)'
@@ -111,13 +539,154 @@ class RestInlineGrammar(mistune.InlineGrammar):
         r'^\*(?P<text>(?:\*\*|[^\*])+?)\*(?!\*)'  # *word*
     )
 
+    def __init__(self):
+        # spans are indexed by each lexer
+        self.code = _CodeSpanRule()
+        # ~~text~~, closed by the first ~~ after a non-space character
+        self.strikethrough = _ClosedSpanRule(
+            '~~', mistune.InlineGrammar.strikethrough, r'(?<=\S)(?=~~)', 3, 2)
+        # [^key], closed by the first ]
+        self.footnote = _ClosedSpanRule(
+            '[^', mistune.InlineGrammar.footnote, r'\]', 2, 1)
+        self._span_rules = (self.code, self.strikethrough, self.footnote)
+
+    def push(self, text):
+        """Index ``text`` for the span rules until :meth:`pop`."""
+        for rule in self._span_rules:
+            rule.push(text)
+
+    def pop(self):
+        for rule in self._span_rules:
+            rule.pop()
+
+    # variants without underscores, compiled once for all grammars
+    star_double_emphasis = re.compile(
+        r'^\*{2}(?P<text>[\s\S]+?)\*{2}(?!\*)'  # **word**
+    )
+    star_emphasis = re.compile(
+        r'^\*(?P<text>(?:\*\*|[^\*])+?)\*(?!\*)'  # *word*
+    )
+
     def no_underscore_emphasis(self):
-        self.double_emphasis = re.compile(
-            r'^\*{2}(?P<text>[\s\S]+?)\*{2}(?!\*)'  # **word**
-        )
-        self.emphasis = re.compile(
-            r'^\*(?P<text>(?:\*\*|[^\*])+?)\*(?!\*)'  # *word*
-        )
+        self.double_emphasis = self.star_double_emphasis
+        self.emphasis = self.star_emphasis
+
+
+class _CodeSpanRule(object):
+    """``code`` rule of :class:`RestInlineGrammar`.
+
+    Same as mistune's rule: a code span opens with up to the whole run of
+    backticks and closes with the first later run of exactly as many
+    backticks, the longest opener which has such a closer winning. mistune's
+    regular expression searches the rest of the text for each opener length
+    on each backtick, which takes cubic time for a long run of backticks.
+    Instead, runs of backticks in the text given to :meth:`push` are indexed
+    once, so each run is searched at most once.
+    """
+    run_re = re.compile(r'`+')
+    space_re = re.compile(r'\s*')
+
+    def __init__(self):
+        self._indexes = []
+        self._span_res = {}
+
+    def push(self, text):
+        """Index ``text``, whose suffixes are matched until :meth:`pop`."""
+        self._indexes.append(self._index(text) if '`' in text else None)
+
+    def pop(self):
+        self._indexes.pop()
+
+    def _index(self, text):
+        starts = []
+        ends = []
+        closers = {}  # run length -> starts of the runs
+        for m in self.run_re.finditer(text):
+            start, end = m.span()
+            starts.append(start)
+            ends.append(end)
+            closers.setdefault(end - start, []).append(start)
+        # run -> the first position in the run from which no span opens
+        failed = {}
+        return len(text), starts, ends, closers, failed
+
+    def _span_re(self, length):
+        if length not in self._span_res:
+            self._span_res[length] = re.compile(
+                r'(`{%d})([\s\S]*)`{%d}' % (length, length))
+        return self._span_res[length]
+
+    def match(self, text):
+        if not text.startswith('`'):
+            return None
+        if self._indexes:
+            index = self._indexes[-1]
+        else:
+            index = self._index(text)
+        size, starts, ends, closers, failed = index
+        pos = size - len(text)
+        i = bisect_right(starts, pos) - 1
+        if failed.get(i, ends[i]) <= pos:
+            return None
+        # shorter openers only have fewer closers, so this loop runs at
+        # most once for the whole run in total
+        for length in range(ends[i] - pos, 0, -1):
+            runs = closers.get(length)
+            if not runs:
+                continue
+            # the code starts after the opener and the spaces after it,
+            # or at the last space if only a closer follows the spaces
+            start = pos + length
+            if start == ends[i]:
+                start = self.space_re.match(text, length).end() + pos
+            j = bisect_right(runs, start)
+            if j == len(runs) and runs[-1] == start > ends[i]:
+                j -= 1
+            if j < len(runs):
+                return self._span_re(length).match(
+                    text, 0, runs[j] + length - pos)
+        failed[i] = pos
+        return None
+
+
+class _ClosedSpanRule(object):
+    """Rule of a span which ends at the first closer after its opener, like
+    ``strikethrough`` and ``footnote`` rules of mistune.
+
+    mistune's regular expressions search the rest of the text for a closer
+    on each opener, which takes quadratic time when many openers are not
+    closed. Instead, closers in the text given to :meth:`push` are indexed
+    on first use, and ``pattern`` is matched only up to the first closer at
+    least ``offset`` characters after the opener.
+    """
+
+    def __init__(self, opener, pattern, closer, offset, length):
+        self.opener = opener
+        self.pattern = pattern
+        self.closer_re = re.compile(closer)
+        self.offset = offset
+        self.length = length  # of the closer
+        self._texts = []
+
+    def push(self, text):
+        """Index ``text``, whose suffixes are matched until :meth:`pop`."""
+        self._texts.append([text, None])
+
+    def pop(self):
+        self._texts.pop()
+
+    def match(self, text):
+        if not text.startswith(self.opener):
+            return None
+        item = self._texts[-1] if self._texts else [text, None]
+        if item[1] is None:
+            item[1] = [m.start() for m in self.closer_re.finditer(item[0])]
+        closers = item[1]
+        pos = len(item[0]) - len(text)
+        i = bisect_left(closers, pos + self.offset)
+        if i == len(closers):
+            return None
+        return self.pattern.match(text, 0, closers[i] + self.length - pos)
 
 
 class RestInlineLexer(mistune.InlineLexer):
@@ -129,24 +698,81 @@ class RestInlineLexer(mistune.InlineLexer):
         'eol_literal_marker',
     ] + mistune.InlineLexer.default_rules
 
-    def __init__(self, *args, **kwargs):
-        no_underscore_emphasis = kwargs.pop('no_underscore_emphasis', False)
-        disable_inline_math = kwargs.pop('disable_inline_math', False)
-        super(RestInlineLexer, self).__init__(*args, **kwargs)
-        if not _is_sphinx:
-            parse_options()
-        if no_underscore_emphasis or getattr(options,
-                                             'no_underscore_emphasis',
-                                             False):
+    # rule names of each lexer class and config
+    _rule_lists = {}
+
+    def __init__(self, renderer, rules=None, config=None, **kwargs):
+        self.config = config = _pop_config(kwargs, config)
+        super(RestInlineLexer, self).__init__(renderer, rules, **kwargs)
+        if config.no_underscore_emphasis:
             self.rules.no_underscore_emphasis()
-        inline_maths = 'inline_math' in self.default_rules
-        if disable_inline_math or getattr(options,
-                                          'disable_inline_math',
-                                          False):
-            if inline_maths:
-                self.default_rules.remove('inline_math')
-        elif not inline_maths:
-            self.default_rules.insert(0, 'inline_math')
+        self.default_rules = self._rule_list(config)
+        self._output_depth = 0
+
+    @classmethod
+    def _rule_list(cls, config):
+        key = (cls, tuple(cls.default_rules), config.disable_inline_math)
+        rule_list = cls._rule_lists.get(key)
+        if rule_list is None:
+            rule_list = [rule for rule in cls.default_rules
+                         if rule != 'inline_math']
+            if not config.disable_inline_math:
+                rule_list.insert(0, 'inline_math')
+            cls._rule_lists[key] = rule_list
+        return rule_list
+
+    def output(self, text, rules=None):
+        """Render inline ``text``.
+
+        Same as ``mistune.InlineLexer.output``, but rendered pieces are
+        joined by ``RestRenderer.join_inline``, which removes unneeded
+        escapes around inline markups.
+        """
+        text = text.rstrip('\n')
+        if not rules:
+            rules = list(self.default_rules)
+        if self._in_footnote and 'footnote' in rules:
+            rules.remove('footnote')
+
+        pieces = []
+        self._output_depth += 1
+        self.rules.push(text)
+        try:
+            matchers = []
+            for key in rules:
+                match = getattr(self.rules, key).match
+                handle = getattr(self, 'output_%s' % key)
+                if _profiler is not None:
+                    match, handle = _profiler.time_rule('inline', key, match,
+                                                        handle)
+                matchers.append((match, handle))
+            while text:
+                for match, handle in matchers:
+                    m = match(text)
+                    if not m:
+                        continue
+                    self.line_match = m
+                    out = handle(m)
+                    if out is not None:
+                        break
+                else:  # pragma: no cover
+                    raise RuntimeError('Infinite loop at: %s' % text)
+                pieces.append(out)
+                text = text[len(m.group(0)):]
+        finally:
+            self.rules.pop()
+            self._output_depth -= 1
+        return self.renderer.join_inline(pieces, self._output_depth == 0)
+
+    def output_code(self, m):
+        # same as mistune's: strip spaces around the code, but the code ends
+        # with a non-backtick character
+        text = m.group(2)
+        code = text.lstrip() or text[-1]
+        stripped = code.rstrip()
+        if stripped.endswith('`'):
+            stripped = code[:len(stripped) + 1]
+        return self.renderer.codespan(stripped or code)
 
     def output_double_emphasis(self, m):
         # may include code span
@@ -181,11 +807,137 @@ class RestInlineLexer(mistune.InlineLexer):
         return self.renderer.eol_literal_marker(marker)
 
 
+_line_breaks = frozenset('\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029')
+_line_break_re = re.compile('[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+class _Block(object):
+    """Rendered block whose body is indented when it is written out.
+
+    ``body`` is a list of strings and nested blocks. Non-empty lines of the
+    body are prefixed with ``indent`` in addition to the indents of the outer
+    blocks, so each line is indented once however deep it is nested. After
+    the body is written, one trailing newline is removed if ``trim`` is
+    ``'line'``, or all leading and trailing newlines if it is ``'all'``.
+    """
+
+    __slots__ = ('head', 'body', 'tail', 'indent', 'trim')
+
+    def __init__(self, head, body, tail='', indent='', trim=None):
+        self.head = head
+        self.body = body
+        self.tail = tail
+        self.indent = indent
+        self.trim = trim
+
+    def __str__(self):
+        writer = _BlockWriter()
+        writer.write_block(self)
+        return writer.getvalue()
+
+
+class _BlockWriter(object):
+    """Write strings and :class:`_Block` trees out into one text."""
+
+    def __init__(self):
+        self.out = []
+        self.prefix = ''
+        self.line_start = True
+        self.skip_newlines = False
+
+    def getvalue(self):
+        return ''.join(self.out)
+
+    def write(self, text):
+        if self.skip_newlines:
+            text = text.lstrip('\n')
+            if not text:
+                return
+            self.skip_newlines = False
+        if not text:
+            return
+        if self.prefix:
+            # split lines like str.splitlines() as docutils does
+            lines = text.splitlines()
+            if text[-1] in _line_breaks:
+                lines.append('')
+            prefix = self.prefix
+            first = lines[0]
+            if first and self.line_start:
+                first = prefix + first
+            text = '\n'.join([first] + [prefix + line if line else ''
+                                        for line in lines[1:]])
+            self.line_start = not lines[-1]
+        else:
+            self.line_start = text[-1] in _line_breaks
+        self.out.append(text)
+
+    def write_block(self, block):
+        out = self.out
+        self.write(block.head)
+        prefix = self.prefix
+        self.prefix = prefix + block.indent
+        start = len(out)
+        line_start = self.line_start
+        if block.trim == 'all':
+            self.skip_newlines = True
+        for part in block.body:
+            if isinstance(part, _Block):
+                self.write_block(part)
+            else:
+                self.write(part)
+        self.skip_newlines = False
+        if block.trim is not None:
+            while len(out) > start and out[-1].endswith('\n'):
+                if block.trim == 'line':
+                    text = out[-1][:-1]
+                else:
+                    text = out[-1].rstrip('\n')
+                if text:
+                    out[-1] = text
+                    break
+                out.pop()
+                if block.trim == 'line':
+                    break
+            if len(out) > start:
+                self.line_start = out[-1].endswith('\n')
+            else:
+                self.line_start = line_start
+        self.prefix = prefix
+        self.write(block.tail)
+
+    def write_parts(self, parts):
+        """Write ``parts`` of a document and return their reST lines
+        ``(start, end)``, or None for parts which write no text."""
+        out = self.out
+        lines = []
+        line = 0
+        for part in parts:
+            start = len(out)
+            if isinstance(part, _Block):
+                self.write_block(part)
+            else:
+                self.write(part)
+            text = ''.join(out[start:])
+            body = text.strip('\n')
+            if body:
+                first = line + len(text) - len(text.lstrip('\n'))
+                lines.append((first, first + body.count('\n') + 1))
+            else:
+                lines.append(None)
+            line += text.count('\n')
+        return lines
+
+
 class RestRenderer(mistune.Renderer):
     _include_raw_html = False
     list_indent_re = re.compile(r'^(\s*(#\.|\*)\s)')
     indent = ' ' * 3
-    list_marker = '{#__rest_list_mark__#}'
+    escaped_space = '\\ '
+    # characters which may precede/follow inline markups without escaped
+    # spaces (ASCII subset of docutils' inline markup recognition rules)
+    markup_start_chars = frozenset(' \t\n\'"([{<-/')
+    markup_end_chars = frozenset(' \t\n\'")]}>-/.,;!?')
     hmarks = {
         1: '=',
         2: '-',
@@ -195,20 +947,55 @@ class RestRenderer(mistune.Renderer):
         6: '#',
     }
 
-    def __init__(self, *args, **kwargs):
-        self.parse_relative_links = kwargs.pop('parse_relative_links', False)
-        self.anonymous_references = kwargs.pop('anonymous_references', False)
-        super(RestRenderer, self).__init__(*args, **kwargs)
-        if not _is_sphinx:
-            parse_options()
-            if getattr(options, 'parse_relative_links', False):
-                self.parse_relative_links = options.parse_relative_links
-            if getattr(options, 'anonymous_references', False):
-                self.anonymous_references = options.anonymous_references
-
-    def _indent_block(self, block):
-        return '\n'.join(self.indent + line if line else ''
-                         for line in block.splitlines())
+    def __init__(self, config=None, **kwargs):
+        self.config = config = _pop_config(kwargs, config)
+        self.parse_relative_links = config.parse_relative_links
+        self.anonymous_references = config.anonymous_references
+        super(RestRenderer, self).__init__(**kwargs)
+
+    def _indent_block(self, head, body, tail, trim='line'):
+        return _Block(head, body, tail, self.indent, trim)
+
+    def join_inline(self, pieces, outermost=False):
+        """Join rendered inline ``pieces`` into a text.
+
+        Inline markups are rendered with escaped spaces on both sides, which
+        reST needs only when the markup touches other text. Escapes next to
+        whitespace or punctuation are dropped here by looking at the
+        adjacent characters, and two adjacent markups share one escape.
+        ``outermost`` text is surrounded by whitespace in block elements, so
+        escapes at its edges are dropped too; the edges of nested text are
+        left to the enclosing markup.
+        """
+        escape = self.escaped_space
+        out = []
+        escape_after = False  # the last piece ended with an escape
+        for piece in pieces:
+            if not piece:
+                continue
+            if escape_after:
+                escape_after = False
+                if piece[0] not in self.markup_end_chars:
+                    out.append(escape)
+            if piece.startswith(escape):
+                if out:
+                    if out[-1][-1] in self.markup_start_chars:
+                        piece = piece[len(escape):]
+                elif outermost:
+                    piece = piece[len(escape):]
+            if piece.endswith(escape):
+                piece = piece[:-len(escape)]
+                escape_after = True
+            if piece:
+                out.append(piece)
+        if escape_after and not outermost:
+            out.append(escape)
+        return ''.join(out)
+
+    def join_blocks(self, parts):
+        """Join rendered blocks into a :class:`_Block` of the document or a
+        footnote."""
+        return _Block('', parts)
 
     def _raw_html(self, html):
         self._include_raw_html = True
@@ -223,18 +1010,22 @@ class RestRenderer(mistune.Renderer):
             first_line = '\n::\n\n'
         else:
             first_line = '\n.. code-block::\n\n'
-        return first_line + self._indent_block(code) + '\n'
+        return self._indent_block(first_line, [code], '\n')
 
     def block_quote(self, text):
+        """Rendering block quote. Like ``<blockquote>``.
+
+        :param text: list of rendered contents of the quote.
+        """
         # text includes some empty line
-        return '\n..\n\n{}\n\n'.format(self._indent_block(text.strip('\n')))
+        return self._indent_block('\n..\n\n', text, '\n\n', trim='all')
 
     def block_html(self, html):
         """Rendering block level pure html content.
 
         :param html: text content of the html snippet.
         """
-        return '\n\n.. raw:: html\n\n' + self._indent_block(html) + '\n\n'
+        return self._indent_block('\n\n.. raw:: html\n\n', [html], '\n\n')
 
     def header(self, text, level, raw=None):
         """Rendering header/heading tags like ``<h1>`` ``<h2>``.
@@ -253,20 +1044,21 @@ class RestRenderer(mistune.Renderer):
     def list(self, body, ordered=True):
         """Rendering list tags like ``<ul>`` and ``<ol>``.
 
-        :param body: body contents of the list.
+        :param body: list items rendered by :meth:`list_item`.
         :param ordered: whether this list is ordered or not.
         """
         mark = '#. ' if ordered else '* '
-        lines = body.splitlines()
-        for i, line in enumerate(lines):
-            if line and not line.startswith(self.list_marker):
-                lines[i] = ' ' * len(mark) + line
-        return '\n{}\n'.format(
-            '\n'.join(lines)).replace(self.list_marker, mark)
+        for item in body:
+            item.head = '\n' + mark
+            item.indent = ' ' * len(mark)
+        return _Block('\n', body, '\n', trim='line')
 
     def list_item(self, text):
-        """Rendering list item snippet. Like ``<li>``."""
-        return '\n' + self.list_marker + text
+        """Rendering list item snippet. Like ``<li>``.
+
+        :param text: list of rendered contents and nested lists of the item.
+        """
+        return _Block('\n', text)
 
     def paragraph(self, text):
         """Rendering paragraph tags. Like ``<p>``."""
@@ -275,31 +1067,33 @@ class RestRenderer(mistune.Renderer):
     def table(self, header, body):
         """Rendering table element. Wrap header and body in it.
 
-        :param header: header part of the table.
-        :param body: body part of the table.
+        :param header: header row rendered by :meth:`table_row`.
+        :param body: list of body rows rendered by :meth:`table_row`.
         """
-        table = '\n.. list-table::\n'
+        # rows are indented already, and written out as they are
+        rows = _Block('', body, '\n\n', trim='line')
         if header and not header.isspace():
-            table = (table + self.indent + ':header-rows: 1\n\n' +
-                     self._indent_block(header) + '\n')
+            body = [self.indent + ':header-rows: 1\n\n', header, rows]
         else:
-            table = table + '\n'
-        table = table + self._indent_block(body) + '\n\n'
-        return table
+            body = ['\n', rows]
+        return _Block('\n.. list-table::\n', body)
 
     def table_row(self, content):
         """Rendering a table row. Like ``<tr>``.
 
-        :param content: content of current table row.
+        :param content: list of cells rendered by :meth:`table_cell`.
         """
-        contents = content.splitlines()
-        if not contents:
+        if not content:
             return ''
-        clist = ['* ' + contents[0]]
-        if len(contents) > 1:
-            for c in contents[1:]:
-                clist.append('  ' + c)
-        return '\n'.join(clist) + '\n'
+        indent = self.indent
+        if all(cell.endswith('\n') and
+               not _line_break_re.search(cell, 0, len(cell) - 1)
+               for cell in content):
+            # one line for each cell
+            return indent + '* ' + (indent + '  ').join(content)
+        lines = ''.join(content).splitlines()
+        return ''.join([indent + ('  ' if i else '* ') + line + '\n'
+                        for i, line in enumerate(lines)])
 
     def table_cell(self, content, **flags):
         """Rendering a table cell. Like ``<th>`` ``<td>``.
@@ -340,9 +1134,9 @@ class RestRenderer(mistune.Renderer):
 
     def linebreak(self):
         """Rendering line break like ``<br>``."""
-        if self.options.get('use_xhtml'):
-            return self._raw_html('<br />') + '\n'
-        return self._raw_html('<br>') + '\n'
+        html = '<br />' if self.options.get('use_xhtml') else '<br>'
+        # no escape is needed at the end of line
+        return self._raw_html(html)[:-len(self.escaped_space)] + '\n'
 
     def strikethrough(self, text):
         """Rendering ~~strikethrough~~ text.
@@ -377,48 +1171,53 @@ class RestRenderer(mistune.Renderer):
             underscore = '__'
         else:
             underscore = '_'
+        if text.endswith(self.escaped_space) and not title:
+            # text is followed by a space before the target
+            text = text[:-len(self.escaped_space)]
         if title:
             return self._raw_html(
                 '<a href="{link}" title="{title}">{text}</a>'.format(
                     link=link, title=title, text=text
                 )
             )
+        role = self._relative_link_role(link, text)
+        if role:
+            return r'\ {}\ '.format(role)
+        return r'\ `{text} <{target}>`{underscore}\ '.format(
+            target=link,
+            text=text,
+            underscore=underscore
+        )
+
+    def _relative_link_role(self, link, text):
+        """Return ``doc`` or ``ref`` role for a relative ``link``, or None if
+        relative links are not parsed or ``link`` is absolute."""
         if not self.parse_relative_links:
-            return r'\ `{text} <{target}>`{underscore}\ '.format(
-                target=link,
-                text=text,
-                underscore=underscore
-            )
-        else:
-            url_info = urlparse(link)
-            if url_info.scheme:
-                return r'\ `{text} <{target}>`{underscore}\ '.format(
-                    target=link,
-                    text=text,
-                    underscore=underscore
-                )
+            return None
+        url_info = urlparse(link)
+        if url_info.scheme:
+            return None
+        link_type = 'doc'
+        anchor = url_info.fragment
+        if url_info.fragment:
+            if url_info.path:
+                # Can't link to anchors via doc directive.
+                anchor = ''
             else:
-                link_type = 'doc'
-                anchor = url_info.fragment
-                if url_info.fragment:
-                    if url_info.path:
-                        # Can't link to anchors via doc directive.
-                        anchor = ''
-                    else:
-                        # Example: [text](#anchor)
-                        link_type = 'ref'
-                doc_link = '{doc_name}{anchor}'.format(
-                    # splittext approach works whether or not path is set. It
-                    # will return an empty string if unset, which leads to
-                    # anchor only ref.
-                    doc_name=os.path.splitext(url_info.path)[0],
-                    anchor=anchor
-                )
-                return r'\ :{link_type}:`{text} <{doc_link}>`\ '.format(
-                    link_type=link_type,
-                    doc_link=doc_link,
-                    text=text
-                )
+                # Example: [text](#anchor)
+                link_type = 'ref'
+        doc_link = '{doc_name}{anchor}'.format(
+            # splittext approach works whether or not path is set. It
+            # will return an empty string if unset, which leads to
+            # anchor only ref.
+            doc_name=os.path.splitext(url_info.path)[0],
+            anchor=anchor
+        )
+        return ':{link_type}:`{text} <{doc_link}>`'.format(
+            link_type=link_type,
+            doc_link=doc_link,
+            text=text
+        )
 
     def image(self, src, title, text):
         """Rendering a image with title and text.
@@ -462,15 +1261,15 @@ class RestRenderer(mistune.Renderer):
         :param key: identity key for the footnote.
         :param text: text content of the footnote.
         """
-        return '.. [#fn-{0}] {1}\n'.format(key, text.strip())
+        return '.. [#fn-{0}] {1}\n'.format(key, str(text).strip())
 
     def footnotes(self, text):
         """Wrapper for all footnotes.
 
-        :param text: contents of all footnotes.
+        :param text: footnote items joined by :meth:`join_blocks`.
         """
         if text:
-            return '\n\n' + text
+            return _Block('\n\n', [text])
         else:
             return ''
 
@@ -505,17 +1304,407 @@ class RestRenderer(mistune.Renderer):
         return '\n\n'
 
 
+class SourceMap(object):
+    """Map from lines of converted reST to lines of the markdown source.
+
+    ``blocks`` is a list of ``(markdown_start, markdown_end, rest_start,
+    rest_end)`` line ranges of top-level blocks in order. Lines are 0-based
+    and ranges exclude their ends, as offsets of docutils ``StringList``.
+    """
+
+    def __init__(self, blocks=()):
+        self.blocks = list(blocks)
+
+    def __eq__(self, other):
+        return (isinstance(other, SourceMap) and
+                self.blocks == other.blocks)
+
+    def __repr__(self):
+        return 'SourceMap(%r)' % (self.blocks,)
+
+    def __str__(self):
+        return ' '.join(str(line) for block in self.blocks
+                        for line in block)
+
+    @classmethod
+    def from_string(cls, text):
+        """Load a map written by ``str(source_map)``."""
+        lines = [int(line) for line in text.split()]
+        return cls(tuple(lines[i:i + 4]) for i in range(0, len(lines), 4))
+
+    def markdown_line(self, line):
+        """Return the markdown line of reST ``line``.
+
+        Lines of a block are mapped to the lines of its markdown in order,
+        up to its last markdown line. Lines between blocks are mapped to the
+        last line of the previous block, and lines before the first block to
+        its first line.
+        """
+        index = bisect_right(
+            [block[2] for block in self.blocks], line) - 1
+        return self._line(index, line)
+
+    def _line(self, index, line):
+        if index < 0:
+            return self.blocks[0][0] if self.blocks else 0
+        md_start, md_end, rest_start, rest_end = self.blocks[index]
+        return md_start + min(line - rest_start, md_end - md_start - 1)
+
+    def markdown_lines(self, count):
+        """Return the markdown lines of reST lines ``0`` to ``count - 1``."""
+        result = []
+        index = -1
+        starts = [block[2] for block in self.blocks] + [float('inf')]
+        for line in range(count):
+            while starts[index + 1] <= line:
+                index += 1
+            result.append(self._line(index, line))
+        return result
+
+    def string_list(self, rest, source, tab_width=8):
+        """Return a docutils ``StringList`` of the reST text ``rest``
+        converted from ``source``, whose items are the markdown lines."""
+        from docutils import statemachine
+        lines = statemachine.string2lines(rest, tab_width,
+                                          convert_whitespace=True)
+        rest_lines = rest.split('\n')
+        if rest_lines[-1] == '':
+            rest_lines.pop()
+        if len(lines) == len(rest_lines):
+            offsets = self.markdown_lines(len(lines))
+        else:
+            # other line breaks, which are not counted in the map
+            lines = []
+            offsets = []
+            for offset, text in zip(self.markdown_lines(len(rest_lines)),
+                                    rest_lines):
+                split = statemachine.string2lines(
+                    text, tab_width, convert_whitespace=True) or ['']
+                lines.extend(split)
+                offsets.extend([offset] * len(split))
+        return statemachine.StringList(
+            lines, items=[(source, offset) for offset in offsets])
+
+
 class M2R(mistune.Markdown):
+    """Markdown to reST converter.
+
+    Options are given by ``config`` (a :class:`M2RConfig`), or by its
+    fields as keyword arguments, which override the ``config``.
+
+    A converter can be reused for many documents and shared by threads.
+    States of the document being converted are kept in the converter, so
+    concurrent or nested calls are run by its clones.
+    """
+
     def __init__(self, renderer=None, inline=RestInlineLexer,
-                 block=RestBlockLexer, **kwargs):
+                 block=RestBlockLexer, config=None, **kwargs):
+        self.config = config = _pop_config(kwargs, config)
+        self._init_args = (inline, block, kwargs)
         if renderer is None:
-            renderer = RestRenderer(**kwargs)
+            renderer = RestRenderer(config, **kwargs)
         super(M2R, self).__init__(renderer, inline=inline, block=block,
-                                  **kwargs)
+                                  config=config, **kwargs)
+        self._lock = threading.Lock()
+        self._idle = [self]  # converters not converting a document
+
+    @contextmanager
+    def _worker(self):
+        """Borrow an idle converter of the same options."""
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+        if worker is None:
+            worker = self._clone()
+        try:
+            yield worker
+        finally:
+            with self._lock:
+                self._idle.append(worker)
+
+    def _clone(self):
+        """Return a converter of the same options, renderer class and lexer
+        classes, which shares no states with this converter."""
+        inline, block, kwargs = self._init_args
+        if not isinstance(inline, type):
+            inline = type(inline)
+        if not isinstance(block, type):
+            block = type(block)
+        # renderers reset their states on each document
+        clone = copy.copy(self)
+        M2R.__init__(clone, copy.copy(self.renderer), inline, block,
+                     config=self.config, **kwargs)
+        return clone
 
     def parse(self, text):
-        output = super(M2R, self).parse(text)
-        return self.post_process(output)
+        with self._worker() as worker:
+            return worker._parse(text)
+
+    def _parse(self, text):
+        self.reset()
+        output = self._output_document(mistune.preprocessing(text))
+        return self.post_process(str(output))
+
+    def parse_with_source_map(self, text):
+        """Convert markdown ``text`` and return the reST text and its
+        :class:`SourceMap`."""
+        with self._worker() as worker:
+            return worker._parse_with_source_map(text)
+
+    def _parse_with_source_map(self, text):
+        self.reset()
+        document = self._output_document(mistune.preprocessing(text))
+        writer = _BlockWriter()
+        rest_lines = writer.write_parts(document.body)
+        body = writer.getvalue()
+        output = self.post_process(body)
+        offset = output[:len(output) - len(body)].count('\n')
+        blocks = []
+        for md_lines, lines in zip(self.block_lines, rest_lines):
+            if md_lines is not None and lines is not None:
+                blocks.append(md_lines + (lines[0] + offset,
+                                          lines[1] + offset))
+        return output, SourceMap(blocks)
+
+    def output(self, text, rules=None):
+        return str(self.renderer.join_blocks(self._output_parts(text, rules)))
+
+    def _output_document(self, text):
+        """Render a whole document by :meth:`RestRenderer.join_blocks`.
+
+        Container blocks keep their contents as nested blocks, which are
+        indented when the whole document is written out at once.
+        """
+        parts = self._output_parts(text)
+        parts.append(self._output_footnotes(self.block.def_footnotes))
+        self.block.def_links = {}
+        self.block.def_footnotes = {}
+        self.inline.links = {}
+        self.inline.footnotes = {}
+        return self.renderer.join_blocks(parts)
+
+    def _output_parts(self, text, rules=None):
+        self.tokens = self.block.parse(text, rules, line=0)
+        self.tokens.reverse()
+        self.inline.setup(self.block.def_links, self.block.def_footnotes)
+        return self._output_body()
+
+    def _output_body(self, end=None):
+        """Render tokens up to the ``end`` token type into a list.
+
+        Markdown lines of top-level blocks are kept in ``block_lines``.
+        """
+        body = []
+        if end is None:
+            lines = self.block_lines = []
+            while self.pop():
+                lines.append(self.token.get('lines'))
+                body.append(self.tok())
+            return body
+        while self.pop() and self.token['type'] != end:
+            body.append(self.tok())
+        return body
+
+    def reset(self):
+        """Clear states left by the previous document.
+
+        Converters are reused across documents, so a failed conversion must
+        not leak tokens or flags to the next one.
+        """
+        self.tokens = []
+        self.block_lines = []
+        self.footnotes = []
+        self.block.tokens = _TokenList()
+        self.block.def_links = {}
+        self.block.def_footnotes = {}
+        self.block._list_depth = 0
+        self.block._blockquote_depth = 0
+        self.inline._in_link = False
+        self.inline._in_footnote = False
+        self.renderer._include_raw_html = False
+
+    def iter_parse(self, fileobj, chunk_size=64 * 1024):
+        """Convert markdown read from ``fileobj`` and yield reST in chunks.
+
+        Input is read line by line and converted at top-level block
+        boundaries once ``chunk_size`` characters are buffered, so memory
+        usage does not grow with the input size. When ``fileobj`` is
+        seekable, it is lexed once in advance to collect link and footnote
+        definitions; otherwise only definitions which appear before their
+        references are resolved. Output is the same as :func:`convert`,
+        except that the raw-html role is defined just before the first chunk
+        that uses it.
+        """
+        with self._worker() as worker:
+            for output in worker._iter_parse(fileobj, chunk_size):
+                yield output
+
+    def _iter_parse(self, fileobj, chunk_size):
+        self.reset()
+        footnotes = {}
+        links = {}
+        if fileobj.seekable():
+            position = fileobj.tell()
+            self._scan_definitions(fileobj, chunk_size, footnotes)
+            fileobj.seek(position)
+            links = dict(self.block.def_links)
+        include_raw_html = False
+        started = False
+        for tokens in self._iter_tokens(fileobj, chunk_size):
+            self.tokens = tokens
+            # the last definition of a link wins over the whole document
+            self.block.def_links.update(links)
+            self.tokens.reverse()
+            for key in self.block.def_footnotes:
+                footnotes.setdefault(key, 0)
+            # keep footnote index over chunks (InlineLexer.setup resets it)
+            self.inline.links = self.block.def_links
+            self.inline.footnotes = footnotes
+            body = str(self.renderer.join_blocks(self._output_body()))
+            if include_raw_html:
+                self.renderer._include_raw_html = False
+            output = self.post_process(body)
+            if self.renderer._include_raw_html:
+                include_raw_html = True
+                if started:
+                    # separate the role directive from the previous block
+                    output = '\n' + output
+            if output:
+                started = True
+                yield output
+        output = str(self._output_footnotes(footnotes))
+        if output:
+            if include_raw_html:
+                self.renderer._include_raw_html = False
+            yield self.post_process(output)
+
+    def _scan_definitions(self, fileobj, chunk_size, footnotes):
+        """Collect link and footnote definitions of ``fileobj``.
+
+        The input is lexed in the same chunks as the conversion, so that
+        lines like definitions in other blocks are not taken for them. Only
+        link definitions are kept in the block lexer; footnotes are defined
+        again by the conversion.
+        """
+        for _ in self._iter_tokens(fileobj, chunk_size):
+            pass
+        for key in self.block.def_footnotes:
+            footnotes.setdefault(key, 0)
+        self.block.tokens = _TokenList()
+        self.block.def_footnotes = {}
+
+    def _iter_tokens(self, fileobj, chunk_size):
+        """Lex markdown read from ``fileobj`` in chunks of top-level blocks,
+        and yield the tokens of each chunk.
+
+        Blocks at the end of a chunk may be lexed differently with the text
+        after them, like an empty list item followed by a paragraph, so the
+        last three blocks and the blocks after the first one which may be
+        closed far after it (see :func:`_open_block`) are lexed again with
+        the next chunk. Chunks are joined until they are as long as the
+        blocks lexed again, so each part of the input is lexed a bounded
+        number of times.
+        """
+        block = self.block
+        rest = ''
+        pending = []
+        size = 0
+        for chunk, last in _iter_chunks(fileobj, chunk_size):
+            pending.append(mistune.preprocessing(chunk))
+            size += len(pending[-1])
+            if not last and size < len(rest):
+                continue
+            text = rest + ''.join(pending)
+            pending = []
+            size = 0
+            block.tokens = _TokenList()
+            if last:
+                yield block.parse(text)
+                return
+            # (position, first token, footnotes defined before) of blocks
+            blocks = []
+            position = index = 0
+            footnotes = len(block.def_footnotes)
+            for source in block.parse_blocks(text):
+                blocks.append((position, index, footnotes))
+                position += len(source)
+                index = len(block.tokens)
+                footnotes = len(block.def_footnotes)
+            tokens = block.tokens
+            blocks.append((len(text), len(tokens), footnotes))
+            keep = max(0, len(blocks) - 4)
+            for i in range(keep):
+                (start, index, _), (end, next_index, _) = blocks[i:i + 2]
+                token = tokens[index] if index < next_index else None
+                if _open_block(text[start:end], token):
+                    keep = i
+                    break
+            start, index, footnotes = blocks[keep]
+            rest = text[start:]
+            del tokens[index:]
+            for key in list(block.def_footnotes)[footnotes:]:
+                del block.def_footnotes[key]
+            yield tokens
+
+    def _output_footnotes(self, keys):
+        """Render footnotes referenced in the document, like
+        ``mistune.Markdown.parse``."""
+        footnotes = sorted(
+            (note for note in self.footnotes if keys.get(note['key'])),
+            key=lambda note: keys[note['key']],
+        )
+        self.footnotes = []
+        if not footnotes:
+            return self.renderer.placeholder()
+        return self.renderer.footnotes(self.renderer.join_blocks([
+            self.renderer.footnote_item(note['key'], note['text'])
+            for note in footnotes]))
+
+    def output_block_quote(self):
+        return self.renderer.block_quote(
+            self._output_body('block_quote_end'))
+
+    def output_footnote(self):
+        self.inline._in_footnote = True
+        key = self.token['key']
+        text = self.renderer.join_blocks(self._output_body('footnote_end'))
+        self.footnotes.append({'key': key, 'text': text})
+        self.inline._in_footnote = False
+        return self.renderer.placeholder()
+
+    def output_list(self):
+        ordered = self.token['ordered']
+        items = []
+        while self.pop()['type'] != 'list_end':
+            items.append(self.tok())
+        return self.renderer.list(items, ordered)
+
+    def output_list_item(self):
+        body = []
+        while self.pop()['type'] != 'list_item_end':
+            if self.token['type'] == 'text':
+                body.append(self.tok_text())
+            else:
+                body.append(self.tok())
+        return self.renderer.list_item(body)
+
+    def output_loose_item(self):
+        return self.renderer.list_item(
+            self._output_body('list_item_end'))
+
+    def output_table(self):
+        aligns = self.token['align']
+        header = self._output_table_row(self.token['header'], aligns, True)
+        body = [self._output_table_row(row, aligns, False)
+                for row in self.token['cells']]
+        return self.renderer.table(header, body)
+
+    def _output_table_row(self, row, aligns, header):
+        cells = []
+        for i, value in enumerate(row):
+            align = aligns[i] if i < len(aligns) else None
+            cells.append(self.renderer.table_cell(
+                self.inline(value), header=header, align=align))
+        return self.renderer.table_row(cells)
 
     def output_directive(self):
         return self.renderer.directive(self.token['text'])
@@ -524,39 +1713,819 @@ class M2R(mistune.Markdown):
         return self.renderer.rest_code_block()
 
     def post_process(self, text):
-        output = (text
-                  .replace('\\ \n', '\n')
-                  .replace('\n\\ ', '\n')
-                  .replace(' \\ ', ' ')
-                  .replace('\\  ', ' ')
-                  .replace('\\ .', '.')
-                  )
         if self.renderer._include_raw_html:
-            return prolog + output
+            return prolog + text
         else:
-            return output
+            return text
+
+
+# characters which may start reST inline markups in plain text
+_rest_markup_re = re.compile(r'[*`|\\@:]|_(?!\w)')
+# paragraphs which may be reST blocks like line blocks, field lists, tables,
+# enumerated lists, option lists, section titles and definition lists
+_rest_block_re = re.compile(
+    r'\A(?:\|(?: |$)|:[^:\s`][^:`]*:(?: |$)|>>>(?: |$)|\+-|=+ +=|__ |'
+    r'\(?(?:\d+|#|[a-zA-Z]|[ivxlcdmIVXLCDM]+)[.)] |--?\w)'
+    r'|\n\s'
+    r'|^([!-/:-@\[-`{-~])\1* *$',
+    re.MULTILINE,
+)
+
+
+class DocutilsRenderer(RestRenderer):
+    """Renderer which builds docutils nodes instead of reST text.
+
+    Block methods return lists of nodes and inline methods return lists of
+    nodes or strings. Strings are plain text which may include reST markups,
+    so the outermost text is parsed by the reST inliner as in reST documents.
+    Embedded reST directives are parsed by the reST parser. :meth:`setup`
+    must be called with the target document before rendering.
+    """
+
+    def setup(self, document):
+        """Prepare to render markdown into ``document``."""
+        from docutils.parsers.rst import languages, states
+        self.document = document
+        self.inliner = states.Inliner()
+        self.inliner.init_customizations(document.settings)
+        self.memo = states.Struct(
+            document=document,
+            reporter=document.reporter,
+            language=languages.get_language(
+                document.settings.language_code, document.reporter),
+            title_styles=[],
+            section_level=0,
+            section_bubble_up_kludge=False,
+            inliner=self.inliner,
+        )
+        if not hasattr(document.reporter, 'get_source_and_line'):
+            # used by roles and directives to locate messages
+            document.reporter.get_source_and_line = partial(
+                _source_and_line, document['source'])
+        self.state_machine = None
+        self.line = 0  # markdown line of the current top-level block
+        self.raw_html_role = False
+        self.messages = []
+        self.title_styles = []
+        self.section_level = 0
+        self.section_depths = {}
+
+    def placeholder(self):
+        return []
+
+    def join_blocks(self, parts):
+        return [node for part in parts for node in part]
+
+    def join_inline(self, pieces, outermost=False):
+        result = []
+        text = []
+        for piece in pieces:
+            if isinstance(piece, str):
+                text.append(piece)
+                continue
+            if text:
+                result.extend(self._text(''.join(text), outermost))
+                text = []
+            result.extend(piece)
+        if text:
+            result.extend(self._text(''.join(text), outermost))
+        return result
+
+    def _text(self, text, outermost):
+        # reST markups are not parsed in other markups
+        if outermost and _rest_markup_re.search(text):
+            return self._parse_inline(text)
+        return [nodes.Text(text)]
+
+    def _parse_inline(self, text):
+        """Parse reST inline ``text`` by the inliner."""
+        result, messages = self.inliner.parse(text, self.line + 1,
+                                              self.memo, nodes.Element())
+        self.messages.extend(messages)
+        return result
+
+    def _parse_rest(self, text, offset=0):
+        """Parse reST ``text`` starting at markdown line ``offset`` by the
+        reST parser and return the nodes."""
+        from docutils import statemachine
+        from docutils.parsers.rst import states
+        document = self.document
+        if self.state_machine is None:
+            self.state_machine = states.RSTStateMachine(
+                state_classes=states.state_classes, initial_state='Body',
+                debug=document.reporter.debug_flag)
+        start = len(document)
+        lines = statemachine.string2lines(
+            text, document.settings.tab_width, convert_whitespace=True)
+        try:
+            self.state_machine.run(lines, document, input_offset=offset,
+                                   inliner=self.inliner)
+        finally:
+            # run() attaches it every time
+            del self.state_machine.observers[:]
+        result = document[start:]
+        del document[start:]
+        return result
+
+    def rest_block(self, text, raw_html=False):
+        """Parse reST ``text``, which may use the raw-html role if
+        ``raw_html`` is true."""
+        offset = self.line
+        if raw_html and not self.raw_html_role:
+            self.raw_html_role = True
+            text = prolog + text
+            offset = max(0, offset - prolog.count('\n'))
+        return self._parse_rest(text, offset)
+
+    def _pop_messages(self):
+        messages = self.messages
+        self.messages = []
+        return messages
+
+    def _paragraph(self, text):
+        return [nodes.paragraph('', '', *text)] + self._pop_messages()
+
+    def _raw_html(self, html):
+        return nodes.raw('', html, format='html', classes=['raw-html-m2r'])
+
+    def _image(self, src, target, alt):
+        reference = nodes.reference(refuri=''.join(target.split()))
+        reference += nodes.image(uri=''.join(src.split()), alt=alt)
+        return [reference]
+
+    def block_code(self, code, lang=None):
+        if lang == 'math':
+            return self._parse_rest(
+                str(super(DocutilsRenderer, self).block_code(code, lang)))
+        # leading and trailing blank lines are not in reST literal blocks
+        code = code.strip('\n')
+        node = nodes.literal_block(code, code)
+        if lang:
+            # same as sphinx's code-block directive
+            node['force'] = False
+            node['language'] = lang
+            node['highlight_args'] = {}
+        return [node]
+
+    def block_quote(self, text):
+        return [nodes.block_quote('', *self.join_blocks(text))]
+
+    def block_html(self, html):
+        return [nodes.raw('', html.strip('\n'), format='html')]
+
+    def header(self, text, level, raw=None):
+        """Rendering a section of the document. The section is filled by
+        :meth:`build_sections`.
+
+        Title levels are decided by the order of appearance like reST
+        section titles.
+        """
+        styles = self.title_styles
+        if level in styles:
+            depth = styles.index(level) + 1
+        elif len(styles) == self.section_level:
+            styles.append(level)
+            depth = len(styles)
+        else:
+            depth = None
+        if depth is None or depth > self.section_level + 1:
+            self._pop_messages()
+            return [self.document.reporter.severe(
+                'Title level inconsistent:', nodes.literal_block('', raw))]
+        self.section_level = depth
+        section = nodes.section()
+        title = nodes.title('', '', *text)
+        section['names'].append(nodes.fully_normalize_name(title.astext()))
+        section += title
+        section += self._pop_messages()
+        self.document.note_implicit_target(section, section)
+        self.section_depths[id(section)] = depth
+        return [section]
+
+    def rubric(self, text):
+        """Rendering a heading in other blocks, where sections are not
+        allowed."""
+        return [nodes.rubric('', '', *text)] + self._pop_messages()
+
+    def build_sections(self, children):
+        """Move ``children`` of the document into the sections rendered by
+        :meth:`header`."""
+        root = []
+        stack = [root]
+        for node in children:
+            depth = self.section_depths.get(id(node))
+            if depth is not None:
+                del stack[depth:]
+                stack[-1].append(node)
+                stack.append(node)
+            else:
+                stack[-1].append(node)
+        self.section_depths = {}
+        return root
+
+    def hrule(self):
+        return [nodes.transition()]
+
+    def list(self, body, ordered=True):
+        if ordered:
+            node = nodes.enumerated_list(enumtype='arabic', prefix='',
+                                         suffix='.')
+        else:
+            node = nodes.bullet_list(bullet='*')
+        node.extend(self.join_blocks(body))
+        return [node]
+
+    def list_item(self, text):
+        return [nodes.list_item('', *self.join_blocks(text))]
+
+    def paragraph(self, text):
+        blocks = [node for node in text
+                  if not (isinstance(node, nodes.Text) and node.isspace())]
+        if blocks and all(isinstance(node, nodes.reference) and
+                          len(node) == 1 and isinstance(node[0], nodes.image)
+                          for node in blocks):
+            # standalone images like image directive
+            return blocks + self._pop_messages()
+        if not text:
+            return []
+        return self._paragraph(text)
+
+    def table(self, header, body):
+        body = [row for part in body for row in part]
+        rows = header + body
+        if not rows:
+            return []
+        cols = max(len(row) for row in rows)
+        for row in rows:
+            row.extend(nodes.entry() for _ in range(cols - len(row)))
+        table = nodes.table()
+        tgroup = nodes.tgroup(cols=cols)
+        table += tgroup
+        for _ in range(cols):
+            tgroup += nodes.colspec(colwidth=100 // cols)
+        if header:
+            tgroup += nodes.thead('', *header)
+        tgroup += nodes.tbody('', *body)
+        return [table]
+
+    def table_row(self, content):
+        if not content:
+            return []
+        return [nodes.row('', *[entry for cell in content for entry in cell])]
+
+    def table_cell(self, content, **flags):
+        entry = nodes.entry()
+        if content:
+            entry.extend(self._paragraph(content))
+        return [entry]
+
+    def double_emphasis(self, text):
+        return [nodes.strong('', '', *text)]
 
+    def emphasis(self, text):
+        return [nodes.emphasis('', '', *text)]
+
+    def codespan(self, text):
+        text = text.rstrip()
+        return [nodes.literal(text, text)]
+
+    def linebreak(self):
+        html = '<br />' if self.options.get('use_xhtml') else '<br>'
+        return [self._raw_html(html), nodes.Text('\n')]
+
+    def strikethrough(self, text):
+        # the tags are split around the inner nodes, so they are not wrapped
+        # in spans of the raw-html-m2r class like other raw html
+        return ([nodes.raw('', '<del>', format='html')] + text +
+                [nodes.raw('', '</del>', format='html')])
+
+    def escape(self, text):
+        return [nodes.Text(text)]
+
+    def autolink(self, link, is_email=False):
+        uri = 'mailto:' + link if is_email else link
+        return [nodes.reference(link, link, refuri=uri)]
+
+    def link(self, link, title, text):
+        if not text:
+            text = [nodes.Text(link)]
+        if title:
+            return [nodes.reference('', '', *text, refuri=link,
+                                    reftitle=title)]
+        content = ''.join(node.astext() for node in text)
+        role = self._relative_link_role(link, content)
+        if role:
+            return self._parse_inline(role)
+        uri = ''.join(link.split())
+        if self.inliner.patterns.email.match(uri):
+            uri = 'mailto:' + uri
+        reference = nodes.reference(
+            '', '', *text, name=nodes.whitespace_normalize_name(content),
+            refuri=uri)
+        if self.anonymous_references:
+            return [reference]
+        # named references define targets like reST
+        target = nodes.target('', refuri=uri)
+        target.referenced = 1
+        target['names'].append(nodes.fully_normalize_name(content))
+        self.document.note_explicit_target(target)
+        return [reference, target]
+
+    def image(self, src, title, text):
+        return self._image(src, src, text)
+
+    def inline_html(self, html):
+        return [self._raw_html(html)]
+
+    def newline(self):
+        return []
+
+    def footnote_ref(self, key, index):
+        refnode = nodes.footnote_reference('[#fn-{}]_'.format(key))
+        refnode['auto'] = 1
+        self.document.note_autofootnote_ref(refnode)
+        refnode['refname'] = nodes.fully_normalize_name('fn-' + key)
+        self.document.note_footnote_ref(refnode)
+        return [refnode]
+
+    def footnote_item(self, key, text):
+        footnote = nodes.footnote()
+        footnote['auto'] = 1
+        footnote['names'].append(nodes.fully_normalize_name('fn-' + key))
+        self.document.note_autofootnote(footnote)
+        self.document.note_explicit_target(footnote, footnote)
+        footnote.extend(text)
+        return [footnote]
+
+    def footnotes(self, text):
+        return text
+
+    def image_link(self, url, target, alt):
+        return self._image(url, target, alt)
+
+    def rest_role(self, text):
+        return self._parse_inline(text)
+
+    def rest_link(self, text):
+        return self._parse_inline(text)
+
+    def inline_math(self, math):
+        return self._parse_inline(':math:`{}`'.format(math))
+
+    def directive(self, text):
+        return self.rest_block(text)
+
+    def rest_code_block(self):
+        return []
+
+
+def _source_and_line(source, lineno=None):
+    return source, lineno
+
+
+class DocutilsM2R(M2R):
+    """Markdown parser which builds docutils nodes by
+    :class:`DocutilsRenderer`."""
+
+    def __init__(self, renderer=None, config=None, **kwargs):
+        config = _pop_config(kwargs, config)
+        if renderer is None:
+            renderer = DocutilsRenderer(config, **kwargs)
+        super(DocutilsM2R, self).__init__(renderer, config=config, **kwargs)
+        self._options = kwargs
+        self._rest_inline = None
+
+    def _clone(self):
+        clone = super(DocutilsM2R, self)._clone()
+        clone._rest_inline = None
+        return clone
+
+    def parse(self, text, document):
+        """Render markdown ``text`` and return the nodes to be inserted into
+        ``document``."""
+        with self._worker() as worker:
+            return worker._parse(text, document)
+
+    def _parse(self, text, document):
+        self.reset()
+        self.renderer.setup(document)
+        children = self._output_document(mistune.preprocessing(text))
+        return self.renderer.build_sections(children)
+
+    def reset(self):
+        super(DocutilsM2R, self).reset()
+        self._depth = 0
+
+    def _output_body(self, end=None):
+        if end is None:
+            return self._output_top_level()
+        self._depth += 1
+        try:
+            return super(DocutilsM2R, self)._output_body(end)
+        finally:
+            self._depth -= 1
+
+    def _output_top_level(self):
+        """Render top-level blocks, locating their nodes at their markdown
+        lines."""
+        body = []
+        source = self.renderer.document['source']
+        while self.pop():
+            lines = self.token.get('lines')
+            if lines is not None:
+                self.renderer.line = lines[0]
+            part = self.tok()
+            for node in part:
+                if isinstance(node, nodes.Element) and node.line is None:
+                    node.source = source
+                    node.line = self.renderer.line + 1
+            body.append(part)
+        return body
+
+    def output_heading(self):
+        text = self.inline(self.token['text'])
+        if self._depth:
+            return self.renderer.rubric(text)
+        return self.renderer.header(text, self.token['level'],
+                                    self.token['text'])
+
+    def output_list_item(self):
+        # tight items are paragraphs in reST too
+        return self.output_loose_item()
+
+    def output_paragraph(self):
+        return self._output_paragraph(self.token['text'])
+
+    def output_text(self):
+        text = self.token['text']
+        while self.peek()['type'] == 'text':
+            text += '\n' + self.pop()['text']
+        return self._output_paragraph(text)
+
+    def _output_paragraph(self, text):
+        if not _rest_block_re.search(text):
+            return self.renderer.paragraph(self.inline(text))
+        # may be reST markups, which are parsed by the reST parser like
+        # converted reST documents
+        inline = self._rest_inline
+        if inline is None:
+            inline = self._rest_inline = RestInlineLexer(
+                RestRenderer(self.config, **self._options),
+                config=self.config, **self._options)
+        inline.setup(self.inline.links, self.inline.footnotes)
+        inline.footnote_index = self.inline.footnote_index
+        inline._in_footnote = self.inline._in_footnote
+        inline.renderer._include_raw_html = False
+        text = inline(text)
+        self.inline.footnote_index = inline.footnote_index
+        return self.renderer.rest_block(
+            text, raw_html=inline.renderer._include_raw_html)
+
+
+_fence_re = re.compile(r' *(`{3,}|~{3,})')
+_list_item_re = re.compile(r'(?:[*+-]|\d+\.)(?:[ \t]|$)')
+_html_block_re = re.compile(r' *<(!--|[a-zA-Z][\w-]*)')
+_void_tags = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+def _iter_chunks(lines, chunk_size):
+    """Yield chunks of :func:`_iter_blocks` and whether each is the last."""
+    chunks = _iter_blocks(lines, chunk_size)
+    chunk = next(chunks, '')
+    while chunk:
+        next_chunk = next(chunks, '')
+        yield chunk, not next_chunk
+        chunk = next_chunk
+
+
+def _iter_blocks(lines, chunk_size):
+    """Join ``lines`` into markdown chunks ending at top-level blocks.
+
+    A chunk is split only before an unindented line following a blank line,
+    and not inside fenced code or block html, before list items and block
+    quotes which may continue the previous block, or after reST directives
+    whose extent is decided by the next block. These are only likely
+    boundaries; :meth:`M2R._iter_tokens` lexes again the blocks around them
+    which mistune may lex across them.
+    """
+    chunk = []
+    size = 0
+    fence = None  # marker of the open code fence
+    html_end = None  # end of the open html block
+    blank = True  # previous line is blank
+    hold = False  # the current block must not end a chunk
+    for line in lines:
+        if (blank and not hold and size >= chunk_size and
+                fence is None and html_end is None and
+                line[:1] not in ('', ' ', '\t', '\n', '>') and
+                not _list_item_re.match(line)):
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+        chunk.append(line)
+        size += len(line)
+        if fence is not None:
+            if line.rstrip().endswith(fence):
+                fence = None
+            continue
+        if html_end is not None:
+            if html_end in line:
+                html_end = None
+            continue
+        if not line.strip():
+            blank = True
+            continue
+        if blank and line[:1] not in (' ', '\t'):
+            # first line of a top-level block
+            hold = line.startswith('..')
+        blank = False
+        m = _fence_re.match(line)
+        if m:
+            fence = m.group(1)
+            continue
+        m = _html_block_re.match(line)
+        if m:
+            tag = m.group(1)
+            if tag == '!--':
+                end = '-->'
+            elif tag.lower() not in _void_tags:
+                end = '</{}'.format(tag)
+            else:
+                continue
+            if end not in line[m.end():]:
+                html_end = end
+    if chunk:
+        yield ''.join(chunk)
+
+
+_converters = {}
+
+
+def _get_converter(config, cls=M2R):
+    """Return a converter of ``cls`` for the sphinx ``config``.
+
+    Converters are cached by the ``m2r_*`` config values, so they are built
+    once per build and shared by all documents and ``mdinclude`` directives.
+    """
+    key = M2RConfig.from_sphinx_config(config)
+    converter = _converters.get((cls, key))
+    if converter is None:
+        converter = _converters[cls, key] = cls(config=key)
+    return converter
+
+
+# conversion caches of sphinx builds by directory
+_caches = {}
+
+
+def _get_cache(env):
+    """Return the :class:`ConversionCache` shared by all workers of the build
+    of ``env``, or None if the ``m2r_rest_cache`` option is off.
+
+    Only conversions to reST text are cached. Nodes of the default parser
+    are built against the document being read, and loading them would take
+    about as long as building them.
+    """
+    if not env.config.m2r_rest_cache:
+        return None
+    directory = os.path.join(env.doctreedir, 'm2r-cache')
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = ConversionCache(directory)
+    return cache
+
+
+def _convert_cached(env, converter, text):
+    """Convert markdown ``text`` to reST and its :class:`SourceMap` by
+    ``converter`` through the conversion cache of the build.
+
+    The source map is cached on the first line of the entry.
+    """
+    cache = _get_cache(env)
+    if cache is None:
+        return converter.parse_with_source_map(text)
+    key = cache.key(text.encode('utf-8'), config=converter.config,
+                    source_map=True)
+    cached = cache.get(key)
+    _count_cache(env, 'conversion', cached is not None)
+    if cached is None:
+        output, source_map = converter.parse_with_source_map(text)
+        cache.set(key, '%s\n%s' % (source_map, output))
+        return output, source_map
+    source_map, _, output = cached.partition('\n')
+    return output, SourceMap.from_string(source_map)
+
+
+class _LRUCache(object):
+    """Least-recently-used cache whose total size is limited by ``maxsize``.
+
+    Size of each value is given by the caller when it is stored.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return item[0]
+
+    def set(self, key, value, size):
+        if key in self._data:
+            self.size -= self._data.pop(key)[1]
+        if size > self.maxsize:
+            return
+        self._data[key] = (value, size)
+        self.size += size
+        self._evict()
+
+    def resize(self, maxsize):
+        """Limit the total size to ``maxsize``, evicting values over it."""
+        self.maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.maxsize:
+            self.size -= self._data.popitem(last=False)[1][1]
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+
+# converted lines of mdinclude-ed files
+_mdinclude_cache = _LRUCache(16 * 1024 * 1024)
+
+
+class _LineIndex(object):
+    """Byte offsets of lines in a UTF-8 file, which are split as
+    ``str.splitlines``.
+
+    The offset of every ``step``-th line is found when the index is built,
+    and offsets of lines between them are found on lookup. The file is read
+    by mmap, so only the looked-up bytes are loaded.
+    """
+
+    step = 1024
+    # line ends of str.splitlines in UTF-8
+    _other_ends = (b'\r', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e',
+                   b'\xc2\x85', b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+    _simple_line = br'[^\n]*\n'
+    _line = (
+        br'[^\n\r\x0b\x0c\x1c-\x1e\x85\xa8\xa9]*'
+        br'(?:(?:(?<!\xc2)\x85|(?<!\xe2\x80)[\xa8\xa9])'
+        br'[^\n\r\x0b\x0c\x1c-\x1e\x85\xa8\xa9]*)*'
+        br'(?:\r\n|\r(?!\n)|[\n\x0b\x0c\x1c-\x1e]'
+        br'|(?<=\xc2)\x85|(?<=\xe2\x80)[\xa8\xa9])'
+    )
+
+    def __init__(self, path):
+        import mmap
+        stat = os.stat(path)
+        self.path = path
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        self.size = stat.st_size
+        self.offsets = [0]
+        self.lines = 0
+        if not self.size:
+            return
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            line = self._simple_line
+            if any(data.find(end) >= 0 for end in self._other_ends):
+                line = self._line
+            self._line_re = re.compile(line)
+            block = re.compile(b'(?:' + line + b'){%d}' % self.step)
+            m = block.match(data)
+            while m:
+                self.offsets.append(m.end())
+                m = block.match(data, m.end())
+            self.lines = (len(self.offsets) - 1) * self.step
+            pos = self.offsets[-1]
+            m = self._line_re.match(data, pos)
+            while m:
+                self.lines += 1
+                pos = m.end()
+                m = self._line_re.match(data, pos)
+            if pos < self.size:
+                # the last line without line end
+                self.lines += 1
+
+    def _offset(self, data, line):
+        if line >= self.lines:
+            return self.size
+        pos = self.offsets[line // self.step]
+        for _ in range(line % self.step):
+            pos = self._line_re.match(data, pos).end()
+        return pos
+
+    def read(self, start, end):
+        """Return bytes of lines ``[start:end]`` (as list slicing)."""
+        import mmap
+        start, end, _ = slice(start, end).indices(self.lines)
+        if start >= end:
+            return b''
+        with open(self.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data[self._offset(data, start):self._offset(data, end)]
+
+
+# line indexes of mdinclude-ed files by path
+_line_indexes = {}
+
+
+def _read_lines(path, start, end, encoding, errors='strict'):
+    """Return lines ``[start:end]`` of file ``path`` decoded by ``encoding``,
+    or None if the file is not UTF-8 or ASCII.
+
+    Lines are read by a :class:`_LineIndex`, which is built once for each
+    version of the file.
+    """
+    import codecs
+    name = codecs.lookup(encoding).name
+    if name not in ('utf-8', 'utf-8-sig', 'ascii'):
+        return None
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    index = _line_indexes.get(key)
+    if index is None or index.version != (stat.st_mtime_ns, stat.st_size):
+        index = _line_indexes[key] = _LineIndex(path)
+    data = index.read(start, end)
+    if name == 'utf-8-sig' and slice(start, end).indices(index.lines)[0]:
+        # a byte order mark is skipped only at the start of the file
+        name = 'utf-8'
+    # normalize newlines as docutils.io.FileInput
+    return '\n'.join(data.decode(name, errors).splitlines() + [''])
+
+
+class _M2RParserMixin(object):
+    """Markdown parser of docutils and sphinx, based on
+    ``docutils.parsers.rst.Parser``."""
 
-class M2RParser(rst.Parser, object):
     # Explicitly tell supported formats to sphinx
     supported = ('markdown', 'md', 'mkd')
 
     def parse(self, inputstrings, document):
+        from docutils import statemachine
+        from docutils.parsers.rst import roles
         if isinstance(inputstrings, statemachine.StringList):
             inputstring = '\n'.join(inputstrings)
         else:
             inputstring = inputstrings
         config = document.settings.env.config
-        converter = M2R(
-            no_underscore_emphasis=config.no_underscore_emphasis,
-            parse_relative_links=config.m2r_parse_relative_links,
-            anonymous_references=config.m2r_anonymous_references,
-            disable_inline_math=config.m2r_disable_inline_math
-        )
-        super(M2RParser, self).parse(converter(inputstring), document)
+        if config.m2r_rest_parser:
+            rest, source_map = _convert_cached(
+                document.settings.env, _get_converter(config), inputstring)
+            self._parse_rest(rest, source_map, document)
+            return
+        self.setup_parse(inputstring, document)
+        converter = _get_converter(config, DocutilsM2R)
+        document.extend(converter.parse(inputstring, document))
+        # restore the default role changed by directives like rst.Parser
+        roles._roles.pop('', None)
+        self.finish_parse()
+
+    def _parse_rest(self, rest, source_map, document):
+        """Parse converted ``rest`` like ``rst.Parser.parse``, with line
+        offsets of the markdown source."""
+        from docutils.parsers.rst import roles, states
+        self.setup_parse(rest, document)
+        settings = document.settings
+        settings.setdefault('tab_width', 8)
+        self.statemachine = states.RSTStateMachine(
+            state_classes=self.state_classes,
+            initial_state=self.initial_state,
+            debug=document.reporter.debug_flag)
+        lines = source_map.string_list(rest, document.current_source,
+                                       settings.tab_width)
+        limit = getattr(settings, 'line_length_limit', None)
+        for i, line in enumerate(lines):
+            if limit is not None and len(line) > limit:
+                document.append(document.reporter.error(
+                    'Line %d exceeds the line-length-limit.'
+                    % (lines.offset(i) + 1)))
+                break
+        else:
+            self.statemachine.run(lines, document, inliner=self.inliner)
+        roles._roles.pop('', None)
+        self.finish_parse()
 
 
-class MdInclude(rst.Directive):
+class _MdIncludeMixin(object):
     """Directive class to include markdown in sphinx.
 
     Load a file and convert it to rst and insert as a node. Currently
@@ -574,6 +2543,7 @@ class MdInclude(rst.Directive):
 
         docutils version: 0.12
         """
+        from docutils.parsers import rst
         if not self.state.document.settings.file_insertion_enabled:
             raise self.warning('"%s" directive disabled.' % self.name)
         source = self.state_machine.input_lines.source(
@@ -591,6 +2561,19 @@ class MdInclude(rst.Directive):
         tab_width = self.options.get(
             'tab-width', self.state.document.settings.tab_width)
 
+        startline = self.options.get('start-line', None)
+        endline = self.options.get('end-line', None)
+        env = self.state.document.settings.env
+        cache_key = self._cache_key(path, startline, endline, encoding,
+                                    tab_width, env.config)
+        if cache_key is not None:
+            include_lines = _mdinclude_cache.get(cache_key)
+            _count_cache(env, 'mdinclude', include_lines is not None)
+            if include_lines is not None:
+                self.state.document.settings.record_dependencies.add(path)
+                self.state_machine.insert_input(include_lines, path)
+                return []
+
         # open the including file
         try:
             self.state.document.settings.record_dependencies.add(path)
@@ -607,10 +2590,14 @@ class MdInclude(rst.Directive):
                               (self.name, io.error_string(error)))
 
         # read from the file
-        startline = self.options.get('start-line', None)
-        endline = self.options.get('end-line', None)
         try:
-            if startline or (endline is not None):
+            rawtext = None
+            if (startline or (endline is not None)) and encoding:
+                rawtext = _read_lines(path, startline, endline, encoding,
+                                      e_handler)
+            if rawtext is not None:
+                include_file.close()
+            elif startline or (endline is not None):
                 lines = include_file.readlines()
                 rawtext = ''.join(lines[startline:endline])
             else:
@@ -619,19 +2606,92 @@ class MdInclude(rst.Directive):
             raise self.severe('Problem with "%s" directive:\n%s' %
                               (self.name, io.error_string(error)))
 
-        config = self.state.document.settings.env.config
-        converter = M2R(
-            no_underscore_emphasis=config.no_underscore_emphasis,
-            parse_relative_links=config.m2r_parse_relative_links,
-            anonymous_references=config.m2r_anonymous_references,
-            disable_inline_math=config.m2r_disable_inline_math
-        )
-        include_lines = statemachine.string2lines(converter(rawtext),
-                                                  tab_width,
-                                                  convert_whitespace=True)
+        rest, source_map = _convert_cached(env, _get_converter(env.config),
+                                           rawtext)
+        include_lines = source_map.string_list(rest, path, tab_width)
+        offset = self._start_offset(path, startline, endline)
+        if offset:
+            include_lines.items = [(source, line + offset)
+                                   for source, line in include_lines.items]
+        if cache_key is not None:
+            _mdinclude_cache.set(cache_key, include_lines,
+                                 sum(sys.getsizeof(line) + 64
+                                     for line in include_lines))
         self.state_machine.insert_input(include_lines, path)
         return []
 
+    def _start_offset(self, path, startline, endline):
+        """Return the file line of ``start-line``."""
+        if not startline or startline > 0:
+            return startline or 0
+        # from the end of the file, whose lines are counted by the index
+        index = _line_indexes.get(os.path.abspath(path))
+        if index is None:
+            index = _LineIndex(path)
+        return slice(startline, endline).indices(index.lines)[0]
+
+    def _cache_key(self, path, startline, endline, encoding, tab_width,
+                   config):
+        """Return a key of the conversion cache, or None if not cacheable."""
+        if not config.m2r_mdinclude_cache_size:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # error is reported on opening the file
+            return None
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size,
+                startline, endline, encoding, tab_width,
+                M2RConfig.from_sphinx_config(config))
+
+
+def _resize_mdinclude_cache(app, config):
+    _mdinclude_cache.resize(config.m2r_mdinclude_cache_size)
+
+
+def _count_cache(env, cache, hit):
+    """Record a hit or miss of ``cache`` (``'mdinclude'`` or
+    ``'conversion'``) for the current document.
+
+    Counts are stored in the build environment, so that they are merged from
+    parallel readers.
+    """
+    if not hasattr(env, 'm2r_cache_stats'):
+        env.m2r_cache_stats = {}
+    counts = env.m2r_cache_stats.setdefault(env.docname, {})
+    counts.setdefault(cache, [0, 0])[0 if hit else 1] += 1
+
+
+def _purge_cache_stats(app, env, docname):
+    getattr(env, 'm2r_cache_stats', {}).pop(docname, None)
+
+
+def _merge_cache_stats(app, env, docnames, other):
+    if not hasattr(env, 'm2r_cache_stats'):
+        env.m2r_cache_stats = {}
+    other_stats = getattr(other, 'm2r_cache_stats', {})
+    for docname in docnames:
+        if docname in other_stats:
+            env.m2r_cache_stats[docname] = other_stats[docname]
+
+
+def _start_cache_stats(app, env, docnames):
+    env.m2r_read_docnames = set(docnames)
+
+
+def _report_cache_stats(app, env):
+    from sphinx.util import logging
+    stats = getattr(env, 'm2r_cache_stats', {})
+    for cache in ('mdinclude', 'conversion'):
+        hits = misses = 0
+        for docname in getattr(env, 'm2r_read_docnames', ()):
+            counts = stats.get(docname, {}).get(cache, (0, 0))
+            hits += counts[0]
+            misses += counts[1]
+        if hits or misses:
+            logging.getLogger(__name__).info(
+                'm2r: %s cache: %d hits, %d misses', cache, hits, misses)
+
 
 def setup(app):
     """When used for sphinx extension."""
@@ -641,12 +2701,20 @@ def setup(app):
     app.add_config_value('m2r_parse_relative_links', False, 'env')
     app.add_config_value('m2r_anonymous_references', False, 'env')
     app.add_config_value('m2r_disable_inline_math', False, 'env')
+    app.add_config_value('m2r_rest_parser', False, 'env')
+    app.add_config_value('m2r_mdinclude_cache_size', 16 * 1024 * 1024, '')
+    app.add_config_value('m2r_rest_cache', False, '')
     if hasattr(app, 'add_source_suffix'):
         app.add_source_suffix('.md', 'markdown')
-        app.add_source_parser(M2RParser)
+        app.add_source_parser(_lazy('M2RParser'))
     else:
-        app.add_source_parser('.md', M2RParser)
-    app.add_directive('mdinclude', MdInclude)
+        app.add_source_parser('.md', _lazy('M2RParser'))
+    app.add_directive('mdinclude', _lazy('MdInclude'))
+    app.connect('config-inited', _resize_mdinclude_cache)
+    app.connect('env-before-read-docs', _start_cache_stats)
+    app.connect('env-purge-doc', _purge_cache_stats)
+    app.connect('env-merge-info', _merge_cache_stats)
+    app.connect('env-updated', _report_cache_stats)
     metadata = dict(
         version=__version__,
         parallel_read_safe=True,
@@ -655,16 +2723,609 @@ def setup(app):
     return metadata
 
 
-def convert(text, **kwargs):
-    return M2R(**kwargs)(text)
+def convert(text, config=None, **kwargs):
+    """Convert markdown ``text`` to reST with ``config`` (a
+    :class:`M2RConfig`)."""
+    return M2R(config=config, **kwargs)(text)
+
+
+class _RuleStats(object):
+    __slots__ = ('attempts', 'hits', 'seconds')
+
+    def __init__(self):
+        self.attempts = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+
+class _CallStats(object):
+    __slots__ = ('calls', 'seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+
+class Profile(object):
+    """Statistics recorded in a :func:`profile` block.
+
+    ``rules`` maps ``block.<rule>`` and ``inline.<rule>`` to the number of
+    match ``attempts``, ``hits`` and ``seconds`` spent in matching and
+    handling the rule. ``methods`` maps ``<Renderer>.<method>`` to the
+    number of ``calls`` and ``seconds``. Times include nested rules and
+    calls, like cumulative times of :mod:`cProfile`.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.methods = {}
+        self._patched = []
+
+    def _rule(self, kind, key):
+        name = kind + '.' + key
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = _RuleStats()
+        return stats
+
+    def time_rule(self, kind, key, match, handle):
+        """Return ``match`` and ``handle`` functions of a lexer rule which
+        record its attempts, hits and time.
+
+        Used by :meth:`RestBlockLexer.parse_blocks` and
+        :meth:`RestInlineLexer.output` while profiling. A rule hits when it
+        matches and its handler does not return None.
+        """
+        stat = self._rule(kind, key)
+        timer = time.perf_counter
+
+        def timed_match(*args):
+            start = timer()
+            try:
+                return match(*args)
+            finally:
+                stat.attempts += 1
+                stat.seconds += timer() - start
+
+        def timed_handle(m):
+            start = timer()
+            try:
+                out = handle(m)
+            finally:
+                stat.seconds += timer() - start
+            if kind == 'block' or out is not None:
+                stat.hits += 1
+            return out
+        return timed_match, timed_handle
+
+    def _patch_renderers(self):
+        import inspect
+        classes = [RestRenderer]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+            for name, func in list(vars(cls).items()):
+                if name.startswith('_') or not inspect.isfunction(func):
+                    continue
+                self._patched.append((cls, name, func))
+                setattr(cls, name, self._wrap(cls.__name__ + '.' + name,
+                                              func))
+
+    def _unpatch_renderers(self):
+        for cls, name, func in reversed(self._patched):
+            setattr(cls, name, func)
+        self._patched = []
+
+    def _wrap(self, name, func):
+        stats = self.methods[name] = _CallStats()
+        timer = time.perf_counter
+
+        @wraps(func)
+        def method(*args, **kwargs):
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.calls += 1
+                stats.seconds += timer() - start
+        return method
+
+    def report(self):
+        """Return a text report of rules and methods sorted by time."""
+        lines = ['{:<32} {:>10} {:>10} {:>10}'.format(
+            'rule', 'attempts', 'hits', 'seconds')]
+        for name, stats in sorted(self.rules.items(),
+                                  key=lambda item: -item[1].seconds):
+            if stats.attempts:
+                lines.append('{:<32} {:>10} {:>10} {:>10.6f}'.format(
+                    name, stats.attempts, stats.hits, stats.seconds))
+        lines.append('')
+        lines.append('{:<32} {:>10} {:>10}'.format(
+            'renderer method', 'calls', 'seconds'))
+        for name, stats in sorted(self.methods.items(),
+                                  key=lambda item: -item[1].seconds):
+            if stats.calls:
+                lines.append('{:<32} {:>10} {:>10.6f}'.format(
+                    name, stats.calls, stats.seconds))
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profile():
+    """Record lexer rules and renderer methods used in the ``with`` block.
+
+    Yields a :class:`Profile`, which is filled while conversions run in the
+    block. Profiling affects all converters in the process, so blocks can
+    not be nested, and conversions in other threads should not run in the
+    block, as the statistics are not locked.
+    """
+    global _profiler
+    if _profiler is not None:
+        raise RuntimeError('profile() is already active')
+    stats = Profile()
+    stats._patch_renderers()
+    _profiler = stats
+    try:
+        yield stats
+    finally:
+        _profiler = None
+        stats._unpatch_renderers()
+
+
+class ConversionCache(object):
+    """On-disk cache of conversion results.
+
+    Entries are keyed by a hash of the input bytes, m2r version, encoding and
+    converter options, and stored as ``<directory>/<version>/<xx>/<key>.rst``.
+    Entries are written atomically, so a directory can be shared by parallel
+    processes.
+    """
+
+    suffix = '.rst'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, data, **kwargs):
+        """Return a cache key of the input ``data`` (bytes) and options."""
+        import hashlib
+        h = hashlib.sha256()
+        h.update(__version__.encode('utf-8'))
+        h.update(repr(sorted(kwargs.items())).encode('utf-8'))
+        h.update(b'\0')
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, __version__, key[:2],
+                            key + self.suffix)
+
+    def get(self, key):
+        """Return cached text of ``key``, or None if not cached."""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            return None
+        try:
+            # mark as used for prune()
+            os.utime(path)
+        except OSError:
+            pass
+        return text
+
+    def set(self, key, text):
+        import tempfile
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def prune(self, max_age=30 * 24 * 60 * 60):
+        """Remove entries of other m2r versions and entries not used for
+        ``max_age`` seconds. Return the number of removed files.
+        """
+        removed = 0
+        limit = time.time() - max_age
+        for root, dirs, files in os.walk(self.directory, topdown=False):
+            current = (os.path.relpath(root, self.directory)
+                       .split(os.sep)[0] == __version__)
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if current and os.stat(path).st_mtime >= limit:
+                        continue
+                    os.unlink(path)
+                except OSError:
+                    continue
+                removed += 1
+            if root != self.directory:
+                try:
+                    os.rmdir(root)
+                except OSError:  # not empty
+                    pass
+        return removed
+
+
+async def aconvert(text, config=None, executor=None, timeout=None,
+                   **kwargs):
+    """Convert markdown ``text`` like :func:`convert` in ``executor``.
+
+    ``executor`` is a thread or process pool of :mod:`concurrent.futures`
+    (the default executor of the event loop if None). If the conversion
+    does not finish in ``timeout`` seconds, :class:`asyncio.TimeoutError` is
+    raised. A cancelled or timed-out conversion is dropped if it has not
+    started yet; otherwise its thread or process runs to the end, but the
+    result is discarded.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        executor, partial(convert, text, config, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def aconvert_many(texts, concurrency=4, config=None, executor=None,
+                        timeout=None, **kwargs):
+    """Convert markdown ``texts`` by :func:`aconvert` and return the results
+    in input order.
+
+    At most ``concurrency`` documents are submitted to ``executor`` at once,
+    and ``timeout`` applies to each document. If a conversion fails, the
+    others are cancelled and the error is raised.
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(text):
+        async with semaphore:
+            return await aconvert(text, config, executor, timeout, **kwargs)
 
+    tasks = [asyncio.ensure_future(run(text)) for text in texts]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
 
-def parse_from_file(file, encoding='utf-8', **kwargs):
+
+def iter_convert(fileobj, chunk_size=64 * 1024, **kwargs):
+    """Convert markdown read from ``fileobj`` and yield reST in chunks.
+
+    See :meth:`M2R.iter_parse` for details.
+    """
+    return M2R(**kwargs).iter_parse(fileobj, chunk_size)
+
+
+class _RecordingDict(dict):
+    """Dict which records keys tested by ``in`` into ``keys_used``."""
+
+    __slots__ = ('keys_used',)
+
+    def __init__(self, *args, **kwargs):
+        super(_RecordingDict, self).__init__(*args, **kwargs)
+        self.keys_used = set()
+
+    def __contains__(self, key):
+        self.keys_used.add(key)
+        return dict.__contains__(self, key)
+
+
+class _Segment(object):
+    """Top-level blocks of a :class:`ConversionSession` with their tokens,
+    definitions and rendered reST."""
+
+    __slots__ = ('size', 'source', 'tokens', 'links', 'footnote_keys',
+                 'open', 'output', 'link_refs', 'footnote_refs', 'footnotes',
+                 'raw_html')
+
+    def __init__(self, size, source, tokens, links, footnote_keys,
+                 is_open=False):
+        self.size = size  # length of the markdown text
+        self.source = source  # preprocessed text
+        self.tokens = tokens
+        self.links = links  # link definitions
+        self.footnote_keys = footnote_keys  # keys of footnote definitions
+        self.open = is_open  # lexed by text after the segment
+        self.output = ''
+        self.link_refs = frozenset()  # link keys looked up by the output
+        self.footnote_refs = frozenset()
+        self.footnotes = []  # rendered footnote definitions
+        self.raw_html = False
+
+    @property
+    def uses_footnotes(self):
+        return bool(self.footnote_refs or self.footnote_keys)
+
+
+def _skip_footnotes(tokens, keys):
+    """Remove definitions of footnotes ``keys`` from ``tokens``."""
+    result = []
+    skip = False
+    for token in tokens:
+        if token['type'] == 'footnote_start' and token['key'] in keys:
+            skip = True
+        if not skip:
+            result.append(token)
+        elif token['type'] == 'footnote_end':
+            skip = False
+    return result
+
+
+# lines split at the newlines of mistune.preprocessing
+_raw_line_re = re.compile(
+    '[^\r\n\u2424]*(?:\r\n?|[\n\u2424])|[^\r\n\u2424]+')
+# lines which block rules try to close anywhere after them
+_fence_line_re = re.compile(r'^ *(?:`{3,}|~{3,})', re.MULTILINE)
+_html_line_re = re.compile(r' *<(?:!--|%s)' % mistune._block_tag)
+_bracket_line_re = re.compile(r'^ *\[', re.MULTILINE)
+
+
+def _open_block(source, token):
+    """Return True if the top-level block ``source`` whose first token is
+    ``token`` may be lexed differently by a change after it.
+
+    Fenced code, html blocks and link definitions are searched to their
+    closing markers, which may be far after them if they are not closed in
+    the block. Others depend only on the block and the first line after it.
+    """
+    kind = token['type'] if token else None
+    if kind in ('directive', 'open_html'):
+        return False
+    if (kind == 'code' and not source.startswith('    ') and
+            _fence_line_re.match(source)):
+        # fenced code, which is closed in the block
+        return False
+    if kind == 'close_html' and source.lstrip(' ').startswith('<!--'):
+        return False
+    if _html_line_re.match(source) or _fence_line_re.search(source):
+        return True
+    return any(source.find(']', m.end()) < 0
+               for m in _bracket_line_re.finditer(source))
+
+
+class ConversionSession(object):
+    """Markdown document which is converted incrementally as it is edited.
+
+    The document is split into segments of top-level blocks at line starts,
+    and the tokens and reST of each segment are kept. :meth:`edit` lexes
+    again from two segments before the edit, or from the first segment with
+    an unclosed fence, html block or bracket, until the blocks reach a
+    boundary of the old segments after it, and renders the new segments,
+    the segments which refer to link definitions changed by the edit, and,
+    if footnotes are involved, the segments which use footnotes. So the
+    time of an edit depends on the size of the edited blocks rather than
+    the whole document, and ``output`` is always the same as
+    :func:`convert` of ``text``. A session must not be used by threads at
+    the same time.
+    """
+
+    def __init__(self, text='', config=None, **kwargs):
+        self.converter = M2R(config=config, **kwargs)
+        self.converter.reset()
+        self.text = ''
+        self.output = ''
+        self._segments = []
+        self._starts = []  # offsets of the segments in text
+        self._open = []  # offsets of open segments
+        self._links = _RecordingDict()
+        self._link_users = {}  # link key -> segments which look it up
+        self._footnote_index = _RecordingDict()
+        self._footnotes = ''  # rendered footnotes section
+        self._raw_html = 0  # number of segments using the raw-html role
+        self.edit(0, 0, text)
+
+    def edit(self, offset, removed, inserted):
+        """Replace ``removed`` characters at ``offset`` of the markdown text
+        with ``inserted`` text, and return the updated reST."""
+        if not 0 <= offset <= offset + removed <= len(self.text):
+            raise ValueError('edit out of the text: offset %d, removed %d' %
+                             (offset, removed))
+        text = self.text[:offset] + inserted + self.text[offset + removed:]
+        delta = len(inserted) - removed
+        starts = self._starts
+        segments = self._segments
+        # blocks end by looking ahead up to two lines (setext headings and
+        # tables), so the two segments before the edit may end differently,
+        # and open segments may be closed by the edit
+        restart = offset
+        if self._open:
+            restart = min(restart, self._open[0])
+        first = max(bisect_right(starts, restart) - 3, 0)
+        start = starts[first] if starts else 0
+        new_open = self._open[:bisect_left(self._open, start)]
+        # old segments after the edit, which are not changed; the line at the
+        # end of the edit is preprocessed again
+        kept = bisect_right(starts, offset + removed)
+        end = starts[kept] + delta if kept < len(starts) else len(text)
+        source = mistune.preprocessing(text[start:end]) + ''.join(
+            [segment.source for segment in segments[kept:]])
+        self.text = text
+        new, last = self._lex(start, source, end, delta)
+        old = segments[first:last]
+        segments[first:last] = new
+        new_starts = []
+        for segment in new:
+            new_starts.append(start)
+            if segment.open:
+                new_open.append(start)
+            start += segment.size
+        self._starts = (starts[:first] + new_starts +
+                        [position + delta for position in starts[last:]])
+        if last < len(starts):
+            kept_open = bisect_left(self._open, starts[last])
+        else:
+            kept_open = len(self._open)
+        self._open = new_open + [position + delta
+                                 for position in self._open[kept_open:]]
+        self._update(old, new)
+        return self.output
+
+    def _lex(self, position, source, end, delta):
+        """Lex ``source``, preprocessed text from ``position``, into new
+        segments until a block ends at an old segment after ``end``.
+
+        Return the new segments and the index of the old segment.
+        """
+        block = self.converter.block
+        block.tokens = _TokenList()
+        block.def_links = {}
+        block.def_footnotes = {}
+        text = source.rstrip('\n')
+        lines = _raw_line_re.finditer(self.text, position)
+        segments = []
+        segment_start = 0
+        offset = 0
+        index = 0
+        is_open = False
+        for block_source in block.parse_blocks(text):
+            offset += len(block_source)
+            token = block.tokens[index] if index < len(block.tokens) else None
+            index = len(block.tokens)
+            is_open = is_open or _open_block(block_source, token)
+            if offset == len(text) or text[offset - 1] != '\n':
+                continue
+            raw_end = position
+            for _ in range(text.count('\n', segment_start, offset)):
+                raw_end = next(lines).end()
+            segments.append(_Segment(
+                raw_end - position, source[segment_start:offset],
+                block.tokens, block.def_links,
+                frozenset(block.def_footnotes), is_open))
+            block.tokens = _TokenList()
+            block.def_links = {}
+            block.def_footnotes = {}
+            segment_start = offset
+            index = 0
+            is_open = False
+            position = raw_end
+            if position >= end:
+                index = bisect_left(self._starts, position - delta)
+                if (index < len(self._starts) and
+                        self._starts[index] == position - delta):
+                    return segments, index
+        if position < len(self.text):
+            segments.append(_Segment(
+                len(self.text) - position, source[segment_start:],
+                block.tokens, block.def_links,
+                frozenset(block.def_footnotes), is_open))
+        return segments, len(self._starts)
+
+    def _update(self, old, new):
+        """Render ``new`` segments replacing ``old`` ones and the segments
+        depending on their definitions, and join the output."""
+        footnotes_changed = False
+        keys = set()
+        for segment in old:
+            self._forget(segment)
+            self._raw_html -= segment.raw_html
+            footnotes_changed = footnotes_changed or segment.uses_footnotes
+            keys.update(segment.links)
+        render = set(new)
+        for segment in new:
+            keys.update(segment.links)
+        for key in keys:
+            # the last definition is used as mistune
+            link = None
+            for segment in self._segments:
+                link = segment.links.get(key, link)
+            if link != self._links.get(key):
+                if link is None:
+                    del self._links[key]
+                else:
+                    self._links[key] = link
+                render.update(self._link_users.get(key, ()))
+        for segment in render:
+            used = segment.uses_footnotes
+            self._render(segment)
+            footnotes_changed = (footnotes_changed or used or
+                                 segment.uses_footnotes)
+        if footnotes_changed:
+            self._render_footnotes()
+        body = ''.join([segment.output for segment in self._segments])
+        body += self._footnotes
+        self.output = prolog + body if self._raw_html else body
+
+    def _forget(self, segment):
+        for key in segment.link_refs:
+            users = self._link_users[key]
+            users.discard(segment)
+            if not users:
+                del self._link_users[key]
+
+    def _render(self, segment, tokens=None):
+        md = self.converter
+        md.tokens = (segment.tokens if tokens is None else tokens)[::-1]
+        md.footnotes = []
+        md.renderer._include_raw_html = False
+        md.inline.links = self._links
+        md.inline.footnotes = self._footnote_index
+        self._links.keys_used = set()
+        self._footnote_index.keys_used = set()
+        self._forget(segment)
+        self._raw_html -= segment.raw_html
+        segment.output = str(md.renderer.join_blocks(md._output_body()))
+        segment.link_refs = frozenset(self._links.keys_used)
+        segment.footnote_refs = frozenset(self._footnote_index.keys_used)
+        segment.footnotes = md.footnotes
+        segment.raw_html = md.renderer._include_raw_html
+        self._raw_html += segment.raw_html
+        for key in segment.link_refs:
+            self._link_users.setdefault(key, set()).add(segment)
+
+    def _render_footnotes(self):
+        """Render the segments using footnotes in order, which number the
+        footnotes, and the footnotes section."""
+        md = self.converter
+        index = self._footnote_index = _RecordingDict()
+        for segment in self._segments:
+            for key in segment.footnote_keys:
+                index.setdefault(key, 0)
+        md.inline.footnote_index = 0
+        defined = set()
+        footnotes = []
+        for segment in self._segments:
+            if not segment.uses_footnotes:
+                continue
+            tokens = None
+            if not defined.isdisjoint(segment.footnote_keys):
+                # only the first definition is used as mistune
+                tokens = _skip_footnotes(segment.tokens, defined)
+            self._render(segment, tokens)
+            defined.update(segment.footnote_keys)
+            footnotes.extend(segment.footnotes)
+        md.footnotes = footnotes
+        self._footnotes = str(md._output_footnotes(index))
+        md.inline.footnote_index = 0
+
+
+def parse_from_file(file, encoding='utf-8', cache=None, **kwargs):
+    """Convert markdown ``file`` and return the result.
+
+    If ``cache`` (a :class:`ConversionCache`) is given, unchanged files are
+    not converted again but loaded from the cache.
+    """
     if not os.path.exists(file):
         raise OSError('No such file exists: {}'.format(file))
-    with open(file, encoding=encoding) as f:
-        src = f.read()
-    output = convert(src, **kwargs)
+    if cache is None:
+        with open(file, encoding=encoding) as f:
+            src = f.read()
+        return convert(src, **kwargs)
+    with open(file, 'rb') as f:
+        data = f.read()
+    key = cache.key(data, encoding=encoding, **kwargs)
+    output = cache.get(key)
+    if output is None:
+        output = convert(data.decode(encoding), **kwargs)
+        cache.set(key, output)
     return output
 
 
@@ -680,13 +3341,722 @@ def save_to_file(file, src, encoding='utf-8', **kwargs):
         f.write(src)
 
 
+def _match_any(path, patterns):
+    return any(fnmatch(path, pattern) or
+               fnmatch(os.path.basename(path), pattern)
+               for pattern in patterns)
+
+
+def find_files(paths, include=None, exclude=None):
+    """Yield files to convert from ``paths``.
+
+    Directories are walked recursively and only files matching one of
+    ``include`` patterns (default: ``*.md``) are yielded. Files and
+    directories matching one of ``exclude`` patterns are skipped. Patterns are
+    matched against both the base name and the path relative to the given
+    directory.
+    """
+    include = include or ['*.md']
+    exclude = exclude or []
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            rel_root = os.path.relpath(root, path)
+            if rel_root == os.curdir:
+                rel_root = ''
+            dirs[:] = sorted(
+                d for d in dirs
+                if not _match_any(os.path.join(rel_root, d), exclude))
+            for name in sorted(files):
+                rel_path = os.path.join(rel_root, name)
+                if (_match_any(rel_path, include) and
+                        not _match_any(rel_path, exclude)):
+                    yield os.path.join(root, name)
+
+
+def _convert_job(file, dry_run=False, **kwargs):
+    """Convert a file for batch mode and never ask for confirmation.
+
+    Return ``(file, result, error)``, where ``result`` is the converted text
+    on dry-run and the path of the written file otherwise.
+    """
+    try:
+        output = parse_from_file(file, **kwargs)
+        if dry_run:
+            return file, output, None
+        target = os.path.splitext(file)[0] + '.rst'
+        with open(target, 'w', encoding=kwargs.get('encoding', 'utf-8')) as f:
+            f.write(output)
+        return file, target, None
+    except Exception as e:
+        return file, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def convert_files(files, jobs=1, dry_run=False, **kwargs):
+    """Convert ``files`` and yield ``(file, result, error)`` in input order.
+
+    With ``jobs`` > 1 files are converted in a pool of worker processes
+    (``jobs=0`` uses all CPUs). Existing output files are overwritten without
+    confirmation. Conversion errors do not stop the batch, but are reported
+    as ``error`` message of the failed file.
+    """
+    job = partial(_convert_job, dry_run=dry_run, **kwargs)
+    if jobs is not None and jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if not jobs or jobs == 1:
+        for file in files:
+            yield job(file)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    files = list(files)
+    chunksize = max(1, min(64, len(files) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(job, files, chunksize=chunksize):
+            yield result
+
+
+class FileWatcher(object):
+    """Watch markdown files under ``paths`` by polling their modification
+    times every ``interval`` seconds.
+
+    ``paths``, ``include`` and ``exclude`` select files as
+    :func:`find_files`. :meth:`changes` waits for changed or new files and
+    returns them once no more changes are seen for ``delay`` seconds, so that
+    a burst of writes by an editor is reported once. Use
+    :func:`make_watcher` to watch by inotify where it is available.
+    """
+
+    def __init__(self, paths, include=None, exclude=None, delay=0.05,
+                 interval=0.5):
+        self.paths = list(paths)
+        self.include = include or ['*.md']
+        self.exclude = exclude or []
+        self.delay = delay
+        self.interval = interval
+        self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def files(self):
+        """Return the watched files."""
+        return list(find_files(self.paths, self.include, self.exclude))
+
+    def changes(self, timeout=None):
+        """Return a sorted list of files changed since the last call, or an
+        empty list if nothing changes in ``timeout`` seconds."""
+        changed = self._wait(timeout)
+        if not changed:
+            return []
+        while True:
+            more = self._wait(self.delay)
+            if not more:
+                break
+            changed.update(more)
+        return sorted(file for file in changed if os.path.isfile(file))
+
+    def _start(self):
+        self._stats = self._scan()
+
+    def _scan(self):
+        stats = {}
+        for file in self.files():
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            stats[file] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _wait(self, timeout):
+        """Return a set of changed files, waiting up to ``timeout`` seconds
+        (forever if None) for the first change."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self._scan()
+            changed = {file for file, stat in stats.items()
+                       if self._stats.get(file) != stat}
+            self._stats = stats
+            if changed:
+                return changed
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return set()
+            time.sleep(min(self.interval, remaining))
+
+
+class InotifyWatcher(FileWatcher):
+    """:class:`FileWatcher` notified of written and moved-in files by Linux
+    inotify instead of polling."""
+
+    # from <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    def _start(self):
+        import ctypes
+        self._libc = _inotify_libc()
+        if self._libc is None:
+            raise OSError('inotify is not available')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'cannot initialize inotify')
+        self._dirs = {}  # watch descriptor -> directory
+        for path in self.paths:
+            if os.path.isdir(path):
+                self._add_tree(path)
+            else:
+                self._add_dir(os.path.dirname(path) or os.curdir)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_dir(self, path):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd >= 0:
+            self._dirs[wd] = path
+
+    def _add_tree(self, path):
+        """Watch directory ``path`` and its subdirectories, and return the
+        files in them."""
+        files = []
+        for root, dirs, names in os.walk(path):
+            if not self._watched_dir(root):
+                dirs[:] = []
+                continue
+            self._add_dir(root)
+            files.extend(os.path.join(root, name) for name in names)
+        return files
+
+    def _relative(self, path, top):
+        """Return ``path`` relative to directory ``top``, or None if it is
+        not in ``top``."""
+        # watched paths are joined to top by os.walk
+        prefix = os.path.join(top, '')
+        if path.startswith(prefix):
+            return path[len(prefix):]
+        rel = os.path.relpath(path, top)
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return None
+        return '' if rel == os.curdir else rel
+
+    def _excluded(self, rel_dir):
+        parts = rel_dir.split(os.sep) if rel_dir else []
+        return any(_match_any(os.path.join(*parts[:i]), self.exclude)
+                   for i in range(1, len(parts) + 1))
+
+    def _watched_dir(self, path):
+        for top in self.paths:
+            if os.path.isdir(top):
+                rel = self._relative(path, top)
+                if rel is not None and not self._excluded(rel):
+                    return True
+        return False
+
+    def _wanted(self, file):
+        for top in self.paths:
+            if not os.path.isdir(top):
+                if os.path.normpath(file) == os.path.normpath(top):
+                    return True
+                continue
+            rel = self._relative(file, top)
+            if (rel is not None and _match_any(rel, self.include) and
+                    not _match_any(rel, self.exclude) and
+                    not self._excluded(os.path.dirname(rel))):
+                return True
+        return False
+
+    def _wait(self, timeout):
+        import select
+        import struct
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                offset += 16
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    # events are lost
+                    changed.update(self.files())
+                elif mask & self.IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                elif wd not in self._dirs:
+                    continue
+                elif mask & self.IN_ISDIR:
+                    # files may be written before the new directory is watched
+                    path = os.path.join(self._dirs[wd], name)
+                    if self._watched_dir(path):
+                        changed.update(self._add_tree(path))
+                elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                    changed.add(os.path.join(self._dirs[wd], name))
+        return {file for file in changed if self._wanted(file)}
+
+
+def _inotify_libc():
+    """Return the C library if it provides inotify, or None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+
+def make_watcher(paths, include=None, exclude=None, delay=0.05,
+                 polling=False):
+    """Return an :class:`InotifyWatcher` of ``paths``, or a polling
+    :class:`FileWatcher` if ``polling`` is true or inotify is not
+    available."""
+    if not polling and _inotify_libc() is not None:
+        return InotifyWatcher(paths, include, exclude, delay)
+    return FileWatcher(paths, include, exclude, delay)
+
+
+def _converter_options():
+    """Return converter options given on command line."""
+    return dict(config=M2RConfig.from_options(options))
+
+
+def _parse_address(address):
+    """Return socket family and address of ``[HOST:]PORT`` or
+    ``unix:PATH``."""
+    import socket
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+class ServerStats(object):
+    """Counters of a :class:`ConversionServer`.
+
+    ``latency`` counts conversion requests by their time in milliseconds:
+    ``latency[i]`` is the number of requests which took up to
+    ``buckets[i]`` ms, and the last item counts slower ones.
+    """
+
+    buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.documents = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = [0] * (len(self.buckets) + 1)
+
+    def record(self, documents, bytes_in, bytes_out, seconds, error=False):
+        bucket = bisect_right(self.buckets, seconds * 1000 - 1e-9)
+        with self._lock:
+            self.requests += 1
+            self.documents += documents
+            self.errors += error
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.latency[bucket] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(
+                requests=self.requests,
+                documents=self.documents,
+                errors=self.errors,
+                bytes_in=self.bytes_in,
+                bytes_out=self.bytes_out,
+                latency_buckets_ms=list(self.buckets),
+                latency=list(self.latency),
+            )
+
+
+class _ConversionHandlerMixin(object):
+    """Handle ``POST /convert`` and ``GET /stats`` requests.
+
+    A conversion request is a JSON object of ``text`` (or a list of
+    ``texts``) and optional ``options`` (fields of :class:`M2RConfig`), and
+    the response is a JSON object of ``output`` (or ``outputs``).
+    """
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._reply(404, {'error': 'not found'})
+            return
+        self._reply(200, self.server.stats.as_dict())
+
+    def do_POST(self):
+        if self.path != '/convert':
+            self._reply(404, {'error': 'not found'})
+            return
+        import json
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        documents = 0
+        try:
+            request = json.loads(body.decode('utf-8'))
+            config = M2RConfig(**request.get('options', {}))
+            converter = self.server.converter(config)
+            if 'texts' in request:
+                documents = len(request['texts'])
+                result = {'outputs': [converter(text)
+                                      for text in request['texts']]}
+            else:
+                documents = 1
+                result = {'output': converter(request['text'])}
+            status = 200
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            status, result = 400, {'error': 'bad request: {}'.format(e)}
+        except Exception as e:
+            status, result = 500, {'error': '{}: {}'.format(
+                type(e).__name__, e)}
+        data = json.dumps(result).encode('utf-8')
+        # recorded before the response, so it is seen by the next request
+        self.server.stats.record(documents, len(body), len(data),
+                                 time.perf_counter() - start, status != 200)
+        self._send(status, data)
+
+    def _reply(self, status, result):
+        import json
+        self._send(status, json.dumps(result).encode('utf-8'))
+
+    def _send(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # unix sockets have no client address
+        return str(self.client_address or 'unix')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ConversionServerMixin(object):
+    """HTTP server which converts markdown sent to ``/convert`` and reports
+    :class:`ServerStats` at ``/stats``.
+
+    Converters are built once for each config and shared by the request
+    threads, so requests skip interpreter startup, imports and converter
+    construction. Use :func:`make_server` to listen on a unix socket.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address):
+        self.stats = ServerStats()
+        self._converters = {}
+        self._converters_lock = threading.Lock()
+        super(_ConversionServerMixin, self).__init__(
+            address, _lazy('_ConversionHandler'))
+
+    def converter(self, config):
+        """Return the warm converter of ``config``."""
+        with self._converters_lock:
+            converter = self._converters.get(config)
+            if converter is None:
+                converter = self._converters[config] = M2R(config=config)
+            return converter
+
+
+class _UnixConversionServerMixin(object):
+    """:class:`ConversionServer` on a unix socket of ``address`` path."""
+
+    @property
+    def address_family(self):
+        import socket
+        return socket.AF_UNIX
+
+    def server_bind(self):
+        # remove the socket left by a stopped server
+        path = self.server_address
+        if os.path.exists(path) and S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        # HTTPServer.server_bind expects a host and a port
+        from socketserver import TCPServer
+        TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        super(_UnixConversionServerMixin, self).server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def make_server(address):
+    """Return a conversion server listening on ``address`` (``[HOST:]PORT``
+    or ``unix:PATH``)."""
+    import socket
+    family, address = _parse_address(address)
+    if family == socket.AF_UNIX:
+        return _lazy('UnixConversionServer')(address)
+    return _lazy('ConversionServer')(address)
+
+
+class _UnixHTTPConnectionMixin(object):
+    """HTTP connection to a unix socket of ``path``."""
+
+    def __init__(self, path, timeout=None):
+        super(_UnixHTTPConnectionMixin, self).__init__(
+            'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        import socket
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ConversionClient(object):
+    """Client of a conversion server running on ``address``."""
+
+    def __init__(self, address, timeout=None):
+        self.address = address
+        self.timeout = timeout
+
+    def _request(self, method, path, request=None):
+        import json
+        import socket
+        from http.client import HTTPConnection
+        family, address = _parse_address(self.address)
+        if family == socket.AF_UNIX:
+            connection = _lazy('_UnixHTTPConnection')(address, self.timeout)
+        else:
+            connection = HTTPConnection(*address, timeout=self.timeout)
+        try:
+            body = None
+            if request is not None:
+                body = json.dumps(request).encode('utf-8')
+            connection.request(method, path, body,
+                               {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            result = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError('m2r server: {}'.format(result['error']))
+        return result
+
+    def _options(self, config, kwargs):
+        config = _pop_config(kwargs, config)
+        if kwargs:
+            raise TypeError('unsupported options: {}'.format(
+                ', '.join(sorted(kwargs))))
+        return config._asdict()
+
+    def convert(self, text, config=None, **kwargs):
+        """Convert markdown ``text`` like :func:`convert` by the server.
+
+        Only the options of :class:`M2RConfig` are supported.
+        """
+        result = self._request('POST', '/convert', {
+            'text': text, 'options': self._options(config, kwargs)})
+        return result['output']
+
+    def convert_many(self, texts, config=None, **kwargs):
+        """Convert markdown ``texts`` in one request and return the results
+        in input order."""
+        result = self._request('POST', '/convert', {
+            'texts': list(texts), 'options': self._options(config, kwargs)})
+        return result['outputs']
+
+    def stats(self):
+        """Return :class:`ServerStats` of the server as a dict."""
+        return self._request('GET', '/stats')
+
+
+def _serve_main():
+    server = make_server(options.serve)
+    print('m2r: serving on {}'.format(options.serve), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _client_main():
+    client = ConversionClient(options.server)
+    config = M2RConfig.from_options(options)
+    if options.input_file == ['-']:
+        texts = [sys.stdin.read()]
+    else:
+        files = list(find_files(options.input_file, options.include,
+                                options.exclude))
+        texts = []
+        for file in files:
+            if not os.path.exists(file):
+                raise OSError('No such file exists: {}'.format(file))
+            with open(file, encoding='utf-8') as f:
+                texts.append(f.read())
+    try:
+        outputs = client.convert_many(texts, config)
+    except ConnectionError as e:
+        _lazy('parser').exit(1, 'm2r: cannot connect to {}: {}\n'.format(
+            options.server, e))
+    except RuntimeError as e:
+        # error reported by the server
+        _lazy('parser').exit(1, '{}\n'.format(e))
+    if options.input_file == ['-']:
+        sys.stdout.write(outputs[0])
+        return
+    for file, output in zip(files, outputs):
+        if options.dry_run:
+            print(output)
+        else:
+            save_to_file(file, output)
+
+
+def _watch_main():
+    converter = M2R(**_converter_options())
+
+    def convert_file(file):
+        start = time.perf_counter()
+        try:
+            with open(file, encoding='utf-8') as f:
+                output = converter(f.read())
+            if options.dry_run:
+                print(output, flush=True)
+                return
+            target = os.path.splitext(file)[0] + '.rst'
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(output)
+        except Exception as e:
+            print('failed: {}: {}: {}'.format(file, type(e).__name__, e),
+                  file=sys.stderr)
+            return
+        print('converted: {} -> {} ({:.1f} ms)'.format(
+            file, target, (time.perf_counter() - start) * 1000), flush=True)
+
+    with make_watcher(options.input_file, options.include,
+                      options.exclude) as watcher:
+        # bring outputs up to date before watching
+        for file in watcher.files():
+            target = os.path.splitext(file)[0] + '.rst'
+            if (not os.path.exists(target) or
+                    os.path.getmtime(target) < os.path.getmtime(file)):
+                convert_file(file)
+        print('m2r: watching {} ({})'.format(
+            ', '.join(options.input_file), type(watcher).__name__),
+            file=sys.stderr)
+        try:
+            while True:
+                for file in watcher.changes():
+                    convert_file(file)
+        except KeyboardInterrupt:
+            pass
+
+
+def _batch_main(cache):
+    files = find_files(options.input_file, options.include, options.exclude)
+    report = sys.stderr if options.dry_run else sys.stdout
+    converted = failed = 0
+    # profiled conversions must run in this process
+    jobs = 1 if options.profile else options.jobs
+    for file, result, error in convert_files(
+            files, jobs=jobs, dry_run=options.dry_run, cache=cache,
+            **_converter_options()):
+        if error is not None:
+            failed += 1
+            print('failed: {}: {}'.format(file, error), file=report)
+            continue
+        converted += 1
+        if options.dry_run:
+            print(result)
+        else:
+            print('converted: {} -> {}'.format(file, result), file=report)
+    print('{} file(s) converted, {} failed'.format(converted, failed),
+          file=report)
+    if failed:
+        _lazy('parser').exit(1)
+
+
 def main():
     parse_options()  # parse cli options
+    if not options.profile:
+        _main()
+        return
+    with profile() as stats:
+        try:
+            _main()
+        finally:
+            sys.stderr.write(stats.report())
+
+
+def _main():
+    if options.serve:
+        _serve_main()
+        return
+    if options.server and options.input_file:
+        _client_main()
+        return
+    if options.watch:
+        if not options.input_file or options.input_file == ['-']:
+            _lazy('parser').error('--watch requires files or directories')
+        _watch_main()
+        return
+    cache = None
+    if options.cache_dir:
+        cache = ConversionCache(options.cache_dir)
+    if options.prune_cache:
+        if cache is None:
+            _lazy('parser').error('--prune-cache requires --cache-dir')
+        removed = cache.prune(options.cache_max_age * 24 * 60 * 60)
+        print('removed {} cache file(s)'.format(removed))
+        if not options.input_file:
+            return
+    if options.profile:
+        cache = None  # profile all files
     if not options.input_file:
+        parser = _lazy('parser')
         parser.print_help()
         parser.exit(0)
+    if options.input_file == ['-']:
+        for output in iter_convert(sys.stdin, **_converter_options()):
+            sys.stdout.write(output)
+        return
+    if options.jobs is not None or any(os.path.isdir(file)
+                                       for file in options.input_file):
+        _batch_main(cache)
+        return
     for file in options.input_file:
-        output = parse_from_file(file)
+        output = parse_from_file(file, cache=cache, **_converter_options())
         if options.dry_run:
             print(output)
         else:
@@ -7,10 +7,17 @@ import sys
 import os
 from os import path
 from copy import copy
-from unittest import TestCase
+from io import StringIO
+from unittest import TestCase, skipIf
+import socket
 import subprocess
+import tempfile
+import threading
+import time
 
-from m2r import parse_from_file, main, options
+import m2r
+from m2r import (parse_from_file, main, options, ConversionCache,
+                 ConversionClient, make_server)
 
 from unittest.mock import patch
 _builtin = 'builtins'
@@ -20,21 +27,26 @@ test_md = path.join(curdir, 'test.md')
 test_rst = path.join(curdir, 'test.rst')
 
 
-class TestConvert(TestCase):
+class CliTestBase(TestCase):
     def setUp(self):
-        # reset cli options
-        options.overwrite = False
-        options.dry_run = False
-        options.no_underscore_emphasis = False
-        options.anonymous_references = False
-        options.disable_inline_math = False
+        # reset cli options to their defaults
+        for name, value in vars(m2r.parser.parse_args([])).items():
+            setattr(options, name, value)
         self._orig_argv = copy(sys.argv)
+
+    def tearDown(self):
+        sys.argv = self._orig_argv
+
+
+class TestConvert(CliTestBase):
+    def setUp(self):
+        super(TestConvert, self).setUp()
         if path.exists(test_rst):
             with open(test_rst) as f:
                 self._orig_rst = f.read()
 
     def tearDown(self):
-        sys.argv = self._orig_argv
+        super(TestConvert, self).tearDown()
         with open(test_rst, 'w') as f:
             f.write(self._orig_rst)
 
@@ -53,6 +65,12 @@ class TestConvert(TestCase):
         self.assertIn('inline-math', message)
         self.assertIn('options:', message)
 
+    def test_stdin(self):
+        with open(test_md, 'rb') as f:
+            p = subprocess.run([sys.executable, '-m', 'm2r', '-'], stdin=f,
+                               stdout=subprocess.PIPE, check=True)
+        self.assertEqual(p.stdout.decode(), parse_from_file(test_md))
+
     def test_parse_file(self):
         output = parse_from_file(test_md)
         with open(test_rst) as f:
@@ -112,6 +130,16 @@ class TestConvert(TestCase):
             first_line = f.readline()
         self.assertNotIn('test', first_line)
 
+    def test_profile(self):
+        sys.argv = [sys.argv[0], '--dry-run', '--profile', test_md]
+        with patch(_builtin + '.print'):
+            with patch.object(sys, 'stderr') as m:
+                main()
+        report = ''.join(call[0][0] for call in m.write.call_args_list)
+        self.assertIn('block.heading', report)
+        self.assertIn('inline.link', report)
+        self.assertIn('RestRenderer.header', report)
+
     def test_underscore_option(self):
         sys.argv = [
             sys.argv[0], '--no-underscore-emphasis', '--dry-run', test_md]
@@ -135,3 +163,338 @@ class TestConvert(TestCase):
             main()
         self.assertIn('``$E = mc^2$``', m.call_args[0][0])
         self.assertNotIn(':math:', m.call_args[0][0])
+
+
+class TestBatchConvert(CliTestBase):
+    def setUp(self):
+        super(TestBatchConvert, self).setUp()
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.root = self._tmpdir.name
+        with open(test_md) as f:
+            self.src = f.read()
+        self.expected = parse_from_file(test_md)
+        for name in ('a.md', path.join('sub', 'b.md'),
+                     path.join('skip', 'c.md'), 'd.txt'):
+            file = path.join(self.root, name)
+            os.makedirs(path.dirname(file), exist_ok=True)
+            with open(file, 'w') as f:
+                f.write(self.src)
+
+    def tearDown(self):
+        super(TestBatchConvert, self).tearDown()
+        self._tmpdir.cleanup()
+
+    def rst(self, name):
+        return path.join(self.root, name)
+
+    def test_directory(self):
+        sys.argv = [sys.argv[0], '--exclude', 'skip', self.root]
+        # existing files are overwritten without confirmation
+        with open(self.rst('a.rst'), 'w') as f:
+            f.write('test')
+        with patch(_builtin + '.input') as m_input:
+            with patch(_builtin + '.print') as m_print:
+                main()
+        self.assertFalse(m_input.called)
+        for name in ('a.rst', path.join('sub', 'b.rst')):
+            with open(self.rst(name)) as f:
+                self.assertEqual(f.read(), self.expected)
+        self.assertFalse(path.exists(self.rst(path.join('skip', 'c.rst'))))
+        self.assertFalse(path.exists(self.rst('d.rst')))
+        m_print.assert_called_with('2 file(s) converted, 0 failed',
+                                   file=sys.stdout)
+
+    def test_include(self):
+        sys.argv = [sys.argv[0], '--include', '*.txt', self.root]
+        with patch(_builtin + '.print'):
+            main()
+        self.assertTrue(path.exists(self.rst('d.rst')))
+        self.assertFalse(path.exists(self.rst('a.rst')))
+
+    def test_jobs(self):
+        sys.argv = [sys.argv[0], '--jobs', '2', '--dry-run', self.root]
+        with patch(_builtin + '.print') as m:
+            main()
+        outputs = [c[0][0] for c in m.call_args_list if 'file' not in c[1]]
+        self.assertEqual(outputs, [self.expected] * 3)
+        self.assertFalse(path.exists(self.rst('a.rst')))
+
+    def test_failure(self):
+        missing = path.join(self.root, 'missing.md')
+        sys.argv = [sys.argv[0], '--jobs', '2', missing, self.rst('a.md')]
+        with patch(_builtin + '.print') as m:
+            with self.assertRaises(SystemExit) as cm:
+                main()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertTrue(path.exists(self.rst('a.rst')))
+        messages = [c[0][0] for c in m.call_args_list]
+        self.assertTrue(messages[0].startswith('failed: ' + missing))
+        self.assertEqual(messages[-1], '1 file(s) converted, 1 failed')
+
+
+class TestCache(CliTestBase):
+    def setUp(self):
+        super(TestCache, self).setUp()
+        options.overwrite = True
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = path.join(self._tmpdir.name, 'cache')
+        self.md = path.join(self._tmpdir.name, 'a.md')
+        self.rst = path.join(self._tmpdir.name, 'a.rst')
+        with open(test_md) as f:
+            self.src = f.read()
+        with open(self.md, 'w') as f:
+            f.write(self.src)
+
+    def tearDown(self):
+        super(TestCache, self).tearDown()
+        self._tmpdir.cleanup()
+
+    def test_cache_hit(self):
+        cache = ConversionCache(self.cache_dir)
+        expected = parse_from_file(self.md)
+        self.assertEqual(parse_from_file(self.md, cache=cache), expected)
+        with patch.object(m2r, 'convert') as m:
+            self.assertEqual(parse_from_file(self.md, cache=cache), expected)
+        self.assertFalse(m.called)
+
+    def test_cache_key(self):
+        cache = ConversionCache(self.cache_dir)
+        parse_from_file(self.md, cache=cache)
+        # options and contents are part of the key
+        anonymous = parse_from_file(self.md, cache=cache,
+                                    anonymous_references=True)
+        self.assertIn('`A link to GitHub <http://github.com/>`__', anonymous)
+        with open(self.md, 'a') as f:
+            f.write('\nappended\n')
+        self.assertIn('appended', parse_from_file(self.md, cache=cache))
+
+    def test_cli(self):
+        sys.argv = [sys.argv[0], '--cache-dir', self.cache_dir, self.md]
+        main()
+        with open(self.rst) as f:
+            expected = f.read()
+        os.remove(self.rst)
+        with patch.object(m2r, 'convert') as m:
+            main()
+        self.assertFalse(m.called)
+        with open(self.rst) as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_prune(self):
+        cache = ConversionCache(self.cache_dir)
+        cache.set('00used', 'a')
+        cache.set('11stale', 'b')
+        stale = path.join(self.cache_dir, m2r.__version__, '11',
+                          '11stale.rst')
+        os.utime(stale, (0, 0))
+        old_version = path.join(self.cache_dir, '0.0.0', '22')
+        os.makedirs(old_version)
+        with open(path.join(old_version, '22old.rst'), 'w') as f:
+            f.write('c')
+        sys.argv = [sys.argv[0], '--cache-dir', self.cache_dir,
+                    '--prune-cache']
+        with patch(_builtin + '.print') as m:
+            main()
+        m.assert_called_once_with('removed 2 cache file(s)')
+        self.assertEqual(cache.get('00used'), 'a')
+        self.assertIsNone(cache.get('11stale'))
+        self.assertFalse(path.exists(path.join(self.cache_dir, '0.0.0')))
+
+
+class TestServer(CliTestBase):
+    def setUp(self):
+        super(TestServer, self).setUp()
+        options.overwrite = True
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super(TestServer, self).tearDown()
+        self._tmpdir.cleanup()
+
+    def start(self, address):
+        server = make_server(address)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        if isinstance(server.server_address, tuple):
+            return '127.0.0.1:{}'.format(server.server_address[1])
+        return address
+
+    def test_convert(self):
+        client = ConversionClient(self.start('127.0.0.1:0'))
+        self.assertEqual(client.convert('[a](b)'), m2r.convert('[a](b)'))
+        self.assertEqual(client.convert('[a](b)', anonymous_references=True),
+                         '\n`a <b>`__\n')
+        self.assertEqual(client.convert_many(['# a', '*b*']),
+                         [m2r.convert('# a'), m2r.convert('*b*')])
+        stats = client.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['documents'], 4)
+        self.assertEqual(sum(stats['latency']), 3)
+        self.assertGreater(stats['bytes_in'], 0)
+        self.assertGreater(stats['bytes_out'], 0)
+
+    def test_bad_request(self):
+        client = ConversionClient(self.start('127.0.0.1:0'))
+        with self.assertRaises(TypeError):
+            client.convert('a', unknown_option=True)
+        with self.assertRaises(RuntimeError):
+            client._request('POST', '/convert',
+                            {'text': 'a', 'options': {'unknown': True}})
+        self.assertEqual(client.stats()['errors'], 1)
+
+    def test_cli_client(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('unix sockets are not supported')
+        address = self.start(
+            'unix:' + path.join(self._tmpdir.name, 'm2r.sock'))
+        md = path.join(self._tmpdir.name, 'a.md')
+        with open(md, 'w') as f:
+            f.write('# Title\n')
+        sys.argv = [sys.argv[0], '--server', address, md]
+        with patch.object(m2r, 'convert') as m:
+            main()
+        self.assertFalse(m.called)
+        with open(path.join(self._tmpdir.name, 'a.rst')) as f:
+            self.assertEqual(f.read(), m2r.convert('# Title\n'))
+
+    def test_cli_server_error(self):
+        address = self.start('127.0.0.1:0')
+        md = path.join(self._tmpdir.name, 'a.md')
+        with open(md, 'w') as f:
+            f.write('# Title\n')
+        sys.argv = [sys.argv[0], '--server', address, md]
+        error = RuntimeError('m2r server: failed')
+        with patch.object(ConversionClient, 'convert_many',
+                          side_effect=error):
+            with patch('sys.stderr', new_callable=StringIO) as stderr:
+                with self.assertRaises(SystemExit) as cm:
+                    main()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(stderr.getvalue(), 'm2r server: failed\n')
+
+
+class TestLazyImport(TestCase):
+    # imported only by the sphinx extension, the server and the cli
+    deferred = ['argparse', 'asyncio', 'concurrent.futures.process',
+                'docutils.parsers.rst', 'docutils.statemachine',
+                'http.client', 'http.server', 'json', 'sphinx']
+
+    def imported(self, code=''):
+        p = subprocess.run(
+            [sys.executable, '-c',
+             'import sys, m2r\n{}\nprint(" ".join(sys.modules))'.format(code)],
+            cwd=path.dirname(curdir), stdout=subprocess.PIPE, check=True)
+        return p.stdout.decode().split()
+
+    def test_import(self):
+        modules = self.imported('m2r.convert("# a *b*")')
+        for module in self.deferred:
+            self.assertNotIn(module, modules)
+
+    def test_sphinx_classes(self):
+        modules = self.imported('from m2r import M2RParser, MdInclude')
+        self.assertIn('docutils.parsers.rst', modules)
+        self.assertNotIn('http.server', modules)
+        from docutils.parsers import rst
+        self.assertTrue(issubclass(m2r.M2RParser, rst.Parser))
+        self.assertTrue(issubclass(m2r.MdInclude, rst.Directive))
+        self.assertIs(m2r.M2RParser, m2r.M2RParser)
+        self.assertEqual(m2r.M2RParser.__module__, 'm2r')
+
+    def test_server_classes(self):
+        self.assertTrue(issubclass(m2r.UnixConversionServer,
+                                   m2r.ConversionServer))
+        self.assertIn('--server', m2r.parser.format_help())
+        with self.assertRaises(AttributeError):
+            m2r.no_such_attribute
+
+
+class TestFileWatcher(TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self._tmpdir.name
+        os.mkdir(path.join(self.dir, 'sub'))
+        os.mkdir(path.join(self.dir, 'skip'))
+        self.write('a.md', 'a')
+        self.watcher = self.make_watcher([self.dir], exclude=['skip'])
+
+    def tearDown(self):
+        self.watcher.close()
+        self._tmpdir.cleanup()
+
+    def make_watcher(self, paths, **kwargs):
+        return m2r.FileWatcher(paths, interval=0.02, **kwargs)
+
+    def write(self, name, text):
+        with open(path.join(self.dir, name), 'w') as f:
+            f.write(text)
+
+    def test_changes(self):
+        self.assertEqual(self.watcher.changes(timeout=0.1), [])
+        self.write('a.md', 'changed')
+        self.write('sub/b.md', 'new')
+        self.write('a.rst', 'output')
+        self.write('skip/c.md', 'excluded')
+        self.assertEqual(self.watcher.changes(timeout=5), [
+            path.join(self.dir, 'a.md'), path.join(self.dir, 'sub', 'b.md')])
+        self.assertEqual(self.watcher.changes(timeout=0.1), [])
+
+    def test_new_directory(self):
+        os.makedirs(path.join(self.dir, 'new', 'deep'))
+        self.write('new/deep/d.md', 'd')
+        self.assertEqual(self.watcher.changes(timeout=5),
+                         [path.join(self.dir, 'new', 'deep', 'd.md')])
+
+    def test_file(self):
+        self.watcher.close()
+        self.write('sub/b.md', 'b')
+        self.watcher = self.make_watcher([path.join(self.dir, 'a.md')])
+        self.write('sub/b.md', 'changed')
+        self.write('a.md', 'changed')
+        self.assertEqual(self.watcher.changes(timeout=5),
+                         [path.join(self.dir, 'a.md')])
+
+    def test_debounce(self):
+        def edit():
+            for i in range(5):
+                self.write('a.md', 'x' * i)
+                time.sleep(0.005)
+        thread = threading.Thread(target=edit)
+        thread.start()
+        changes = self.watcher.changes(timeout=5)
+        thread.join()
+        self.assertEqual(changes, [path.join(self.dir, 'a.md')])
+        self.assertEqual(self.watcher.changes(timeout=0.1), [])
+
+
+@skipIf(m2r._inotify_libc() is None, 'inotify is not available')
+class TestInotifyWatcher(TestFileWatcher):
+    def make_watcher(self, paths, **kwargs):
+        watcher = m2r.make_watcher(paths, **kwargs)
+        self.assertIsInstance(watcher, m2r.InotifyWatcher)
+        return watcher
+
+
+class TestWatch(TestCase):
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(path.join(tmpdir, 'old.md'), 'w') as f:
+                f.write('# Old\n')
+            p = subprocess.Popen(
+                [sys.executable, '-m', 'm2r', '--watch', tmpdir],
+                cwd=path.dirname(curdir), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, universal_newlines=True)
+            try:
+                self.assertIn('old.rst', p.stdout.readline())
+                self.assertIn('watching', p.stderr.readline())
+                with open(path.join(tmpdir, 'new.md'), 'w') as f:
+                    f.write('**new**\n')
+                self.assertIn('new.rst', p.stdout.readline())
+            finally:
+                p.terminate()
+                p.communicate()
+            with open(path.join(tmpdir, 'new.rst')) as f:
+                self.assertEqual(f.read(), m2r.convert('**new**\n'))
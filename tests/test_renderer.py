@@ -3,12 +3,26 @@
 
 from __future__ import print_function, unicode_literals
 
+import asyncio
+import sys
+import threading
+import time
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import StringIO
+from os import path
 from unittest import TestCase, skip
+from unittest.mock import patch
 
 from docutils.core import Publisher
 from docutils import io
 
-from m2r import prolog, convert
+from m2r import (prolog, convert, aconvert, aconvert_many, iter_convert,
+                 profile, M2R, M2RConfig, RestBlockLexer, RestRenderer,
+                 RestInlineGrammar,
+                 ConversionSession, SourceMap, _get_converter)
+
+test_md = path.join(path.dirname(path.abspath(__file__)), 'test.md')
 
 
 class RendererTestBase(TestCase):
@@ -132,6 +146,21 @@ class TestInlineMarkdown(RendererTestBase):
         out = self.conv(src, no_underscore_emphasis=True)
         self.assertEqual(out.replace('\n', ''), '__a__')
 
+    def test_emphasis_in_word(self):
+        src = 'a**b**c'
+        out = self.conv(src)
+        self.assertEqual(out, '\na\\ **b**\\ c\n')
+
+    def test_emphasis_punctuation(self):
+        src = '(**a**), "*b*" and `c`.'
+        out = self.conv(src)
+        self.assertEqual(out, '\n(**a**), "*b*" and ``c``.\n')
+
+    def test_adjacent_markups(self):
+        src = '**a**`b`*c*'
+        out = self.conv(src)
+        self.assertEqual(out, '\n**a**\\ ``b``\\ *c*\n')
+
     def test_autolink(self):
         src = 'link to http://example.com/ in sentence.'
         out = self.conv(src)
@@ -143,6 +172,12 @@ class TestInlineMarkdown(RendererTestBase):
         self.assertEqual(
             out, '\nthis is a `link <http://example.com/>`_.\n')
 
+    def test_link_with_emphasis(self):
+        src = 'a [**b** c](http://example.com/), d'
+        out = self.conv(src)
+        self.assertEqual(
+            out, '\na `\\ **b** c <http://example.com/>`_, d\n')
+
     def test_anonymous_link(self):
         src = 'this is a [link](http://example.com/).'
         out = self.conv(src, anonymous_references=True)
@@ -225,6 +260,11 @@ class TestInlineMarkdown(RendererTestBase):
         out = self.conv(src)
         self.assertEqual(out, '\n' + src + '\n')
 
+    def test_rest_domain_role(self):
+        src = 'a :py:func:`some.func` inline.'
+        out = self.conv_no_check(src)
+        self.assertEqual(out, '\n' + src + '\n')
+
     def test_rest_link(self):
         src = 'a `RefLink <http://example.com>`_ here.'
         out = self.conv(src)
@@ -291,6 +331,11 @@ class TestInlineMarkdown(RendererTestBase):
         out = self.conv(src)
         self.assertEqual(out, '\nthis is :math:`E = mc^2` inline math.\n')
 
+    def test_inline_math_twice(self):
+        src = '`$a$` and `$b$`'
+        out = self.conv(src)
+        self.assertEqual(out, '\n:math:`a` and :math:`b`\n')
+
     def test_disable_inline_math(self):
         src = 'this is `$E = mc^2$` inline math.'
         out = self.conv(src, disable_inline_math=True)
@@ -320,6 +365,39 @@ class TestBlockQuote(RendererTestBase):
         # one extra empty line is inserted, but still valid rst anyway
         self.assertEqual(out, '\n..\n\n   q1\n\n   ..\n\n      q2\n\n')
 
+    def test_block_quote_in_list(self):
+        src = '\n'.join([
+            '> quote',
+            '>',
+            '> * item',
+            '>',
+            '>   > nested',
+            '>   > quote',
+            '>',
+            '>       code',
+        ])
+        out = self.conv(src)
+        self.assertEqual(out, '\n'.join([
+            '\n..',
+            '',
+            '   quote',
+            '',
+            '',
+            '   * ',
+            '     item',
+            '',
+            '     ..',
+            '',
+            '        nested',
+            '        quote',
+            '',
+            '',
+            '     .. code-block::',
+            '',
+            '        code',
+            '\n',
+        ]))
+
     @skip('markdown does not support dedent in block quote')
     def test_block_quote_nested_2(self):
         src = '> q1\n> > q2\n> q3'
@@ -355,6 +433,15 @@ class TestCodeBlock(RendererTestBase):
         out = self.conv(src)
         self.assertEqual(out, '\n.. math::\n\n   E = mc^2\n')
 
+    def test_code_block_backslash(self):
+        src = '\n'.join([
+            '```',
+            'a\\ .',
+            '```',
+        ])
+        out = self.conv(src)
+        self.assertEqual(out, '\n.. code-block::\n\n   a\\ .\n')
+
     def test_plain_code_block_indent(self):
         src = '\n'.join([
             '```',
@@ -649,6 +736,42 @@ class TestList(RendererTestBase):
             ])
         )
 
+    def test_nested_blocks(self):
+        src = '\n'.join([
+            '* list 1',
+            '',
+            '    * list 1.1',
+            '',
+            '          code',
+            '',
+            '        > quote',
+            '* list 2',
+        ])
+        out = self.conv(src)
+        self.assertEqual(
+            out,
+            '\n'.join([
+                '\n\n* ',
+                '  list 1',
+                '',
+                '',
+                '  * ',
+                '    list 1.1',
+                '',
+                '    .. code-block::',
+                '',
+                '       code',
+                '',
+                '',
+                '    ..',
+                '',
+                '       quote',
+                '',
+                '',
+                '* list 2\n',
+            ])
+        )
+
 
 class TestConplexText(RendererTestBase):
     def test_code(self):
@@ -691,6 +814,33 @@ class TestTable(RendererTestBase):
             '',
         ]))
 
+    def test_table_in_quote(self):
+        src = '> h1 | h2\n> --- | ---\n> 1 | 2\n'
+        out = self.conv(src)
+        self.assertEqual(out, '\n'.join([
+            '',
+            '..',
+            '',
+            '   .. list-table::',
+            '      :header-rows: 1',
+            '',
+            '      * - h1',
+            '        - h2',
+            '      * - 1',
+            '        - 2',
+            '',
+            '',
+        ]))
+
+    def test_table_cell_line_break(self):
+        src = 'h1 | h2\n--- | ---\n1\x1c2 | 3\n'
+        out = self.conv_no_check(src)
+        self.assertIn('\n'.join([
+            '   * - 1',
+            '     2',
+            '     - 3',
+        ]), out)
+
 
 class TestFootNote(RendererTestBase):
     def test_footnote(self):
@@ -766,3 +916,558 @@ class TestRestCode(RendererTestBase):
         src = 'a ::\n\n    code\n'
         out = self.conv(src)
         self.assertEqual(out, '\na\n\n.. code-block::\n\n   code\n')
+
+
+class TestTokens(TestCase):
+    def test_records(self):
+        tokens = RestBlockLexer().parse('\n'.join([
+            '# Title', '',
+            '* item', '',
+            '> quote', '',
+            '```py', 'code', '```', '',
+            '<div>x</div>', '',
+            '| a |', '|---|', '| 1 |', '',
+            '[^1]: note',
+        ]))
+        self.assertEqual(tokens, [
+            {'type': 'heading', 'level': 1, 'text': 'Title'},
+            {'type': 'list_start', 'ordered': False},
+            {'type': 'list_item_start'},
+            {'type': 'text', 'text': 'item'},
+            {'type': 'list_item_end'},
+            {'type': 'list_end'},
+            {'type': 'block_quote_start'},
+            {'type': 'paragraph', 'text': 'quote'},
+            {'type': 'block_quote_end'},
+            {'type': 'code', 'lang': 'py', 'text': 'code'},
+            {'type': 'open_html', 'tag': 'div', 'extra': '', 'text': 'x'},
+            {'type': 'table', 'header': ['a'], 'align': [None],
+             'cells': [['1']]},
+            {'type': 'footnote_start', 'key': '1'},
+            {'type': 'paragraph', 'text': 'note'},
+            {'type': 'footnote_end', 'key': '1'},
+        ])
+        for token in tokens:
+            self.assertNotIsInstance(token, dict)
+
+    def test_block_sources(self):
+        # rules match at the position of each block in the text
+        text = '# a\n.. note::\n   b\n::\n\n    code\ntext\n* item\n\n> q'
+        lexer = RestBlockLexer()
+        self.assertEqual(list(lexer.parse_blocks(text)), [
+            '# a\n', '.. note::\n   b\n', '::\n', '\n', '    code\n',
+            'text\n', '* item\n\n', '> q',
+        ])
+        self.assertEqual([token['type'] for token in lexer.tokens[:5]], [
+            'heading', 'directive', 'rest_code_block', 'code', 'paragraph',
+        ])
+
+    def test_dict_interface(self):
+        token = RestBlockLexer().parse('text')[0]
+        self.assertEqual(token['text'], 'text')
+        self.assertIsNone(token.get('lines'))
+        self.assertNotIn('lines', token)
+        with self.assertRaises(KeyError):
+            token['lines']
+        token['lines'] = (0, 1)
+        self.assertIn('lines', token)
+        self.assertEqual(dict(token), {'type': 'paragraph', 'text': 'text',
+                                       'lines': (0, 1)})
+
+
+class TestConverterReuse(TestCase):
+    def test_reuse(self):
+        converter = M2R()
+        self.assertEqual(converter('a <s>b</s>'),
+                         prolog + '\na :raw-html-m2r:`<s>b</s>`\n')
+        self.assertEqual(converter('a b'), '\na b\n')
+
+    def test_reuse_after_error(self):
+        converter = M2R()
+        converter.block.tokens.append({'type': 'paragraph', 'text': 'x'})
+        self.assertEqual(converter('a b'), '\na b\n')
+
+    def test_independent_options(self):
+        src = 'this is `$E = mc^2$` inline math.'
+        no_math = M2R(disable_inline_math=True)
+        math = M2R()
+        self.assertEqual(no_math(src),
+                         '\nthis is ``$E = mc^2$`` inline math.\n')
+        self.assertEqual(math(src),
+                         '\nthis is :math:`E = mc^2` inline math.\n')
+
+    def test_sphinx_converter_cache(self):
+        def config(**kwargs):
+            values = dict(
+                no_underscore_emphasis=False,
+                m2r_parse_relative_links=False,
+                m2r_anonymous_references=False,
+                m2r_disable_inline_math=False,
+            )
+            values.update(kwargs)
+            return Namespace(**values)
+
+        converter = _get_converter(config())
+        self.assertIs(_get_converter(config()), converter)
+        anonymous = _get_converter(config(m2r_anonymous_references=True))
+        self.assertIsNot(anonymous, converter)
+        self.assertEqual(anonymous('[a](b)'), '\n`a <b>`__\n')
+        self.assertEqual(converter('[a](b)'), '\n`a <b>`_\n')
+
+
+class TestConcurrentUse(TestCase):
+    docs = [
+        'this is `$E = mc^2$` inline math.',
+        '[a](b) and [c][]\n\n[c]: http://example.com/',
+        '_a_ *b* and <s>html</s>',
+        'text[^1]\n\n* list\n\n  > quote\n\n[^1]: note',
+        '# Title\n\n```python\ncode\n```\n\n1. a\n   * b',
+    ]
+    configs = [
+        M2RConfig(),
+        M2RConfig(disable_inline_math=True, anonymous_references=True),
+        M2RConfig(no_underscore_emphasis=True),
+    ]
+
+    def setUp(self):
+        self._interval = sys.getswitchinterval()
+        # switch threads often to interleave conversions
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self._interval)
+
+    def test_threads(self):
+        expected = {}
+        for config in self.configs:
+            for doc in self.docs:
+                expected[config, doc] = M2R(config=config)(doc)
+        converters = [M2R(config=config) for config in self.configs]
+        jobs = [(converter, doc) for converter in converters
+                for doc in self.docs] * 20
+        with ThreadPoolExecutor(8) as executor:
+            outputs = list(executor.map(lambda job: job[0](job[1]), jobs))
+        for (converter, doc), output in zip(jobs, outputs):
+            self.assertEqual(output, expected[converter.config, doc])
+
+    def test_nested(self):
+        converter = M2R()
+        src = StringIO('a <s>b</s>\n\n' + '[c] para\n\n' * 10 +
+                       '[c]: http://example.com/')
+        chunks = converter.iter_parse(src, chunk_size=1)
+        first = next(chunks)
+        self.assertEqual(converter('[a](b)'), '\n`a <b>`_\n')
+        self.assertEqual(first + ''.join(chunks),
+                         convert(src.getvalue()))
+
+
+class TestAsyncConvert(TestCase):
+    docs = ['# Title', '[a](b)', 'this is `$E = mc^2$` inline math.']
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def block_executor(self):
+        # occupy the only worker until tearDown
+        self.executor.submit(self.release.wait)
+
+    def test_aconvert(self):
+        config = M2RConfig(disable_inline_math=True)
+        out = asyncio.run(aconvert(self.docs[2], config, self.executor))
+        self.assertEqual(out, convert(self.docs[2], config))
+
+    def test_aconvert_many(self):
+        outputs = asyncio.run(aconvert_many(self.docs * 5, concurrency=2,
+                                            anonymous_references=True))
+        self.assertEqual(outputs, [convert(doc, anonymous_references=True)
+                                   for doc in self.docs * 5])
+
+    def test_process_executor(self):
+        with ProcessPoolExecutor(1) as executor:
+            out = asyncio.run(aconvert('# Title', executor=executor))
+        self.assertEqual(out, convert('# Title'))
+
+    def test_timeout(self):
+        self.block_executor()
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(aconvert_many(self.docs, executor=self.executor,
+                                      timeout=0.05))
+
+    def test_cancel(self):
+        async def cancel():
+            task = asyncio.ensure_future(
+                aconvert('# Title', executor=self.executor))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await task
+
+        self.block_executor()
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel())
+
+
+class TestConfig(TestCase):
+    def test_config(self):
+        config = M2RConfig(anonymous_references=True)
+        self.assertEqual(convert('[a](b)', config), '\n`a <b>`__\n')
+        self.assertEqual(convert('[a](b)'), '\n`a <b>`_\n')
+        with self.assertRaises(AttributeError):
+            config.anonymous_references = False
+
+    def test_keyword_overrides_config(self):
+        config = M2RConfig(anonymous_references=True)
+        out = convert('[a](b)', config, anonymous_references=False)
+        self.assertEqual(out, '\n`a <b>`_\n')
+
+    def test_argv_not_parsed(self):
+        with patch.object(sys, 'argv', ['m2r', '--anonymous-references']):
+            self.assertEqual(convert('[a](b)'), '\n`a <b>`_\n')
+
+    def test_shared_rules(self):
+        config = M2RConfig(no_underscore_emphasis=True,
+                           disable_inline_math=True)
+        first = M2R(config=config)
+        second = M2R(config=config)
+        self.assertIs(first.inline.default_rules,
+                      second.inline.default_rules)
+        self.assertNotIn('inline_math', first.inline.default_rules)
+        self.assertIs(first.inline.rules.emphasis,
+                      second.inline.rules.emphasis)
+        self.assertEqual(first('_a_ *b*'), '\n_a_ *b*\n')
+
+
+class TestProfile(TestCase):
+    def test_profile(self):
+        header = RestRenderer.header
+        with profile() as stats:
+            convert('# a\n\n## b\n\ntext **strong**\n')
+            self.assertIsNot(RestRenderer.header, header)
+        self.assertIs(RestRenderer.header, header)
+        self.assertEqual(stats.rules['block.heading'].hits, 2)
+        self.assertEqual(stats.rules['block.paragraph'].hits, 1)
+        self.assertEqual(stats.rules['inline.double_emphasis'].hits, 1)
+        self.assertGreater(stats.rules['inline.text'].attempts, 3)
+        self.assertEqual(stats.methods['RestRenderer.header'].calls, 2)
+        self.assertIn('block.heading', stats.report())
+
+    def test_not_nested(self):
+        with profile():
+            with self.assertRaises(RuntimeError):
+                with profile():
+                    pass
+
+
+class TestLinearTime(TestCase):
+    # inputs which took quadratic or worse time to match some rules
+    size = 20000
+    units = [':a ', 'a:', ':', '`$a', '`', '``a`', '_a', '**a', '~', '~~a ',
+             '|a']
+
+    def assertFast(self, src):
+        start = time.time()
+        convert(src)
+        self.assertLess(time.time() - start, 2, repr(src[:20]))
+
+    def test_inline(self):
+        for unit in self.units:
+            self.assertFast(unit * (self.size // len(unit)))
+
+    def test_image_link(self):
+        # mistune's link rules are tried at the same positions, and are not
+        # linear, so only the image link rule is tried here
+        src = '[![a](' * (self.size // 6)
+        start = time.time()
+        for i in range(len(src)):
+            RestInlineGrammar.image_link.match(src, i)
+        self.assertLess(time.time() - start, 2)
+
+    def test_footnote(self):
+        # the link rules are not linear on brackets either, so only the
+        # footnote rule is tried here
+        src = '[^a' * (self.size // 3)
+        rules = RestInlineGrammar()
+        rules.push(src)
+        start = time.time()
+        for i in range(len(src)):
+            rules.footnote.match(src[i:])
+        self.assertLess(time.time() - start, 2)
+
+    def test_spaces(self):
+        self.assertFast('a' + ' ' * self.size + 'b')
+
+    def test_directive(self):
+        self.assertFast('.. note::\n' + '\n' * self.size + 'a')
+
+    def test_fences(self):
+        self.assertFast('```\n' + '~' * self.size)
+        self.assertFast('```\na' + ' ' * self.size)
+        self.assertFast('~~~\n' + ' ' * self.size + 'a')
+
+
+class NonSeekableIO(StringIO):
+    def seekable(self):
+        return False
+
+
+class TestIterConvert(RendererTestBase):
+    src = '\n'.join([
+        '# Title',
+        '',
+        'Text with footnote[^1] and [ref][].',
+        '',
+        '* list 1',
+        '',
+        '* list 2',
+        '',
+        '.. note::',
+        '',
+        '   directive',
+        '',
+        'code::',
+        '',
+        '    code',
+        '',
+        '',
+        '<div>',
+        '',
+        'html',
+        '',
+        '</div>',
+        '',
+        '```',
+        'fenced',
+        '',
+        'code',
+        '```',
+        '',
+        '[ref]: http://example.com/',
+        '[^1]: note',
+    ])
+
+    def test_chunks(self):
+        src = self.src + '\n\n' + 'paragraph\n\n' * 20
+        chunks = list(iter_convert(StringIO(src), chunk_size=1))
+        self.assertGreater(len(chunks), 5)
+        output = ''.join(chunks)
+        self.assertEqual(output, self.conv(src))
+
+    def test_test_md(self):
+        with open(test_md) as f:
+            src = f.read()
+        with open(test_md) as f:
+            output = ''.join(iter_convert(f, chunk_size=1))
+        self.assertEqual(output, self.conv(src))
+
+    def test_raw_html_role(self):
+        src = 'first\n\n' + 'paragraph\n\n' * 6 + 'second <s>html</s>\n'
+        output = ''.join(iter_convert(StringIO(src), chunk_size=1))
+        self.assertTrue(output.startswith('\nfirst\n\nparagraph\n'))
+        self.assertIn('\n\n' + prolog, output)
+        self.assertTrue(
+            output.endswith('\nsecond :raw-html-m2r:`<s>html</s>`\n'))
+        self.check_rst(output)
+
+    def test_definitions_in_blocks(self):
+        # a setext heading, a definition in block html and a redefinition
+        for src in ['a[^f]\n\n[^f]: note\n---\n',
+                    '[a]\n\n<div>\n[a]: http://b.com\n</div>\n\n[a]\n',
+                    '[a]: http://1.com\n\n[a]\n\n[a]: http://2.com\n']:
+            output = ''.join(iter_convert(StringIO(src), chunk_size=1))
+            self.assertEqual(output, convert(src))
+
+    def test_blocks_continued_over_chunks(self):
+        # an empty list item, and unclosed html, fences and comments
+        for src in ['* \n\ny', '1. \n\nb', '<div></div\n\n</div>',
+                    '```\n```\n\n```', 'b\n<!--\n~~~-->\n\n~~~']:
+            output = ''.join(iter_convert(StringIO(src), chunk_size=1))
+            self.assertEqual(output, convert(src))
+
+    def test_non_seekable(self):
+        src = '[ref]: http://example.com/\n\nlink to [ref][]\n'
+        output = ''.join(iter_convert(NonSeekableIO(src), chunk_size=1))
+        self.assertEqual(output, convert(src))
+        # definitions after references are not resolved
+        src = 'footnote[^1]\n\n' + 'paragraph\n\n' * 6 + '[^1]: note\n'
+        output = ''.join(iter_convert(NonSeekableIO(src), chunk_size=1))
+        self.assertTrue(output.startswith('\nfootnote[^1]\n'))
+        self.assertNotIn('[#fn-1]', output)
+
+
+class TestSourceMap(RendererTestBase):
+    src = '\n'.join([
+        '# Title',
+        '',
+        'para',
+        'graph',
+        '',
+        '',
+        '* a',
+        '  * b',
+        '',
+        '```',
+        'code',
+        '```',
+        '',
+        'footnote[^1]',
+        '',
+        '[^1]: note',
+        '',
+    ])
+
+    def test_blocks(self):
+        output, source_map = M2R().parse_with_source_map(self.src)
+        self.assertEqual(output, convert(self.src))
+        self.assertEqual(source_map.blocks, [
+            (0, 1, 1, 3), (2, 4, 4, 6), (6, 8, 8, 11), (9, 12, 12, 15),
+            (13, 14, 16, 17),
+        ])
+        lines = output.splitlines()
+        self.assertEqual(lines[1:3], ['Title', '====='])
+        self.assertEqual(lines[4:6], ['para', 'graph'])
+        self.assertEqual(lines[14], '   code')
+
+    def test_raw_html_prolog(self):
+        output, source_map = M2R().parse_with_source_map('a\n\n<b>b</b>\n')
+        self.assertTrue(output.startswith(prolog))
+        offset = prolog.count('\n')
+        self.assertEqual(source_map.blocks,
+                         [(0, 1, offset + 1, offset + 2),
+                          (2, 3, offset + 3, offset + 4)])
+
+    def test_markdown_line(self):
+        source_map = SourceMap([(2, 4, 1, 2), (5, 6, 4, 7)])
+        self.assertEqual([source_map.markdown_line(i) for i in range(9)],
+                         [2, 2, 3, 3, 5, 5, 5, 5, 5])
+        self.assertEqual(source_map.markdown_lines(9),
+                         [2, 2, 3, 3, 5, 5, 5, 5, 5])
+        self.assertEqual(SourceMap().markdown_lines(2), [0, 0])
+
+    def test_string(self):
+        source_map = SourceMap([(0, 1, 1, 3), (2, 4, 4, 6)])
+        self.assertEqual(SourceMap.from_string(str(source_map)),
+                         source_map)
+        self.assertEqual(SourceMap.from_string(''), SourceMap())
+
+    def test_string_list(self):
+        output, source_map = M2R().parse_with_source_map(self.src)
+        lines = source_map.string_list(output, 'a.md')
+        self.assertEqual(list(lines), output.splitlines())
+        self.assertEqual(lines.info(lines.index('graph')), ('a.md', 3))
+        self.assertEqual(lines.info(lines.index('.. code-block::')),
+                         ('a.md', 9))
+
+    def test_string_list_line_breaks(self):
+        output, source_map = M2R().parse_with_source_map(
+            'a\x1cb\n\nc\n')
+        lines = source_map.string_list(output, 'a.md')
+        self.assertEqual(list(lines), ['', 'a', 'b', '', 'c'])
+        self.assertEqual([lines.offset(i) for i in range(5)],
+                         [0, 0, 0, 0, 2])
+
+
+class TestConversionSession(TestCase):
+    src = '\n'.join([
+        '# Title',
+        '',
+        'Text with footnote[^1] and [ref][].',
+        '',
+        '* list 1',
+        '* list 2',
+        '',
+        '```',
+        'code',
+        '```',
+        '',
+        '[ref]: http://example.com',
+        '',
+        '[^1]: note',
+        '',
+    ])
+
+    def edit(self, session, old, new):
+        offset = session.text.index(old)
+        rst = session.edit(offset, len(old), new)
+        self.assertEqual(rst, convert(session.text))
+        self.assertEqual(rst, session.output)
+        rst = session.edit(offset, len(new), old)
+        self.assertEqual(rst, convert(session.text))
+
+    def test_init(self):
+        self.assertEqual(ConversionSession(self.src).output,
+                         convert(self.src))
+        self.assertEqual(ConversionSession().output, '')
+
+    def test_edit(self):
+        session = ConversionSession(self.src)
+        self.edit(session, 'Text', 'Changed\n\n* text')
+        self.edit(session, 'list 2', 'list 2\n\n')
+        self.edit(session, 'code\n', 'code\n```\n')
+        self.edit(session, '# Title\n', '')
+        self.edit(session, '[^1]: note\n', '[^1]: note\n\nend\n')
+
+    def test_edit_characters(self):
+        session = ConversionSession(self.src)
+        for offset in range(len(self.src) + 1):
+            for inserted in ('\n', '`', '- ', '```\n', '[', '<div>\n'):
+                session.edit(offset, 0, inserted)
+                self.assertEqual(session.output, convert(session.text))
+                session.edit(offset, len(inserted), '')
+        self.assertEqual(session.output, convert(self.src))
+
+    def test_unclosed_fence(self):
+        session = ConversionSession('```\ntext\n\n* item\n\npara\n')
+        rst = session.edit(len(session.text), 0, '```\n')
+        self.assertIn('.. code-block::', rst)
+        self.assertEqual(rst, convert(session.text))
+
+    def test_link_definition(self):
+        session = ConversionSession(self.src)
+        rst = session.edit(self.src.index('example'), 7, 'python')
+        self.assertIn('`ref <http://python.com>`_', rst)
+        self.assertEqual(rst, convert(session.text))
+        rst = session.edit(0, 0, '[ref]: http://other.com\n\n')
+        self.assertEqual(rst, convert(session.text))
+        offset = session.text.index('[ref]: http://python')
+        rst = session.edit(offset, len('[ref]: http://python.com'), '')
+        self.assertIn('`ref <http://other.com>`_', rst)
+        self.assertEqual(rst, convert(session.text))
+
+    def test_footnotes(self):
+        session = ConversionSession(self.src)
+        self.edit(session, '[^1]: note', '[^1]: note\n[^1]: duplicate')
+        rst = session.edit(0, 0, 'first[^2]\n\n[^2]: other\n\n')
+        self.assertIn('.. [#fn-2] other', rst)
+        self.assertEqual(rst, convert(session.text))
+        offset = session.text.index('[^1]: note')
+        rst = session.edit(offset, len('[^1]: note'), '')
+        self.assertEqual(rst, convert(session.text))
+
+    def test_raw_html(self):
+        session = ConversionSession('a\n\nb\n')
+        rst = session.edit(1, 0, ' <b>c</b>')
+        self.assertTrue(rst.startswith(prolog))
+        self.assertEqual(rst, convert(session.text))
+        rst = session.edit(1, 9, '')
+        self.assertFalse(rst.startswith(prolog))
+        self.assertEqual(rst, convert(session.text))
+
+    def test_line_breaks(self):
+        session = ConversionSession('a\r\nb\r\n\r\nc\n')
+        self.edit(session, '\nb', '\r\n\tb')
+        session.edit(1, 0, '\r')
+        self.assertEqual(session.output, convert(session.text))
+
+    def test_out_of_text(self):
+        session = ConversionSession('text')
+        with self.assertRaises(ValueError):
+            session.edit(5, 0, 'a')
+        with self.assertRaises(ValueError):
+            session.edit(2, 3, '')
+        with self.assertRaises(ValueError):
+            session.edit(-1, 0, '')
+        self.assertEqual(session.text, 'text')
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+
+import os
+import re
+from os import path
+import shutil
+import tempfile
+from io import StringIO
+from unittest import TestCase, skipIf
+
+from docutils.io import FileInput
+
+try:
+    from sphinx.application import Sphinx
+    from sphinx.util.docutils import docutils_namespace
+except ImportError:
+    Sphinx = None
+
+import m2r
+from m2r import _LRUCache
+
+conf_py = '''\
+extensions = ['m2r']
+source_suffix = ['.rst', '.md']
+master_doc = 'index'
+exclude_patterns = ['_build', 'included.md']
+'''
+
+
+class TestLRUCache(TestCase):
+    def test_hit_and_miss(self):
+        cache = _LRUCache(10)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1, 5)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evict_least_recently_used(self):
+        cache = _LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.get('a')
+        cache.set('c', 3, 4)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.size, 8)
+
+    def test_too_large(self):
+        cache = _LRUCache(10)
+        cache.set('a', 1, 11)
+        self.assertEqual(len(cache), 0)
+
+    def test_resize(self):
+        cache = _LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.resize(5)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual((cache.maxsize, cache.size), (5, 4))
+
+
+class TestReadLines(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = path.join(self.dir, 'a.md')
+        self._step = m2r._LineIndex.step
+        m2r._LineIndex.step = 2  # test lines between indexed lines
+
+    def tearDown(self):
+        m2r._LineIndex.step = self._step
+        m2r._line_indexes.clear()
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        # a new version even in the same timestamp
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def assertLines(self, text, encoding='utf-8'):
+        self.write(text.encode(encoding))
+        lines = FileInput(source_path=self.path,
+                          encoding=encoding).readlines()
+        for start in (None, 0, 1, 2, 3, 5, -1, -4, 100):
+            for end in (None, 0, 1, 3, 4, 7, -1, -3, 100):
+                self.assertEqual(
+                    m2r._read_lines(self.path, start, end, encoding),
+                    ''.join(lines[start:end]), (text, start, end))
+
+    def test_lines(self):
+        self.assertLines('')
+        self.assertLines('a')
+        self.assertLines('a\nb\n\nc\nd\ne\nf')
+        self.assertLines('\n\n\n\n\n')
+
+    def test_line_ends(self):
+        self.assertLines('a\r\nb\rc\n\r\n\x0bd\x0c\x1c\x1de\x1e\n')
+        self.assertLines('\u00c5\x85\u2028\u2029\u2027\u20ac\r\r\n\n')
+
+    def test_bom(self):
+        self.assertLines('a\n\ufeffb\nc\n', 'utf-8-sig')
+        self.assertLines('\ufeffa\n\ufeffb\nc\n')
+
+    def test_changed(self):
+        self.assertLines('a\nb\nc\n')
+        self.assertLines('d\ne\n')
+        self.assertEqual(len(m2r._line_indexes), 1)
+
+    def test_other_encoding(self):
+        self.write('a\n'.encode('utf-16'))
+        self.assertIsNone(m2r._read_lines(self.path, 0, 1, 'utf-16'))
+
+
+@skipIf(Sphinx is None, 'sphinx is not installed')
+class SphinxTestBase(TestCase):
+    conf = conf_py
+
+    def setUp(self):
+        self.srcdir = tempfile.mkdtemp()
+        self.outdir = path.join(self.srcdir, '_build')
+        self.write('conf.py', self.conf)
+        m2r._mdinclude_cache.clear()
+        self._is_sphinx = m2r._is_sphinx
+
+    def tearDown(self):
+        # setup() of the extension switches m2r to sphinx mode
+        m2r._is_sphinx = self._is_sphinx
+        shutil.rmtree(self.srcdir)
+
+    def write(self, name, text):
+        with open(path.join(self.srcdir, name), 'w') as f:
+            f.write(text)
+
+    def build(self, buildername='pseudoxml', **kwargs):
+        status = StringIO()
+        warning = StringIO()
+        # nodes and directives registered by an app are removed after it
+        with docutils_namespace():
+            app = Sphinx(self.srcdir, self.srcdir, self.outdir,
+                         path.join(self.outdir, '.doctrees'), buildername,
+                         status=status, warning=warning, freshenv=True,
+                         **kwargs)
+            app.build()
+        return status.getvalue(), warning.getvalue()
+
+    def read(self, name):
+        with open(path.join(self.outdir, name + '.pseudoxml')) as f:
+            return f.read()
+
+
+class TestMdInclude(SphinxTestBase):
+    def test_cache(self):
+        self.write('included.md', '# Title\n\n**included**\n\nnext\n')
+        self.write('index.rst', '\n'.join([
+            'Index', '=====', '',
+            '.. toctree::', '', '   a', '   b', '',
+            '.. mdinclude:: included.md', '',
+        ]))
+        self.write('a.rst', 'A\n=\n\n.. mdinclude:: included.md\n')
+        self.write('b.md', '# B\n\n.. mdinclude:: included.md\n'
+                   '   :start-line: 2\n')
+        status, warning = self.build()
+        for name in ('included.md', 'b.md', 'mdinclude', 'm2r'):
+            self.assertNotIn(name, warning)
+        self.assertIn('mdinclude cache: 1 hits, 2 misses', status)
+        self.assertIn('<strong>', self.read('a'))
+        self.assertIn('<strong>', self.read('b'))
+        self.assertNotIn('Title', self.read('b'))
+
+    def test_cache_size(self):
+        self.write('included.md', '**included**\n')
+        self.write('index.rst', '.. mdinclude:: included.md\n')
+        status, _ = self.build(
+            confoverrides={'m2r_mdinclude_cache_size': 0})
+        self.assertEqual(m2r._mdinclude_cache.maxsize, 0)
+        self.assertNotIn('mdinclude cache', status)
+        self.build()
+        self.assertEqual(m2r._mdinclude_cache.maxsize, 16 * 1024 * 1024)
+        self.assertEqual(len(m2r._mdinclude_cache), 1)
+
+    def test_cache_invalidated(self):
+        self.write('included.md', 'first\n')
+        self.write('index.rst', '.. mdinclude:: included.md\n')
+        self.build()
+        self.assertIn('first', self.read('index'))
+        self.write('included.md', 'second text\n')
+        os.utime(path.join(self.srcdir, 'included.md'), (0, 0))
+        self.build()
+        self.assertIn('second text', self.read('index'))
+
+    def test_line_range(self):
+        self.write('included.md', 'l0\n\nl2\n\nl4\n')
+        self.write('index.rst', '.. mdinclude:: included.md\n'
+                   '   :start-line: 2\n   :end-line: 3\n')
+        self.build()
+        out = self.read('index')
+        self.assertIn('l2', out)
+        self.assertNotIn('l0', out)
+        self.assertNotIn('l4', out)
+
+
+class TestDocutilsParser(SphinxTestBase):
+    md = '\n'.join([
+        '# Title', '',
+        'Text with **strong**, *em*, `code` and :code:`role`.', '',
+        '* item', '  1. nested', '',
+        '> quote', '',
+        '```python', 'print(1)', '```', '',
+        'h1 | h2', '--- | ---', '1 | 2', '',
+        '| line', '| block', '',
+        '## Sub', '',
+        '[link](http://example.com) and footnote[^1].', '',
+        '[^1]: the note', '',
+        '.. note::', '   reST directive', '',
+    ])
+
+    def setUp(self):
+        super(TestDocutilsParser, self).setUp()
+        self.write('index.rst', 'Index\n=====\n\n.. toctree::\n\n   a\n')
+        self.write('a.md', self.md)
+
+    def test_nodes(self):
+        _, warning = self.build()
+        self.assertNotIn('a.md', warning)
+        out = self.read('a')
+        for node in ('<section ids="title"', '<section ids="sub"',
+                     '<strong>', '<emphasis>', '<literal classes="code"',
+                     '<enumerated_list', '<block_quote>',
+                     'language="python"', '<thead>', '<tbody>',
+                     '<line_block>', '<footnote_reference', '<note>'):
+            self.assertIn(node, out)
+
+    def test_strikethrough_html(self):
+        self.write('a.md', '~~x~~ and ~~*y*~~\n')
+        self.build('html')
+        with open(path.join(self.outdir, 'a.html')) as f:
+            out = f.read()
+        self.assertIn('<p><del>x</del> and <del><em>y</em></del></p>', out)
+
+    def test_same_as_rest_parser(self):
+        self.build()
+        out = self.read('a')
+        self.build(confoverrides={'m2r_rest_parser': True})
+        # the rest parser puts empty comments before block quotes
+        rest = re.sub(r' *<comment xml:space="preserve">\n', '',
+                      self.read('a'))
+        self.assertEqual(out, rest)
+
+
+class TestSourceLines(SphinxTestBase):
+    md = '\n'.join([
+        '# Title', '',
+        'text <b>html</b>', '',
+        '* item', '',
+        '.. unknown-directive:: x', '',
+        'A :unknown-role:`x` here', '',
+        'see `broken`_', '',
+    ])
+
+    def setUp(self):
+        super(TestSourceLines, self).setUp()
+        self.write('index.rst', '\n'.join([
+            'Index', '=====', '',
+            '.. toctree::', '', '   a', '',
+            '.. mdinclude:: included.md', '   :start-line: 2', '',
+        ]))
+        self.write('a.md', self.md)
+        self.write('included.md', self.md)
+
+    def assertLines(self, warning):
+        for name in ('a.md', 'included.md'):
+            # lines from the start of the file, including the skipped lines
+            for line, message in ((7, 'Unknown directive type'),
+                                  (9, 'Unknown interpreted text role'),
+                                  (11, 'Unknown target name')):
+                self.assertRegex(warning, r'{}:{}: ERROR: {}'.format(
+                    re.escape(name), line, message))
+
+    def test_docutils_parser(self):
+        _, warning = self.build()
+        self.assertLines(warning)
+
+    def test_rest_parser(self):
+        _, warning = self.build(confoverrides={'m2r_rest_parser': True})
+        self.assertLines(warning)
+
+    def test_cached(self):
+        overrides = {'m2r_rest_parser': True, 'm2r_rest_cache': True}
+        self.build(confoverrides=overrides)
+        m2r._mdinclude_cache.clear()
+        status, warning = self.build(confoverrides=overrides)
+        self.assertIn('conversion cache: 2 hits, 0 misses', status)
+        self.assertLines(warning)
+
+
+class TestConversionCache(SphinxTestBase):
+    conf = conf_py + 'm2r_rest_cache = True\n'
+
+    def setUp(self):
+        super(TestConversionCache, self).setUp()
+        self.write('included.md', '**included**\n')
+        docs = ['doc{}'.format(i) for i in range(6)]
+        self.write('index.rst', '\n'.join(
+            ['.. toctree::', ''] + ['   ' + doc for doc in docs] +
+            ['', '.. mdinclude:: included.md', '']))
+        for doc in docs:
+            self.write(doc + '.md', '# {}\n\n*text*\n'.format(doc))
+
+    def rebuild(self, **kwargs):
+        # a new process does not have the mdinclude cache in memory
+        m2r._mdinclude_cache.clear()
+        return self.build(**kwargs)
+
+    def test_mdinclude(self):
+        # .md files read by the default parser are not cached
+        status, _ = self.build()
+        self.assertIn('conversion cache: 0 hits, 1 misses', status)
+        out = self.read('index')
+        status, _ = self.rebuild()
+        self.assertIn('conversion cache: 1 hits, 0 misses', status)
+        self.assertEqual(self.read('index'), out)
+        self.assertTrue(os.path.isdir(
+            path.join(self.outdir, '.doctrees', 'm2r-cache')))
+
+    def test_changed(self):
+        self.build()
+        self.write('included.md', '**changed**\n')
+        status, _ = self.rebuild()
+        self.assertIn('conversion cache: 0 hits, 1 misses', status)
+        self.assertIn('changed', self.read('index'))
+
+    def test_parallel_rest_parser(self):
+        overrides = {'m2r_rest_parser': True}
+        status, _ = self.build(parallel=2, confoverrides=overrides)
+        self.assertIn('conversion cache: 0 hits, 7 misses', status)
+        out = self.read('doc3')
+        status, _ = self.rebuild(parallel=2, confoverrides=overrides)
+        self.assertIn('conversion cache: 7 hits, 0 misses', status)
+        self.assertEqual(self.read('doc3'), out)
+
+    def test_disabled(self):
+        status, _ = self.build(confoverrides={'m2r_rest_cache': False})
+        self.assertNotIn('conversion cache', status)
+        self.assertFalse(os.path.exists(
+            path.join(self.outdir, '.doctrees', 'm2r-cache')))